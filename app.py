@@ -1,20 +1,49 @@
 from fastapi import FastAPI
 from routing.auth import router as auth_router
-from routing.banner import router as banner_router
-from database.base import init_models
+from routing.banner import banner_service, router as banner_router
+from routing.health import router as health_router
+from routing.metrics import router as metrics_router
+from database.base import check_schema, Session
+from database.instrumentation import DbStatsMiddleware
+from database.redis import redis_client
+from services.banner_events import banner_event_subscriber
+from services.banner_index import banner_index
+from services.config import settings
+from services.metrics import MetricsMiddleware
 
 
 app = FastAPI()
+app.add_middleware(DbStatsMiddleware)
+if settings.METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware)
+    app.include_router(metrics_router)
 
 
 app.include_router(auth_router)
 app.include_router(banner_router)
+app.include_router(health_router)
 
 
 @app.on_event("startup")
 async def start():
-    pass
-    init_models()
+    if settings.DB_SCHEMA_CHECK:
+        await check_schema()
+    if settings.BANNER_INDEX_ENABLED:
+        if settings.BANNER_EVENTS_ENABLED:
+            #  Индекс строится подписчиком сразу после подписки на события
+            banner_event_subscriber.start(redis_client, Session)
+        else:
+            async with Session() as session:
+                await banner_index.build(session=session)
+    if settings.BANNER_WARMUP_SIZE:
+        #  Воркер начинает принимать запросы только после прогрева
+        async with Session() as session:
+            await banner_service.warm_up(session=session, redis_client=redis_client)
+
+
+@app.on_event("shutdown")
+async def stop():
+    await banner_event_subscriber.stop()
 
 
 if __name__ == "__main__":
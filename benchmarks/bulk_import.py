@@ -0,0 +1,94 @@
+"""
+Скорость POST /banner/bulk и GET /banner/export и пиковая память процесса.
+Тело импорта генерируется потоком, поэтому и на стороне клиента в памяти
+только одна пачка строк.
+
+Запуск: python -m benchmarks.bulk_import [--banners N] [--features F]
+"""
+import argparse
+import asyncio
+import json
+import resource
+import time
+from benchmarks.common import auth_headers, bench_client
+from schemas.banner import Feature, Tag
+
+
+async def ndjson_body(banners: int, features: int, chunk: int = 1000):
+    #  Баннер i -- тег i // features + 1 и фича i % features + 1
+    for start in range(0, banners, chunk):
+        yield "".join(
+            json.dumps({
+                "tag_ids": [i // features + 1],
+                "feature_id": i % features + 1,
+                "content": {"title": f"title {i}", "url": "https://example.com"},
+                "is_active": True,
+            }) + "\n"
+            for i in range(start, min(start + chunk, banners))
+        ).encode()
+
+
+def max_rss_mb():
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+async def run(args):
+    async with bench_client(args.database_url, args.redis_url) as (
+        session_maker, client
+    ):
+        tags = -(-args.banners // args.features)
+        async with session_maker() as session:
+            session.add_all([Tag() for _ in range(tags)])
+            session.add_all([Feature() for _ in range(args.features)])
+            await session.commit()
+        headers = await auth_headers(
+            session_maker, client, username="bench_admin", is_admin=True
+        )
+        rss_before = max_rss_mb()
+
+        started = time.perf_counter()
+        response = await client.post(
+            "/banner/bulk",
+            content=ndjson_body(args.banners, args.features),
+            headers=headers,
+            timeout=None,
+        )
+        elapsed = time.perf_counter() - started
+        assert response.status_code == 200, response.text
+        print(json.dumps({
+            "endpoint": "/banner/bulk",
+            **{key: response.json()[key] for key in ("created", "failed")},
+            "seconds": round(elapsed, 2),
+            "banners_per_s": round(args.banners / elapsed),
+            "max_rss_mb_before": rss_before,
+            "max_rss_mb": max_rss_mb(),
+        }))
+
+        started = time.perf_counter()
+        exported = 0
+        async with client.stream(
+                "GET", "/banner/export", headers=headers, timeout=None
+        ) as response:
+            async for _ in response.aiter_lines():
+                exported += 1
+        elapsed = time.perf_counter() - started
+        print(json.dumps({
+            "endpoint": "/banner/export",
+            "exported": exported,
+            "seconds": round(elapsed, 2),
+            "banners_per_s": round(exported / elapsed),
+            "max_rss_mb": max_rss_mb(),
+        }))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--banners", type=int, default=100_000)
+    parser.add_argument("--features", type=int, default=100)
+    parser.add_argument("--database-url", help="postgresql+asyncpg://... пустой бд")
+    parser.add_argument("--redis-url", help="redis://host:port/db, будет очищена")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Сравнение старого формата кеша (pickle ORM-объекта Banner) с текущим кодеком
+services.banner_cache: время обработки попадания в кеш до готового тела ответа
+и размер значения на один ключ.
+
+Запуск: python -m benchmarks.cache_codec [--iterations N]
+"""
+import argparse
+import asyncio
+import json
+import pickle
+import timeit
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import StaticPool
+from database.base import Base
+from schemas.banner import Banner, Tag, Feature
+from schemas.pydantic_models import BannerResponse
+from services.banner_cache import CachedBanner, encode_entry, decode_entry
+
+CONTENT = {
+    "title": "Скидка 30% на все товары",
+    "text": "Только до конца недели, успейте оформить заказ " * 3,
+    "url": "https://example.com/promo/summer?utm_source=banner",
+}
+
+
+async def load_banner():
+    engine = create_async_engine("sqlite+aiosqlite://", poolclass=StaticPool)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    async with async_sessionmaker(engine, expire_on_commit=False)() as session:
+        tags = [await Tag.add(session=session) for _ in range(5)]
+        feature = await Feature.add(session=session)
+        await Banner.add(
+            session=session, tags=tags, feature_id=feature.id, content=CONTENT
+        )
+        session.expunge_all()
+        banner = await Banner.get(
+            session=session, feature_id=feature.id, tag_id=tags[0].id
+        )
+    await engine.dispose()
+    return banner
+
+
+def pickle_hit(payload):
+    #  Старый путь: распаковка ORM-объекта и сериализация через response_model
+    banner = pickle.loads(payload)
+    _ = banner.is_active
+    return BannerResponse.model_validate(
+        banner, from_attributes=True
+    ).model_dump_json().encode()
+
+
+def codec_hit(payload):
+    entry = decode_entry(payload)
+    _ = entry.is_active
+    return entry.body
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=100_000)
+    args = parser.parse_args()
+
+    banner = asyncio.run(load_banner())
+    payloads = {
+        "pickle": pickle.dumps(banner),
+        "codec": encode_entry(CachedBanner.from_banner(banner)),
+    }
+    hits = {"pickle": pickle_hit, "codec": codec_hit}
+    for name, payload in payloads.items():
+        hit = hits[name]
+        seconds = min(timeit.repeat(
+            lambda: hit(payload), number=args.iterations, repeat=3
+        ))
+        print(json.dumps({
+            "format": name,
+            "bytes_per_key": len(payload),
+            "hit_us": round(seconds / args.iterations * 1e6, 3),
+        }))
+
+
+if __name__ == "__main__":
+    main()
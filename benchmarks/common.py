@@ -0,0 +1,146 @@
+import contextlib
+import os
+import statistics
+import tempfile
+import fakeredis
+import fakeredis.aioredis
+import httpx
+import redis.asyncio
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from app import app
+from database.base import Base, get_read_session, get_session
+from database.redis import get_redis
+from schemas.banner import Banner, BannerVersion, Tag, Feature
+from schemas.user import User
+
+
+@contextlib.asynccontextmanager
+async def bench_client(database_url: str = None, redis_url: str = None):
+    """
+    Приложение в процессе поверх SQLite (aiosqlite) и fakeredis, либо поверх
+    переданных Postgres/Redis (бд должна быть пустой, Redis будет очищен)
+    """
+    database_url = database_url or "sqlite+aiosqlite:///" + os.path.join(
+        tempfile.mkdtemp(), "bench.db"
+    )
+    engine = create_async_engine(database_url)
+    session_maker = async_sessionmaker(engine, expire_on_commit=False)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    if redis_url:
+        redis_client = redis.asyncio.Redis.from_url(redis_url)
+        await redis_client.flushdb()
+    else:
+        redis_client = fakeredis.aioredis.FakeRedis(server=fakeredis.FakeServer())
+
+    async def bench_session():
+        async with session_maker() as session:
+            yield session
+
+    async def bench_redis():
+        yield redis_client
+
+    app.dependency_overrides[get_session] = bench_session
+    app.dependency_overrides[get_read_session] = bench_session
+    app.dependency_overrides[get_redis] = bench_redis
+    transport = httpx.ASGITransport(app=app)
+    client = httpx.AsyncClient(transport=transport, base_url="http://bench")
+    try:
+        async with client:
+            yield session_maker, client
+    finally:
+        app.dependency_overrides.clear()
+        await engine.dispose()
+
+
+async def seed_banners(session_maker, banners: int):
+    #  Каждому баннеру своя пара (tag_id, feature_id) = (i, i)
+    async with session_maker() as session:
+        tags = [await Tag.add(session=session) for _ in range(banners)]
+        features = [await Feature.add(session=session) for _ in range(banners)]
+        for tag, feature in zip(tags, features):
+            await Banner.add(
+                session=session,
+                tags=[tag],
+                feature_id=feature.id,
+                content={"title": f"title {tag.id}", "url": "https://example.com"},
+            )
+
+
+def volume_pairs(tags: int, features: int, banners: int, tags_per_banner: int):
+    """
+    Детерминированная раскладка баннеров: баннер i получает фичу i % features
+    и очередные tags_per_banner тегов этой фичи, поэтому пары (фича, тег)
+    не повторяются. Возвращает [(feature_id, [tag_id, ...]), ...]
+    """
+    if banners > features * (tags // tags_per_banner):
+        raise ValueError("Недостаточно тегов и фич для стольких баннеров")
+    layout = []
+    for i in range(banners):
+        feature_index, slot = i % features, i // features
+        tag_ids = [slot * tags_per_banner + j + 1 for j in range(tags_per_banner)]
+        layout.append((feature_index + 1, tag_ids))
+    return layout
+
+
+async def seed_volume(
+        session_maker,
+        tags: int,
+        features: int,
+        banners: int,
+        tags_per_banner: int = 1,
+        chunk: int = 1000,
+):
+    """
+    Заливка через модели: баннеры, banner_lookup и первая версия пишутся
+    теми же методами, что и в сервисе, но одной транзакцией на пачку
+    """
+    async with session_maker() as session:
+        session.add_all([Tag() for _ in range(tags)])
+        session.add_all([Feature() for _ in range(features)])
+        await session.commit()
+        tag_objects = {tag.id: tag for tag in await Tag.all(session=session)}
+        layout = volume_pairs(tags, features, banners, tags_per_banner)
+        for start in range(0, banners, chunk):
+            batch = [
+                Banner(
+                    feature_id=feature_id,
+                    tags=[tag_objects[tag_id] for tag_id in tag_ids],
+                    content={
+                        "title": f"title {start + i}",
+                        "url": "https://example.com",
+                    },
+                    is_active=True,
+                )
+                for i, (feature_id, tag_ids) in enumerate(layout[start:start + chunk])
+            ]
+            session.add_all(batch)
+            await session.flush()
+            for banner in batch:
+                await banner.save_lookup(session=session)
+                await BannerVersion.save(session=session, banner=banner)
+            await session.commit()
+    return layout
+
+
+async def auth_headers(session_maker, client, username="bench", is_admin=False):
+    async with session_maker() as session:
+        await User.add(
+            session=session, username=username, password=username, is_admin=is_admin
+        )
+    response = await client.post(
+        "/token", data={"username": username, "password": username}
+    )
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+def summary(latencies: list[float], elapsed: float, **extra):
+    quantiles = statistics.quantiles(latencies, n=100)
+    return {
+        **extra,
+        "requests": len(latencies),
+        "rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(quantiles[49] * 1000, 2),
+        "p95_ms": round(quantiles[94] * 1000, 2),
+        "p99_ms": round(quantiles[98] * 1000, 2),
+    }
@@ -0,0 +1,62 @@
+"""
+Пропускная способность /user_banner под конкурентной нагрузкой.
+Приложение поднимается в процессе, запросы идут через httpx.ASGITransport.
+По умолчанию используются SQLite (aiosqlite) и fakeredis; выигрыш async-стека
+виден только на сетевых Postgres/Redis, их можно передать через
+--database-url/--redis-url (бд должна быть пустой, таблицы создаются скриптом).
+
+Запуск: python -m benchmarks.concurrency [--requests N] [--concurrency C]
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from benchmarks.common import auth_headers, bench_client, seed_banners, summary
+
+
+async def run(args):
+    async with bench_client(args.database_url, args.redis_url) as (
+        session_maker, client
+    ):
+        await seed_banners(session_maker, args.banners)
+        headers = await auth_headers(session_maker, client)
+        semaphore = asyncio.Semaphore(args.concurrency)
+        latencies = []
+
+        async def one():
+            pair = random.randint(1, args.banners)
+            url = (f"/user_banner?tag_id={pair}&feature_id={pair}"
+                   f"&use_last_revision={str(args.last_revision).lower()}")
+            async with semaphore:
+                started = time.perf_counter()
+                response = await client.get(url, headers=headers)
+                latencies.append(time.perf_counter() - started)
+                assert response.status_code == 200, response.text
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(args.requests)))
+        elapsed = time.perf_counter() - started
+
+    print(json.dumps(summary(
+        latencies,
+        elapsed,
+        endpoint="/user_banner",
+        use_last_revision=args.last_revision,
+        concurrency=args.concurrency,
+    )))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--banners", type=int, default=100)
+    parser.add_argument("--last-revision", action="store_true")
+    parser.add_argument("--database-url", help="postgresql+asyncpg://... пустой бд")
+    parser.add_argument("--redis-url", help="redis://host:port/db, будет очищена")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
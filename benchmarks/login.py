@@ -0,0 +1,73 @@
+"""
+Пропускная способность /token и задержка чтения /user_banner во время
+всплеска логинов: bcrypt прямо в event loop (--workers 0) против пула потоков.
+
+Запуск: python -m benchmarks.login [--logins N] [--concurrency C] [--rounds R]
+"""
+import argparse
+import asyncio
+import json
+import time
+import schemas.user
+from benchmarks.common import auth_headers, bench_client, seed_banners, summary
+from services.password import PasswordHasher
+
+
+async def run(args, workers: int):
+    schemas.user.password_hasher = PasswordHasher(
+        workers=workers, queue_size=args.logins, rounds=args.rounds
+    )
+    async with bench_client() as (session_maker, client):
+        await seed_banners(session_maker, 10)
+        headers = await auth_headers(session_maker, client)
+        login_latencies, read_latencies = [], []
+        semaphore = asyncio.Semaphore(args.concurrency)
+        burst_done = asyncio.Event()
+
+        async def login():
+            async with semaphore:
+                started = time.perf_counter()
+                response = await client.post(
+                    "/token", data={"username": "bench", "password": "bench"}
+                )
+                login_latencies.append(time.perf_counter() - started)
+                assert response.status_code == 200, response.text
+
+        async def reader():
+            while not burst_done.is_set():
+                started = time.perf_counter()
+                await client.get("/user_banner?tag_id=1&feature_id=1", headers=headers)
+                read_latencies.append(time.perf_counter() - started)
+                await asyncio.sleep(0.005)
+
+        reader_task = asyncio.create_task(reader())
+        started = time.perf_counter()
+        await asyncio.gather(*(login() for _ in range(args.logins)))
+        elapsed = time.perf_counter() - started
+        burst_done.set()
+        await reader_task
+
+    read_summary = summary(read_latencies, elapsed)
+    print(json.dumps({
+        **summary(login_latencies, elapsed, endpoint="/token", workers=workers),
+        "banner_read_p50_ms": read_summary["p50_ms"],
+        "banner_read_p99_ms": read_summary["p99_ms"],
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--logins", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--rounds", type=int, default=12)
+    parser.add_argument(
+        "--workers", type=int, nargs="+", default=[0, 4],
+        help="размеры пула; 0 -- хеширование в event loop",
+    )
+    args = parser.parse_args()
+    for workers in args.workers:
+        asyncio.run(run(args, workers))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Накладные расходы сбора метрик на горячем пути /user_banner (ответ из кеша):
+одни и те же запросы с метриками (middleware, счетчики кеша, события бд)
+и без них. Режимы чередуются по раундам, в итоге -- медианы по раундам.
+
+Запуск: python -m benchmarks.metrics_overhead [--requests N] [--rounds R]
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+import services.banner
+from app import app
+from benchmarks.common import auth_headers, bench_client, seed_banners
+from database.instrumentation import DbStatsMiddleware, instrument_engine
+from services.metrics import BANNER_CACHE_REQUESTS, MetricsMiddleware
+
+
+class NullCounter:
+    def labels(self, **labels):
+        return self
+
+    def inc(self, amount=1):
+        pass
+
+
+def set_metrics(enabled: bool, middleware):
+    #  Стек middleware собирается заново при следующем запросе
+    app.user_middleware = middleware if enabled else [
+        item for item in middleware
+        if item.cls not in (MetricsMiddleware, DbStatsMiddleware)
+    ]
+    app.middleware_stack = None
+    services.banner.BANNER_CACHE_REQUESTS = (
+        BANNER_CACHE_REQUESTS if enabled else NullCounter()
+    )
+
+
+async def run(args):
+    middleware = list(app.user_middleware)
+    async with bench_client() as (session_maker, client):
+        instrument_engine(session_maker.kw["bind"])
+        await seed_banners(session_maker, args.banners)
+        headers = await auth_headers(session_maker, client)
+        urls = [
+            f"/user_banner?tag_id={i}&feature_id={i}"
+            for i in range(1, args.banners + 1)
+        ]
+        for url in urls:
+            await client.get(url, headers=headers)
+
+        async def one_round():
+            latencies = []
+            for i in range(args.requests):
+                started = time.perf_counter()
+                response = await client.get(urls[i % len(urls)], headers=headers)
+                latencies.append(time.perf_counter() - started)
+                assert response.status_code == 200, response.text
+            return statistics.mean(latencies), statistics.quantiles(latencies, n=100)
+
+        results = {True: [], False: []}
+        try:
+            for round_number in range(args.rounds):
+                #  Порядок режимов меняется, чтобы прогрев не давал преимущества
+                for enabled in (True, False)[::1 if round_number % 2 else -1]:
+                    set_metrics(enabled, middleware)
+                    results[enabled].append(await one_round())
+        finally:
+            set_metrics(True, middleware)
+
+    for enabled, rounds in results.items():
+        print(json.dumps({
+            "endpoint": "/user_banner",
+            "metrics": enabled,
+            "requests": args.requests * args.rounds,
+            "mean_us": round(statistics.median(r[0] for r in rounds) * 1e6, 1),
+            "p50_us": round(statistics.median(r[1][49] for r in rounds) * 1e6, 1),
+            "p99_us": round(statistics.median(r[1][98] for r in rounds) * 1e6, 1),
+        }))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--banners", type=int, default=100)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
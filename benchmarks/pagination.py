@@ -0,0 +1,99 @@
+"""
+Задержка GET /banner для первой и далекой страницы: LIMIT/OFFSET против
+курсора (after). Баннеры заливаются пачками напрямую в таблицы.
+
+Запуск: python -m benchmarks.pagination [--banners N] [--page P] [--limit L]
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from database.base import Base
+from schemas.banner import Banner, Feature, Tag, banner_lookup, banner_tag
+
+FEATURES = 10
+CHUNK = 10_000
+
+
+async def seed(engine, banners: int):
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.execute(insert(Feature), [{"id": i} for i in range(1, FEATURES + 1)])
+        for start in range(1, banners + 1, CHUNK):
+            ids = range(start, min(start + CHUNK, banners + 1))
+            await conn.execute(insert(Tag), [{"id": i} for i in ids])
+            await conn.execute(insert(Banner), [
+                {
+                    "id": i,
+                    "feature_id": i % FEATURES + 1,
+                    "content": {"title": f"title {i}"},
+                    "is_active": True,
+                }
+                for i in ids
+            ])
+            await conn.execute(
+                insert(banner_tag), [{"banner_id": i, "tag_id": i} for i in ids]
+            )
+            await conn.execute(insert(banner_lookup), [
+                {"feature_id": i % FEATURES + 1, "tag_id": i, "banner_id": i}
+                for i in ids
+            ])
+
+
+async def timed(session_maker, repeat: int, **kwargs):
+    best = None
+    for _ in range(repeat):
+        async with session_maker() as session:
+            started = time.perf_counter()
+            banners = await Banner.get_by_one_tag_and_feature(session=session, **kwargs)
+            elapsed = time.perf_counter() - started
+        assert banners
+        best = elapsed if best is None else min(best, elapsed)
+    return round(best * 1000, 2)
+
+
+async def run(args):
+    database_url = args.database_url or "sqlite+aiosqlite:///" + os.path.join(
+        tempfile.mkdtemp(), "pagination.db"
+    )
+    engine = create_async_engine(database_url)
+    await seed(engine, args.banners)
+    session_maker = async_sessionmaker(engine, expire_on_commit=False)
+    for feature_id in (None, 1):
+        #  Для фильтра по фиче id идут с шагом FEATURES
+        step = FEATURES if feature_id else 1
+        skipped = (args.page - 1) * args.limit
+        result = {"banners": args.banners, "limit": args.limit, "page": args.page,
+                  "feature_id": feature_id}
+        for page, offset, after_id in (
+                (1, None, None),
+                (args.page, skipped, skipped * step),
+        ):
+            result[f"offset_page{page}_ms"] = await timed(
+                session_maker, args.repeat,
+                feature_id=feature_id, limit=args.limit, offset=offset,
+            )
+            result[f"cursor_page{page}_ms"] = await timed(
+                session_maker, args.repeat,
+                feature_id=feature_id, limit=args.limit, after_id=after_id,
+            )
+        print(json.dumps(result))
+    await engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--banners", type=int, default=1_000_000)
+    parser.add_argument("--page", type=int, default=1000)
+    parser.add_argument("--limit", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--database-url", help="postgresql+asyncpg://... пустой бд")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
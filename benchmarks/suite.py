@@ -0,0 +1,280 @@
+"""
+Набор сценариев нагрузки на сервис баннеров. Заливает заданный объем тегов,
+фич и баннеров через модели, затем гоняет каждый сценарий с заданной
+конкурентностью и печатает по строке JSON на сценарий (rps, p50/p95/p99,
+число ошибок). С --output строки дописываются в файл, с --baseline
+печатается сравнение с прошлым прогоном.
+По умолчанию SQLite (aiosqlite) и fakeredis, либо --database-url/--redis-url
+(бд должна быть пустой, Redis будет очищен).
+
+Сценарии: user_banner, user_banner_last_revision, user_banner_batch, banners,
+token, create_banner, update_banner, delete_banner
+
+Запуск: python -m benchmarks.suite [--scenarios a,b] [--requests N]
+    [--concurrency C] [--tags T] [--features F] [--banners B]
+"""
+import argparse
+import asyncio
+import json
+import random
+import subprocess
+import time
+import schemas.user
+from benchmarks.common import auth_headers, bench_client, seed_volume, summary
+from schemas.banner import Banner, Tag
+from services.password import PasswordHasher
+
+
+class SuiteContext:
+    def __init__(self, args, layout, user_headers, admin_headers):
+        self.args = args
+        #  [(feature_id, [tag_id, ...]), ...], id баннера -- индекс + 1
+        self.layout = layout
+        self.user_headers = user_headers
+        self.admin_headers = admin_headers
+        self.random = random.Random(args.seed)
+        self.free_tags = []
+        self.banners_to_delete = []
+
+    def random_pair(self):
+        feature_id, tag_ids = self.random.choice(self.layout)
+        return self.random.choice(tag_ids), feature_id
+
+
+async def new_tags(session_maker, count: int) -> list[int]:
+    async with session_maker() as session:
+        tags = [Tag() for _ in range(count)]
+        session.add_all(tags)
+        await session.commit()
+        return [tag.id for tag in tags]
+
+
+async def prepare_create_banner(ctx, session_maker):
+    #  У каждого нового баннера свой новый тег, поэтому пары не заняты
+    ctx.free_tags = await new_tags(session_maker, ctx.args.requests)
+
+
+async def prepare_delete_banner(ctx, session_maker):
+    tag_ids = await new_tags(session_maker, ctx.args.requests)
+    async with session_maker() as session:
+        for tag_id in tag_ids:
+            banner = await Banner.add(
+                session=session,
+                tags=[await session.get(Tag, tag_id)],
+                feature_id=1,
+                content={"title": "to delete"},
+            )
+            ctx.banners_to_delete.append(banner.id)
+
+
+def user_banner(ctx, client, i):
+    tag_id, feature_id = ctx.random_pair()
+    return client.get(
+        f"/user_banner?tag_id={tag_id}&feature_id={feature_id}",
+        headers=ctx.user_headers,
+    )
+
+
+def user_banner_last_revision(ctx, client, i):
+    tag_id, feature_id = ctx.random_pair()
+    return client.get(
+        f"/user_banner?tag_id={tag_id}&feature_id={feature_id}"
+        f"&use_last_revision=true",
+        headers=ctx.user_headers,
+    )
+
+
+def user_banner_batch(ctx, client, i):
+    items = []
+    for _ in range(ctx.args.batch_size):
+        tag_id, feature_id = ctx.random_pair()
+        items.append({"tag_id": tag_id, "feature_id": feature_id})
+    return client.post(
+        "/user_banner/batch",
+        json={"items": items},
+        headers=ctx.user_headers,
+    )
+
+
+def banners(ctx, client, i):
+    feature_id = ctx.random.randint(1, ctx.args.features)
+    return client.get(
+        f"/banner?feature_id={feature_id}&limit={ctx.args.page_size}",
+        headers=ctx.admin_headers,
+    )
+
+
+def token(ctx, client, i):
+    return client.post("/token", data={"username": "bench", "password": "bench"})
+
+
+def create_banner(ctx, client, i):
+    return client.post(
+        "/banner",
+        json={
+            "tag_ids": [ctx.free_tags[i]],
+            "feature_id": ctx.random.randint(1, ctx.args.features),
+            "content": {"title": f"created {i}"},
+            "is_active": True,
+        },
+        headers=ctx.admin_headers,
+    )
+
+
+def update_banner(ctx, client, i):
+    #  Разные баннеры на соседних запросах, чтобы не ловить гонку версий
+    banner_id = i % len(ctx.layout) + 1
+    return client.patch(
+        f"/banner/{banner_id}",
+        json={"content": {"title": f"updated {i}"}},
+        headers=ctx.admin_headers,
+    )
+
+
+def delete_banner(ctx, client, i):
+    return client.delete(
+        f"/banner/{ctx.banners_to_delete[i]}",
+        headers=ctx.admin_headers,
+    )
+
+
+#  Сценарий: (запрос, ожидаемый статус, подготовка вне замера)
+SCENARIOS = {
+    "user_banner": (user_banner, 200, None),
+    "user_banner_last_revision": (user_banner_last_revision, 200, None),
+    "user_banner_batch": (user_banner_batch, 200, None),
+    "banners": (banners, 200, None),
+    "token": (token, 200, None),
+    "create_banner": (create_banner, 201, prepare_create_banner),
+    "update_banner": (update_banner, 200, None),
+    "delete_banner": (delete_banner, 204, prepare_delete_banner),
+}
+
+
+async def drive(ctx, client, request, expected_status: int):
+    semaphore = asyncio.Semaphore(ctx.args.concurrency)
+    latencies, errors = [], 0
+
+    async def one(i):
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            response = await request(ctx, client, i)
+            latencies.append(time.perf_counter() - started)
+            if response.status_code != expected_status:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(ctx.args.requests)))
+    return latencies, time.perf_counter() - started, errors
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: list[dict], baseline_path: str):
+    #  Из прошлых прогонов берется последний результат каждого сценария
+    baseline = {}
+    with open(baseline_path) as file:
+        for raw in file:
+            if raw.strip():
+                line = json.loads(raw)
+                baseline[line["scenario"]] = line
+    for result in results:
+        old = baseline.get(result["scenario"])
+        if old is None:
+            continue
+        print(json.dumps({
+            "scenario": result["scenario"],
+            "baseline_commit": old.get("commit"),
+            "rps_ratio": round(result["rps"] / old["rps"], 3),
+            "p95_ratio": round(result["p95_ms"] / old["p95_ms"], 3),
+            "p99_ratio": round(result["p99_ms"] / old["p99_ms"], 3),
+        }))
+
+
+async def run(args):
+    schemas.user.password_hasher = PasswordHasher(
+        workers=args.hash_workers,
+        queue_size=args.requests,
+        rounds=args.bcrypt_rounds,
+    )
+    names = args.scenarios.split(",") if args.scenarios else list(SCENARIOS)
+    unknown = set(names) - set(SCENARIOS)
+    if unknown:
+        raise SystemExit(f"Неизвестные сценарии: {', '.join(sorted(unknown))}")
+    results = []
+    async with bench_client(args.database_url, args.redis_url) as (
+        session_maker, client
+    ):
+        layout = await seed_volume(
+            session_maker,
+            tags=args.tags,
+            features=args.features,
+            banners=args.banners,
+            tags_per_banner=args.tags_per_banner,
+        )
+        ctx = SuiteContext(
+            args,
+            layout,
+            user_headers=await auth_headers(session_maker, client),
+            admin_headers=await auth_headers(
+                session_maker, client, username="bench_admin", is_admin=True
+            ),
+        )
+        commit = git_commit()
+        for name in names:
+            request, expected_status, prepare = SCENARIOS[name]
+            if prepare is not None:
+                await prepare(ctx, session_maker)
+            latencies, elapsed, errors = await drive(
+                ctx, client, request, expected_status
+            )
+            results.append(summary(
+                latencies,
+                elapsed,
+                scenario=name,
+                commit=commit,
+                concurrency=args.concurrency,
+                banners=args.banners,
+                errors=errors,
+            ))
+            print(json.dumps(results[-1]), flush=True)
+    if args.output:
+        with open(args.output, "a") as file:
+            for result in results:
+                file.write(json.dumps(result) + "\n")
+    if args.baseline:
+        compare(results, args.baseline)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scenarios", help="через запятую, по умолчанию все")
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--tags", type=int, default=1000)
+    parser.add_argument("--features", type=int, default=100)
+    parser.add_argument("--banners", type=int, default=10000)
+    parser.add_argument("--tags-per-banner", type=int, default=3)
+    parser.add_argument("--batch-size", type=int, default=10)
+    parser.add_argument("--page-size", type=int, default=20)
+    parser.add_argument("--bcrypt-rounds", type=int, default=12)
+    parser.add_argument("--hash-workers", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--database-url", help="postgresql+asyncpg://... пустой бд")
+    parser.add_argument("--redis-url", help="redis://host:port/db, будет очищена")
+    parser.add_argument("--output", help="дописать результаты в файл JSON lines")
+    parser.add_argument("--baseline", help="файл JSON lines прошлого прогона")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
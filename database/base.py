@@ -1,21 +1,95 @@
+import os
+from alembic.config import Config
+from alembic.runtime.migration import MigrationContext
+from alembic.script import ScriptDirectory
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import declarative_base, sessionmaker
+from database.instrumentation import (
+    TimedAsyncQueuePool,
+    TimedQueuePool,
+    instrument_engine,
+)
+from database.replica import Replica, RoutingSession
 from services.config import settings
 
-engine = create_engine(settings.DATABASE_URL, echo=False)
+
+def pool_options(name: str) -> dict:
+    return {
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "pool_timeout": settings.DB_POOL_TIMEOUT,
+        "pool_recycle": settings.DB_POOL_RECYCLE,
+        "pool_pre_ping": settings.DB_POOL_PRE_PING,
+        "pool_logging_name": name,
+    }
+
+
+engine = create_async_engine(
+    settings.DATABASE_URL,
+    echo=False,
+    poolclass=TimedAsyncQueuePool,
+    **pool_options("main"),
+)
+instrument_engine(engine)
 Base = declarative_base()
-Session = sessionmaker(engine, expire_on_commit=False)
+Session = async_sessionmaker(engine, expire_on_commit=False)
+
+replica = None
+if settings.REPLICA_DATABASE_URL:
+    replica_engine = create_async_engine(
+        settings.REPLICA_DATABASE_URL,
+        echo=False,
+        poolclass=TimedAsyncQueuePool,
+        connect_args={"timeout": settings.DB_REPLICA_CONNECT_TIMEOUT},
+        **pool_options("replica"),
+    )
+    instrument_engine(replica_engine)
+    replica = Replica(replica_engine, settings.DB_REPLICA_RETRY_SECONDS)
+#  Сессия для чтения: реплика, если она задана и доступна, иначе основная бд
+ReadSession = async_sessionmaker(
+    engine,
+    expire_on_commit=False,
+    sync_session_class=RoutingSession,
+    info={"replica": replica},
+)
+
+#  Синхронный движок для задач Celery
+sync_engine = create_engine(
+    settings.SYNC_DATABASE_URL,
+    echo=False,
+    poolclass=TimedQueuePool,
+    **pool_options("celery"),
+)
+instrument_engine(sync_engine)
+SyncSession = sessionmaker(sync_engine, expire_on_commit=False)
 
 
-def init_models():
-    with engine.begin() as conn:
-        Base.metadata.drop_all(conn)
-        Base.metadata.create_all(conn)
+ALEMBIC_INI = os.path.join(os.path.dirname(os.path.dirname(__file__)), "alembic.ini")
+
+
+async def check_schema(db_engine=engine):
+    """
+    Проверяет, что бд мигрирована до последней ревизии, ничего в ней не меняя.
+    Миграции применяются отдельно: alembic upgrade head
+    """
+    expected = set(ScriptDirectory.from_config(Config(ALEMBIC_INI)).get_heads())
+    async with db_engine.connect() as conn:
+        current = set(await conn.run_sync(
+            lambda sync_conn: MigrationContext.configure(sync_conn).get_current_heads()
+        ))
+    if current != expected:
+        raise RuntimeError(
+            f"Ревизия бд {sorted(current)} вместо {sorted(expected)}, "
+            f"выполните alembic upgrade head"
+        )
+
+
+async def get_session() -> AsyncSession:
+    async with Session() as session:
+        yield session
 
 
-def get_session() -> Session:
-    session = Session()
-    try:
+async def get_read_session() -> AsyncSession:
+    async with ReadSession() as session:
         yield session
-    finally:
-        session.close()
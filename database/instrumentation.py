@@ -0,0 +1,157 @@
+import time
+from contextvars import ContextVar
+from prometheus_client import Gauge, Histogram
+from sqlalchemy import event
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+
+POOL_CHECKOUT_WAIT = Histogram(
+    "db_pool_checkout_wait_seconds",
+    "Время получения соединения из пула",
+    ["pool"],
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+#  С PROMETHEUS_MULTIPROC_DIR значения воркеров складываются (livesum)
+POOL_SIZE = Gauge(
+    "db_pool_size",
+    "Размер пула соединений",
+    ["pool"],
+    multiprocess_mode="livesum",
+)
+POOL_CHECKED_OUT = Gauge(
+    "db_pool_checked_out",
+    "Выданные соединения",
+    ["pool"],
+    multiprocess_mode="livesum",
+)
+POOL_OVERFLOW = Gauge(
+    "db_pool_overflow",
+    "Соединения сверх размера пула",
+    ["pool"],
+    multiprocess_mode="livesum",
+)
+REQUEST_DB_QUERIES = Histogram(
+    "db_request_queries",
+    "Число запросов в бд за один http-запрос",
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100),
+)
+REQUEST_DB_SECONDS = Histogram(
+    "db_request_seconds",
+    "Время в бд за один http-запрос",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+
+#  Счетчик запросов текущего http-запроса, None -- вне запроса
+_db_stats: ContextVar = ContextVar("db_stats", default=None)
+
+
+class TimedPoolMixin:
+    """
+    Замеряет время получения соединения из пула, включая ожидание
+    свободного соединения, pre_ping и открытие нового.
+    Состояние пула записывается в gauge после каждой выдачи и возврата
+    соединения, а не читается при сборе метрик: в режиме
+    PROMETHEUS_MULTIPROC_DIR собираются только записанные значения
+    """
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            return super().connect()
+        finally:
+            POOL_CHECKOUT_WAIT.labels(pool=self.logging_name).observe(
+                time.perf_counter() - start
+            )
+            self._publish_state()
+
+    def _do_return_conn(self, record):
+        try:
+            super()._do_return_conn(record)
+        finally:
+            self._publish_state()
+
+    def _publish_state(self):
+        POOL_SIZE.labels(pool=self.logging_name).set(self.size())
+        POOL_CHECKED_OUT.labels(pool=self.logging_name).set(self.checkedout())
+        POOL_OVERFLOW.labels(pool=self.logging_name).set(max(self.overflow(), 0))
+
+
+class TimedAsyncQueuePool(TimedPoolMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+class TimedQueuePool(TimedPoolMixin, QueuePool):
+    pass
+
+
+class DbStats:
+    __slots__ = ("queries", "seconds")
+
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+
+    def server_timing(self) -> str:
+        return f'db;dur={self.seconds * 1000:.1f};desc="{self.queries} queries"'
+
+
+def instrument_engine(engine):
+    """
+    Подписывает движок (sync или async) на учет запросов в DbStats.
+    Состояние пула публикуют TimedAsyncQueuePool и TimedQueuePool
+    """
+    sync_engine = getattr(engine, "sync_engine", engine)
+    event.listen(sync_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(sync_engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(sync_engine, "handle_error", _handle_error)
+    if isinstance(sync_engine.pool, TimedPoolMixin):
+        sync_engine.pool._publish_state()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+    stats = _db_stats.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.seconds += elapsed
+
+
+def _handle_error(exception_context):
+    starts = exception_context.connection and exception_context.connection.info.get(
+        "query_start"
+    )
+    if starts:
+        starts.pop()
+
+
+class DbStatsMiddleware:
+    """
+    Считает число и время запросов в бд за http-запрос. Итог пишется
+    в гистограммы и в заголовок Server-Timing ответа
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        stats = DbStats()
+        token = _db_stats.set(stats)
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", stats.server_timing().encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _db_stats.reset(token)
+            REQUEST_DB_QUERIES.observe(stats.queries)
+            REQUEST_DB_SECONDS.observe(stats.seconds)
@@ -1,10 +1,25 @@
 import redis
+import redis.asyncio
 from services.config import settings
 
-redis_client = redis.Redis(
+redis_client = redis.asyncio.Redis(
+    host=settings.REDIS_HOST, port=settings.REDIS_PORT, db=settings.REDIS_CACHE_DB
+)
+#  Синхронный клиент для задач Celery
+sync_redis_client = redis.Redis(
     host=settings.REDIS_HOST, port=settings.REDIS_PORT, db=settings.REDIS_CACHE_DB
 )
 
 
-def get_redis():
+#  Брокер Celery, для проверки готовности
+broker_redis_client = redis.asyncio.Redis(
+    host=settings.REDIS_HOST, port=settings.REDIS_PORT, db=settings.REDIS_CELERY_DB
+)
+
+
+async def get_redis():
     yield redis_client
+
+
+async def get_broker_redis():
+    yield broker_redis_client
@@ -0,0 +1,65 @@
+import time
+from prometheus_client import Counter
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import Session
+
+
+REPLICA_FAILOVERS = Counter(
+    "db_replica_failovers",
+    "Переключения чтения с недоступной реплики на основную бд",
+)
+
+
+class Replica:
+    """
+    Движок реплики для чтения. Если к реплике не удалось подключиться,
+    чтение на retry_seconds уходит в основную бд
+    """
+    def __init__(self, engine, retry_seconds: float):
+        self.engine = engine
+        self.retry_seconds = retry_seconds
+        self._down_until = 0.0
+
+    @property
+    def available(self) -> bool:
+        return time.monotonic() >= self._down_until
+
+    def mark_down(self):
+        self._down_until = time.monotonic() + self.retry_seconds
+        REPLICA_FAILOVERS.inc()
+
+
+class RoutingSession(Session):
+    """
+    Сессия, которая читает с реплики из info["replica"], а пишет в основную
+    бд (bind). В основную бд уходит и чтение после use_primary -- когда
+    запросу нужно видеть свои же или только что сделанные изменения
+    """
+    def get_bind(self, mapper=None, *, clause=None, **kwargs):
+        replica = self.info.get("replica")
+        if (
+            replica is None
+            or self._flushing
+            or self.info.get("use_primary")
+            or not replica.available
+        ):
+            return super().get_bind(mapper, clause=clause, **kwargs)
+        return replica.engine.sync_engine
+
+    def _connection_for_bind(self, engine, execution_options=None, **kwargs):
+        try:
+            return super()._connection_for_bind(engine, execution_options, **kwargs)
+        except (DBAPIError, OSError):
+            #  Реплика недоступна -- запрос повторяется на основной бд
+            replica = self.info.get("replica")
+            if replica is None or engine is not replica.engine.sync_engine:
+                raise
+            replica.mark_down()
+            return super()._connection_for_bind(
+                self.bind, execution_options, **kwargs
+            )
+
+
+def use_primary(session):
+    #  Вызывается до первого запроса сессии
+    session.info["use_primary"] = True
@@ -0,0 +1,126 @@
+"""banner lookup and versions
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 17:42:05.318204
+
+Версия баннера и история версий, первичный ключ banner_tag, таблица
+banner_lookup для поиска баннера по паре (фича, тег) и индекс для
+постраничного вывода баннеров фичи. Существующие баннеры получают
+версию 1, banner_lookup заполняется из banner_tag
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0002'
+down_revision: Union[str, Sequence[str], None] = '0001'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    with op.batch_alter_table('banners') as batch_op:
+        batch_op.add_column(
+            sa.Column('version', sa.Integer(), server_default='1', nullable=False)
+        )
+    op.create_index(
+        'ix_banners_feature_id_id', 'banners', ['feature_id', 'id'], unique=False
+    )
+
+    #  Повторы и неполные строки banner_tag без ключа не переносятся
+    rebuild_banner_tag(primary_key=True, rows_query=(
+        'SELECT DISTINCT banner_id, tag_id FROM banner_tag '
+        'WHERE banner_id IS NOT NULL AND tag_id IS NOT NULL'
+    ))
+
+    op.create_table(
+        'banner_lookup',
+        sa.Column('feature_id', sa.Integer(), nullable=False),
+        sa.Column('tag_id', sa.Integer(), nullable=False),
+        sa.Column('banner_id', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['banner_id'], ['banners.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['feature_id'], ['features.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['tag_id'], ['tags.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('feature_id', 'tag_id'),
+    )
+    op.create_index(
+        op.f('ix_banner_lookup_banner_id'), 'banner_lookup', ['banner_id'], unique=False
+    )
+    op.create_index(
+        'ix_banner_lookup_tag_banner',
+        'banner_lookup',
+        ['tag_id', 'banner_id'],
+        unique=False,
+    )
+    #  Если пару (фича, тег) успели занять несколько баннеров, она остается
+    #  за первым из них, как и отдавал GET /user_banner
+    op.execute(
+        'INSERT INTO banner_lookup (feature_id, tag_id, banner_id) '
+        'SELECT banners.feature_id, banner_tag.tag_id, MIN(banners.id) '
+        'FROM banner_tag JOIN banners ON banners.id = banner_tag.banner_id '
+        'WHERE banners.feature_id IS NOT NULL '
+        'GROUP BY banners.feature_id, banner_tag.tag_id'
+    )
+
+    op.create_table(
+        'banner_versions',
+        sa.Column('banner_id', sa.Integer(), nullable=False),
+        sa.Column('version', sa.Integer(), nullable=False),
+        sa.Column('tag_ids', sa.JSON(), nullable=True),
+        sa.Column('feature_id', sa.Integer(), nullable=True),
+        sa.Column('content', sa.JSON(), nullable=True),
+        sa.Column('is_active', sa.Boolean(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['banner_id'], ['banners.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('banner_id', 'version'),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('banner_versions')
+    op.drop_index('ix_banner_lookup_tag_banner', table_name='banner_lookup')
+    op.drop_index(op.f('ix_banner_lookup_banner_id'), table_name='banner_lookup')
+    op.drop_table('banner_lookup')
+    rebuild_banner_tag(
+        primary_key=False,
+        rows_query='SELECT banner_id, tag_id FROM banner_tag',
+    )
+    op.drop_index('ix_banners_feature_id_id', table_name='banners')
+    with op.batch_alter_table('banners') as batch_op:
+        batch_op.drop_column('version')
+
+
+def rebuild_banner_tag(primary_key: bool, rows_query: str):
+    #  Первичный ключ добавляется пересозданием таблицы: так переносятся
+    #  только строки rows_query, одинаково в Postgres и SQLite. Имена
+    #  ограничений -- те, что Postgres дал бы самой banner_tag
+    columns = [
+        sa.Column('banner_id', sa.Integer(), nullable=not primary_key),
+        sa.Column('tag_id', sa.Integer(), nullable=not primary_key),
+        sa.ForeignKeyConstraint(
+            ['banner_id'],
+            ['banners.id'],
+            name='banner_tag_banner_id_fkey',
+            ondelete='CASCADE',
+        ),
+        sa.ForeignKeyConstraint(
+            ['tag_id'],
+            ['tags.id'],
+            name='banner_tag_tag_id_fkey',
+            ondelete='CASCADE',
+        ),
+    ]
+    if primary_key:
+        columns.append(
+            sa.PrimaryKeyConstraint('banner_id', 'tag_id', name='banner_tag_pkey')
+        )
+    op.create_table('banner_tag_new', *columns)
+    op.execute(f'INSERT INTO banner_tag_new (banner_id, tag_id) {rows_query}')
+    op.drop_table('banner_tag')
+    op.rename_table('banner_tag_new', 'banner_tag')
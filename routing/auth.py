@@ -1,6 +1,6 @@
 from fastapi import APIRouter, Depends
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from database.base import get_session
 from services.config import settings
 from services.user import UserService
@@ -15,7 +15,7 @@ user_service = UserService()
 
 @router.post("/token", tags=["auth"])
 async def get_token(
-        session: Session = Depends(get_session),
+        session: AsyncSession = Depends(get_session),
         form_data: OAuth2PasswordRequestForm = Depends(),
 ):
     """
@@ -23,7 +23,7 @@ async def get_token(
     :param form_data: Форма с данными пользователя (username, password)
     :return: Если данные не верны -- 400, иначе ответ с access_token}
     """
-    user = user_service.authenticate_user(
+    user = await user_service.authenticate_user(
         session=session,
         username=form_data.username,
         password=form_data.password
@@ -32,31 +32,37 @@ async def get_token(
 
 
 @router.post("/register", tags=["auth"], response_model=UserResponse)
-def register(user: UserCreate, session: Session = Depends(get_session)):
+async def register(
+        user: UserCreate,
+        session: AsyncSession = Depends(get_session),
+):
     """
     Регистрация обычного пользователя
     :param user: Данные пользователя (username, password)
     :return: Если пользователь уже существует или некорректные данные, то 400,
      иначе ответ с ID и username нового пользователя
     """
-    user = user_service.create_user(session=session, user=user)
+    user = await user_service.create_user(session=session, user=user)
     return user.to_response()
 
 
 @router.post("/register_admin", tags=["auth"], response_model=UserResponse)
-def register_admin(user: UserCreate, session: Session = Depends(get_session)):
+async def register_admin(
+        user: UserCreate,
+        session: AsyncSession = Depends(get_session),
+):
     """
     Регистрация администратора
     :param user: Данные пользователя (username, password)
     :return: Если пользователь уже существует или некорректные данные,
      то 400, иначе ответ с ID и username нового пользователя
     """
-    user = user_service.create_user(session=session, user=user, is_admin=True)
+    user = await user_service.create_user(session=session, user=user, is_admin=True)
     return user.to_response()
 
 
 @router.get("/users/me", response_model=UserResponse, tags=["auth"])
-def get_user(
+async def get_user(
         user: User = Depends(user_service.get_current_user),
 ):
     """
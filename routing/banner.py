@@ -1,12 +1,18 @@
-from fastapi import APIRouter, Depends
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, BackgroundTasks, Depends, Header, Request
+from sqlalchemy.ext.asyncio import AsyncSession
 from database.redis import get_redis
-from database.base import get_session
+from database.base import get_read_session, get_session
 from services.banner import BannerService
 from services.user import UserService
 from schemas.user import User
 from schemas.banner import Tag, Feature
-from schemas.pydantic_models import BannerResponse, BannerCreate, BannerPatch
+from schemas.pydantic_models import (
+    BannerResponse,
+    BannerCreate,
+    BannerPatch,
+    BannerBatchRequest,
+    BannerVersionResponse,
+)
 
 router = APIRouter()
 banner_service = BannerService()
@@ -17,29 +23,65 @@ user_service = UserService()
 async def get_user_banner(
         tag_id: int,
         feature_id: int,
+        background_tasks: BackgroundTasks,
         use_last_revision: bool = False,
+        if_none_match: str = Header(None),
         user: User = Depends(user_service.get_current_user),
-        session: Session = Depends(get_session),
+        session: AsyncSession = Depends(get_read_session),
         redis_client=Depends(get_redis)
 ):
     """
     Получить баннер в формате для пользователя по тегу и фиче
     :param tag_id: ID тега
     :param feature_id: ID фичи
+    :param background_tasks: Фоновая перезагрузка устаревшей записи кеша
     :param use_last_revision: Вернуть самую новую версию, если true
+    :param if_none_match: ETag из прошлого ответа: если баннер не изменился,
+     ответ 304 без тела
     :param user:
     :param session:
     :param redis_client:
-    :return: Данные баннера, если есть, если не найден, то 404,
-     если некорректные данные, то 400, если не авторизован, то 401
+    :return: Данные баннера с ETag и Cache-Control, если есть, если не найден,
+     то 404, если некорректные данные, то 400, если не авторизован, то 401
     """
-    return banner_service.get_banner_to_user(
+    return await banner_service.get_banner_to_user(
         session=session,
         tag_id=tag_id,
         feature_id=feature_id,
         use_last_revision=use_last_revision,
         user=user,
         redis_client=redis_client,
+        background_tasks=background_tasks,
+        if_none_match=if_none_match,
+    )
+
+
+@router.post("/user_banner/batch")
+async def get_user_banners_batch(
+        batch: BannerBatchRequest,
+        background_tasks: BackgroundTasks,
+        user: User = Depends(user_service.get_current_user),
+        session: AsyncSession = Depends(get_read_session),
+        redis_client=Depends(get_redis)
+):
+    """
+    Получить несколько баннеров в формате для пользователя одним запросом
+    :param batch: Список пар (tag_id, feature_id) и use_last_revision
+    :param background_tasks: Фоновая перезагрузка устаревших записей кеша
+    :param user:
+    :param session:
+    :param redis_client:
+    :return: {"results": [...]} в порядке пар запроса: для каждой пары
+     status 200 и content, либо status 400/403/404 и detail,
+     как у GET /user_banner. Если неавторизован, то 401
+    """
+    return await banner_service.get_banners_to_user(
+        session=session,
+        redis_client=redis_client,
+        use_last_revision=batch.use_last_revision,
+        user=user,
+        items=batch.items,
+        background_tasks=background_tasks,
     )
 
 
@@ -50,7 +92,9 @@ async def get_banners(
         tag_id: int = None,
         limit: int = None,
         offset: int = None,
-        session: Session = Depends(get_session),
+        after: str = None,
+        stream: bool = False,
+        session: AsyncSession = Depends(get_read_session),
 ):
     """
     Получить баннеры для администратора с фильтрацией по фиче или тегу
@@ -59,16 +103,23 @@ async def get_banners(
     :param tag_id: ID тега
     :param limit: Ограничение по количеству
     :param offset: Пропуск баннеров с начала
+    :param after: Курсор постраничного вывода, пустое значение -- первая страница.
+     Тогда ответ -- {"banners": [...], "next_cursor": ...}, где next_cursor
+     передается в after для следующей страницы (null -- страниц больше нет)
+    :param stream: Отдавать список потоком по мере чтения из бд, не собирая
+     его в памяти целиком. Нельзя совмещать с after
     :param session:
     :return: Список баннеров, если неавторизован, то 401, если нет прав, то 403
     """
-    return banner_service.get_banners(
+    return await banner_service.get_banners(
         session=session,
         user=user,
         feature_id=feature_id,
         tag_id=tag_id,
         limit=limit,
         offset=offset,
+        after=after,
+        stream=stream,
     )
 
 
@@ -76,39 +127,89 @@ async def get_banners(
 async def create_banner(
         banner: BannerCreate,
         user: User = Depends(user_service.get_current_user),
-        session: Session = Depends(get_session),
+        session: AsyncSession = Depends(get_session),
+        redis_client=Depends(get_redis),
 ):
     """
     Создать баннер
     :param banner: Все данные баннера
     :param user:
     :param session:
+    :param redis_client:
     :return: ID нового баннера, если создан, если неверные данные, то 400,
      если неавторизован, то 401, если нет прав, то 403
     """
-    return banner_service.create_banner(
+    return await banner_service.create_banner(
         banner=banner,
         user=user,
         session=session,
+        redis_client=redis_client,
     )
 
 
+@router.post("/banner/bulk")
+async def import_banners(
+        request: Request,
+        user: User = Depends(user_service.get_current_user),
+        session: AsyncSession = Depends(get_session),
+        redis_client=Depends(get_redis),
+):
+    """
+    Массовое создание баннеров. Тело -- NDJSON, по баннеру в формате
+    POST /banner на строку; читается потоком и вставляется пачками
+    :param request: Тело запроса в формате NDJSON
+    :param user:
+    :param session:
+    :param redis_client:
+    :return: {"created": N, "failed": M, "errors": [{"line": ..., "detail": ...}]}
+     (errors -- только первые ошибки), если неавторизован, то 401,
+     если нет прав, то 403
+    """
+    return await banner_service.import_banners(
+        session=session,
+        redis_client=redis_client,
+        user=user,
+        chunks=request.stream(),
+    )
+
+
+@router.get("/banner/export")
+async def export_banners(
+        user: User = Depends(user_service.get_current_user),
+        session: AsyncSession = Depends(get_session),
+):
+    """
+    Выгрузить все баннеры потоком NDJSON в порядке id
+    :param user:
+    :param session:
+    :return: По баннеру в формате GET /banner на строку, если неавторизован,
+     то 401, если нет прав, то 403
+    """
+    return await banner_service.export_banners(session=session, user=user)
+
+
 @router.delete("/banner/delete", status_code=204)
 async def delete_banners_by_tag_or_feature(
         feature_id: int = None,
         tag_id: int = None,
         user: User = Depends(user_service.get_current_user),
+        redis_client=Depends(get_redis),
 ):
     """
     Удалить баннер по тегу или фиче
     :param feature_id: ID фичи
     :param tag_id: ID тега
     :param user:
+    :param redis_client:
     :return: Если неавторизован, то 401, если нет прав, то 403.
     Если задан и тег и фича, то 400(можно только что то одно). Иначе 204
     """
     user_service.check_admin(user)
-    banner_service.delete_banners_by_tag_or_feature(feature_id, tag_id)
+    await banner_service.delete_banners_by_tag_or_feature(
+        redis_client=redis_client,
+        feature_id=feature_id,
+        tag_id=tag_id,
+    )
 
 
 @router.patch("/banner/{item_id}")
@@ -116,7 +217,8 @@ async def update_banner(
         item_id: int,
         banner: BannerPatch,
         user: User = Depends(user_service.get_current_user),
-        session: Session = Depends(get_session)
+        session: AsyncSession = Depends(get_session),
+        redis_client=Depends(get_redis),
 ):
     """
     Обновить баннер
@@ -124,11 +226,14 @@ async def update_banner(
     :param banner: Новые поля баннера, которые необходимо обновить
     :param user:
     :param session:
+    :param redis_client:
     :return: 400, если некорректные данные, 401 если неавторизован,
-     403 если нет прав, иначе 200
+     403 если нет прав, 409 если баннер одновременно изменил другой запрос,
+     иначе 200
     """
-    return banner_service.update_banner(
+    return await banner_service.update_banner(
         session=session,
+        redis_client=redis_client,
         item_id=item_id,
         user=user,
         new_banner=banner,
@@ -139,101 +244,180 @@ async def update_banner(
 async def delete_banner(
         item_id: int,
         user: User = Depends(user_service.get_current_user),
-        session: Session = Depends(get_session),
+        session: AsyncSession = Depends(get_session),
+        redis_client=Depends(get_redis),
 ):
     """
     Удалить баннер по ID
     :param item_id: ID баннера
     :param user:
     :param session:
+    :param redis_client:
     :return: 204, если баннер существует, если нет, то 400
     """
-    return banner_service.delete_banner(
+    return await banner_service.delete_banner(
+        session=session,
+        redis_client=redis_client,
+        item_id=item_id,
+        user=user,
+    )
+
+
+@router.get("/banner/{item_id}/versions", response_model=list[BannerVersionResponse])
+async def get_banner_versions(
+        item_id: int,
+        limit: int = None,
+        user: User = Depends(user_service.get_current_user),
+        session: AsyncSession = Depends(get_session),
+):
+    """
+    Получить последние версии баннера
+    :param item_id: ID баннера
+    :param limit: Сколько последних версий вернуть
+    :param user:
+    :param session:
+    :return: Версии от новой к старой, 400 если баннера нет,
+     401 если неавторизован, 403 если нет прав
+    """
+    return await banner_service.get_banner_versions(
         session=session,
         item_id=item_id,
         user=user,
+        limit=limit,
+    )
+
+
+@router.post("/banner/{item_id}/versions/{version}/restore")
+async def restore_banner_version(
+        item_id: int,
+        version: int,
+        user: User = Depends(user_service.get_current_user),
+        session: AsyncSession = Depends(get_session),
+        redis_client=Depends(get_redis),
+):
+    """
+    Восстановить версию баннера. Восстановленное состояние сохраняется
+    как новая версия
+    :param item_id: ID баннера
+    :param version: Номер версии
+    :param user:
+    :param session:
+    :param redis_client:
+    :return: 400, если версии нет или ее нельзя восстановить
+     (например, удален тег или пара занята), 401 если неавторизован,
+     403 если нет прав, 409 если баннер одновременно изменил другой запрос,
+     иначе 200
+    """
+    return await banner_service.restore_banner_version(
+        session=session,
+        redis_client=redis_client,
+        item_id=item_id,
+        version=version,
+        user=user,
     )
 
 
 @router.post("/tag")
 async def create_tag(
         user: User = Depends(user_service.get_current_user),
-        session: Session = Depends(get_session),
+        session: AsyncSession = Depends(get_session),
+        redis_client=Depends(get_redis),
 ):
     """
     Создать тег
     :param user:
     :param session:
+    :param redis_client:
     :return: ID тега
     """
-    return banner_service.create_tag(session=session, user=user)
+    return await banner_service.create_tag(
+        session=session,
+        redis_client=redis_client,
+        user=user,
+    )
 
 
 @router.delete("/tag/{item_id}", status_code=204)
 async def delete_tag(
         item_id: int,
         user: User = Depends(user_service.get_current_user),
-        session: Session = Depends(get_session),
+        session: AsyncSession = Depends(get_session),
+        redis_client=Depends(get_redis),
 ):
     """
     Удалить тег
     :param item_id:
     :param user:
     :param session:
+    :param redis_client:
     :return: Если существует 204, если нет 400
     """
-    user_service.check_admin(user)
-    Tag.delete(session=session, item_id=item_id)
-    return
+    return await banner_service.delete_tag(
+        session=session,
+        redis_client=redis_client,
+        item_id=item_id,
+        user=user,
+    )
 
 
 @router.post("/feature")
 async def create_feature(
         user: User = Depends(user_service.get_current_user),
-        session: Session = Depends(get_session),
+        session: AsyncSession = Depends(get_session),
+        redis_client=Depends(get_redis),
 ):
     """
     Создать фичу
     :param user:
     :param session:
+    :param redis_client:
     :return: ID фичи
     """
-    return banner_service.create_feature(session=session, user=user)
+    return await banner_service.create_feature(
+        session=session,
+        redis_client=redis_client,
+        user=user,
+    )
 
 
 @router.delete("/feature/{item_id}", status_code=204)
 async def delete_feature(
         item_id: int,
         user: User = Depends(user_service.get_current_user),
-        session: Session = Depends(get_session),
+        session: AsyncSession = Depends(get_session),
+        redis_client=Depends(get_redis),
 ):
     """
     Удалить фичу
     :param item_id: ID фичи
     :param user:
     :param session:
+    :param redis_client:
     :return: 204, если фича существует, иначе 400
     """
-    user_service.check_admin(user)
-    Feature.delete(session=session, item_id=item_id)
-    return
+    return await banner_service.delete_feature(
+        session=session,
+        redis_client=redis_client,
+        item_id=item_id,
+        user=user,
+    )
 
 
 @router.get('/tags')
-async def get_tags(session: Session = Depends(get_session)):
+async def get_tags(session: AsyncSession = Depends(get_read_session)):
     """
     Получить теги
     :param session:
     :return: Список всех тегов
     """
-    return {"tags": Tag.all(session=session)}
+    return {"tags": await Tag.all(session=session)}
 
 
 @router.get("/features")
-async def get_features(session: Session = Depends(get_session)):
+async def get_features(session: AsyncSession = Depends(get_read_session)):
     """
     Получить фичи
     :param session:
     :return: Список фич
     """
-    return {"features": Feature.all(session=session)}
+    return {"features": await Feature.all(session=session)}
@@ -0,0 +1,46 @@
+from fastapi import APIRouter, Depends, status
+from fastapi.responses import JSONResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from database.base import get_session
+from database.redis import get_broker_redis, get_redis
+from services.health import health_service
+
+router = APIRouter(tags=["health"])
+
+
+@router.get("/health/live")
+async def live():
+    """
+    Проверка живости: процесс отвечает, зависимости не проверяются
+    :return: {"status": "ok"}
+    """
+    return {"status": "ok"}
+
+
+@router.get("/health/ready")
+async def ready(
+        session: AsyncSession = Depends(get_session),
+        redis_client=Depends(get_redis),
+        broker_client=Depends(get_broker_redis),
+):
+    """
+    Проверка готовности: бд, кеш Redis и брокер Celery
+    :param session:
+    :param redis_client:
+    :param broker_client:
+    :return: {"status": ..., "checks": {"db": ..., "redis": ..., "broker": ...}}
+     с временем ответа каждой зависимости. 200, если все проверки прошли,
+     иначе 503: зависимость недоступна, не ответила за HEALTH_TIMEOUT_MS или
+     превышен порог времени получения соединения из пула или ответа Redis
+    """
+    result = await health_service.ready(
+        session=session,
+        redis_client=redis_client,
+        broker_client=broker_client,
+    )
+    status_code = (
+        status.HTTP_200_OK
+        if result["status"] == "ok"
+        else status.HTTP_503_SERVICE_UNAVAILABLE
+    )
+    return JSONResponse(content=result, status_code=status_code)
@@ -0,0 +1,13 @@
+from fastapi import APIRouter
+from services.metrics import metrics_response
+
+router = APIRouter()
+
+
+@router.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    """
+    Метрики в формате Prometheus
+    :return: Текстовый формат экспозиции Prometheus
+    """
+    return metrics_response()
@@ -7,26 +7,60 @@ from sqlalchemy import (
     Boolean,
     JSON,
     ForeignKey,
+    Index,
     Table,
+    delete,
     exists,
+    insert,
+    select,
+    tuple_,
 )
-from sqlalchemy.orm import relationship, selectinload, Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import relationship, selectinload
 from database.base import Base
-from schemas.pydantic_models import BannerAdminResponse
+from schemas.pydantic_models import BannerAdminResponse, BannerVersionResponse
+from services.config import settings
 
 
 banner_tag = Table('banner_tag', Base.metadata,
                    Column(
                        'banner_id',
                        Integer,
-                       ForeignKey('banners.id', ondelete="CASCADE")
+                       ForeignKey('banners.id', ondelete="CASCADE"),
+                       primary_key=True,
                    ),
                    Column(
                        'tag_id',
                        Integer,
-                       ForeignKey('tags.id', ondelete="CASCADE")
+                       ForeignKey('tags.id', ondelete="CASCADE"),
+                       primary_key=True,
                    ))
 
+#  Пара (фича, тег) однозначно определяет баннер. Таблица поддерживается
+#  Banner.add/Banner.update и дает поиск баннера одним обращением к индексу
+banner_lookup = Table('banner_lookup', Base.metadata,
+                      Column(
+                          'feature_id',
+                          Integer,
+                          ForeignKey('features.id', ondelete="CASCADE"),
+                          primary_key=True,
+                      ),
+                      Column(
+                          'tag_id',
+                          Integer,
+                          ForeignKey('tags.id', ondelete="CASCADE"),
+                          primary_key=True,
+                      ),
+                      Column(
+                          'banner_id',
+                          Integer,
+                          ForeignKey('banners.id', ondelete="CASCADE"),
+                          nullable=False,
+                          index=True,
+                      ),
+                      #  Выборка баннеров тега в порядке id для постраничного вывода
+                      Index('ix_banner_lookup_tag_banner', 'tag_id', 'banner_id'))
+
 
 class Tag(Base):
     __tablename__ = "tags"
@@ -35,33 +69,44 @@ class Tag(Base):
     banners = relationship("Banner", secondary='banner_tag', back_populates="tags")
 
     @classmethod
-    def get_tags_by_id(
+    async def get_tags_by_id(
             cls,
             tag_ids: list[int],
-            session: Session,
+            session: AsyncSession,
     ):
-        return [(session.get(cls, tag_id)) for tag_id in tag_ids]
+        """
+        Теги одним запросом IN (...) в порядке tag_ids;
+        на месте отсутствующих -- None
+        """
+        tags = await session.scalars(select(cls).where(cls.id.in_(set(tag_ids))))
+        tags_by_id = {tag.id: tag for tag in tags}
+        return [tags_by_id.get(tag_id) for tag_id in tag_ids]
 
     @classmethod
-    def add(cls, session: Session):
+    async def add(cls, session: AsyncSession):
         tag = cls()
         session.add(tag)
-        session.commit()
+        await session.commit()
         return tag
 
     @classmethod
-    def all(cls, session: Session):
-        tags = session.query(cls).all()
+    async def all(cls, session: AsyncSession):
+        tags = (await session.scalars(select(cls))).all()
         return tags
 
     @classmethod
-    def exists(cls, session: Session, item_id):
-        return session.query(exists(cls).where(cls.id == item_id)).scalar()
+    async def exists(cls, session: AsyncSession, item_id):
+        return await session.scalar(select(exists().where(cls.id == item_id)))
+
+    @classmethod
+    async def existing_ids(cls, session: AsyncSession, item_ids) -> set[int]:
+        ids = await session.scalars(select(cls.id).where(cls.id.in_(set(item_ids))))
+        return set(ids)
 
     @classmethod
-    def delete(cls, session: Session, item_id):
-        session.query(cls).filter_by(id=item_id).delete()
-        session.commit()
+    async def delete(cls, session: AsyncSession, item_id):
+        await session.execute(delete(cls).where(cls.id == item_id))
+        await session.commit()
 
 
 class Feature(Base):
@@ -71,25 +116,30 @@ class Feature(Base):
     banners = relationship("Banner", back_populates="feature")
 
     @classmethod
-    def add(cls, session: Session):
+    async def add(cls, session: AsyncSession):
         feature = cls()
         session.add(feature)
-        session.commit()
+        await session.commit()
         return feature
 
     @classmethod
-    def exists(cls, session: Session, item_id):
-        return session.query(exists(cls).where(cls.id == item_id)).scalar()
+    async def exists(cls, session: AsyncSession, item_id):
+        return await session.scalar(select(exists().where(cls.id == item_id)))
+
+    @classmethod
+    async def existing_ids(cls, session: AsyncSession, item_ids) -> set[int]:
+        ids = await session.scalars(select(cls.id).where(cls.id.in_(set(item_ids))))
+        return set(ids)
 
     @classmethod
-    def all(cls, session: Session):
-        features = session.query(cls).all()
+    async def all(cls, session: AsyncSession):
+        features = (await session.scalars(select(cls))).all()
         return features
 
     @classmethod
-    def delete(cls, session: Session, item_id):
-        session.query(cls).filter_by(id=item_id).delete()
-        session.commit()
+    async def delete(cls, session: AsyncSession, item_id):
+        await session.execute(delete(cls).where(cls.id == item_id))
+        await session.commit()
 
 
 class Banner(Base):
@@ -103,6 +153,13 @@ class Banner(Base):
     is_active = Column(Boolean, default=True)
     created_at = Column(DateTime, default=datetime.now())
     updated_at = Column(DateTime, onupdate=datetime.now())
+    #  Номер ревизии, растет на 1 при каждом изменении баннера
+    version = Column(Integer, nullable=False, default=1, server_default="1")
+
+    __table_args__ = (
+        #  Выборка баннеров фичи в порядке id для постраничного вывода
+        Index('ix_banners_feature_id_id', 'feature_id', 'id'),
+    )
 
     def to_admin_response(self):
         return BannerAdminResponse(
@@ -112,11 +169,51 @@ class Banner(Base):
             content=self.content,
             created_at=str(self.created_at),
             updated_at=str(self.updated_at),
-            is_active=self.is_active
+            is_active=self.is_active,
+            version=self.version,
+        )
+
+    def cache_pairs(self):
+        return [(tag.id, self.feature_id) for tag in self.tags]
+
+    @classmethod
+    def cache_pairs_query(cls, feature_id: int = None, tag_id: int = None):
+        """
+        Пары (tag_id, feature_id) всех баннеров фичи или баннеров, у которых
+        есть тег tag_id
+        """
+        query = select(banner_lookup.c.tag_id, banner_lookup.c.feature_id)
+        if feature_id:
+            query = query.where(banner_lookup.c.feature_id == feature_id)
+        if tag_id:
+            query = query.where(banner_lookup.c.banner_id.in_(
+                select(banner_lookup.c.banner_id).where(
+                    banner_lookup.c.tag_id == tag_id
+                )
+            ))
+        return query
+
+    @classmethod
+    async def get_cache_pairs(
+            cls,
+            session: AsyncSession,
+            feature_id: int = None,
+            tag_id: int = None,
+    ):
+        pairs = await session.execute(
+            cls.cache_pairs_query(feature_id=feature_id, tag_id=tag_id)
         )
+        return [tuple(pair) for pair in pairs]
 
     @classmethod
-    def add(cls, session: Session, tags, feature_id, content, is_active=True):
+    async def add(
+            cls,
+            session: AsyncSession,
+            tags,
+            feature_id,
+            content,
+            is_active=True,
+    ):
         banner = cls(
             content=content,
             tags=tags,
@@ -124,11 +221,15 @@ class Banner(Base):
             is_active=is_active
         )
         session.add(banner)
-        session.commit()
+        await session.flush()
+        await banner.save_lookup(session=session)
+        await BannerVersion.save(session=session, banner=banner)
+        await session.commit()
         return banner
 
-    def update(
+    async def update(
             self,
+            session: AsyncSession,
             tags,
             feature_id,
             content,
@@ -142,51 +243,276 @@ class Banner(Base):
             self.content = content
         if is_active is not None:
             self.is_active = is_active
+        if tags or feature_id:
+            await session.execute(
+                delete(banner_lookup).where(banner_lookup.c.banner_id == self.id)
+            )
+            await self.save_lookup(session=session)
+        if not session.is_modified(self):
+            return False
+        #  Параллельное изменение получит ту же версию и упадет
+        #  с IntegrityError на первичном ключе banner_versions
+        self.version += 1
+        await BannerVersion.save(session=session, banner=self)
+        return True
+
+    async def save_lookup(self, session: AsyncSession):
+        #  Нарушение однозначности пары (фича, тег) -- IntegrityError.
+        #  Пустой список параметров дал бы INSERT ... DEFAULT VALUES
+        if not self.tags:
+            return
+        await session.execute(insert(banner_lookup), [
+            {"feature_id": self.feature_id, "tag_id": tag.id, "banner_id": self.id}
+            for tag in self.tags
+        ])
 
     @classmethod
-    def delete(cls, session: Session, item_id):
-        session.query(cls).filter_by(id=item_id).delete()
-        session.commit()
+    async def delete(cls, session: AsyncSession, item_id):
+        await session.execute(delete(cls).where(cls.id == item_id))
+        await session.commit()
 
     @classmethod
-    def exists(cls, session: Session, item_id):
-        return session.query(exists(cls).where(cls.id == item_id)).scalar()
+    async def exists(cls, session: AsyncSession, item_id):
+        return await session.scalar(select(exists().where(cls.id == item_id)))
 
-    #  Получение баннеров по айди тегов и айди фичи
-    @staticmethod
-    def get_by_tags_and_feature(session: Session, tag_ids, feature_id):
-        banners = session.query(Banner).filter(
-            Banner.feature_id == feature_id,
-            Banner.tags.any(Tag.id.in_(tag_ids))
-        ).all()
-        return banners
+    @classmethod
+    async def get_version(cls, session: AsyncSession, item_id):
+        return await session.scalar(select(cls.version).where(cls.id == item_id))
 
     @classmethod
-    def get_by_one_tag_and_feature(
+    async def get_by_one_tag_and_feature(
             cls,
-            session: Session,
+            session: AsyncSession,
             feature_id: int = None,
             tag_id: int = None,
             limit: int = None,
             offset: int = None,
+            after_id: int = None,
     ):
-        query = session.query(Banner)
+        """
+        Баннеры в порядке id. after_id -- курсор: баннеры с id больше него,
+        в отличие от offset не требует пропускать строки
+        """
+        query = select(Banner).order_by(Banner.id)
         if feature_id:
             query = query.filter_by(feature_id=feature_id)
         if tag_id:
-            query = query.filter(Banner.tags.any(id=tag_id))
-        if limit:
-            query = query.limit(limit)
+            query = query.join(
+                banner_lookup, banner_lookup.c.banner_id == Banner.id
+            ).where(banner_lookup.c.tag_id == tag_id)
+        if after_id is not None:
+            query = query.where(Banner.id > after_id)
         if offset:
             query = query.offset(offset)
+        if limit:
+            query = query.limit(limit)
         query = query.options(selectinload(Banner.tags))
-        banners = query.all()
+        banners = (await session.scalars(query)).all()
         return banners
 
     @classmethod
-    def get(cls, session: Session, feature_id: int, tag_id: int):
-        banner = session.query(cls).filter(
-            cls.feature_id == feature_id,
-            cls.tags.any(id=tag_id)
-        ).scalar()
+    async def taken_pairs(cls, session: AsyncSession, pairs) -> set:
+        #  Какие из пар (tag_id, feature_id) уже заняты, одним запросом
+        rows = await session.execute(
+            select(banner_lookup.c.tag_id, banner_lookup.c.feature_id).where(
+                tuple_(banner_lookup.c.tag_id, banner_lookup.c.feature_id).in_(pairs)
+            )
+        )
+        return {tuple(row) for row in rows}
+
+    @classmethod
+    async def bulk_add(cls, session: AsyncSession, banners: list[dict]):
+        """
+        Вставка пачки баннеров {"tag_ids", "feature_id", "content", "is_active"}
+        несколькими INSERT на всю пачку вместо запросов на каждый баннер:
+        banners, banner_tag, banner_lookup и первая версия. Пары должны
+        быть проверены заранее. Коммит -- на вызывающем
+        """
+        banner_ids = (await session.scalars(
+            insert(cls).returning(cls.id, sort_by_parameter_order=True),
+            [
+                {
+                    "feature_id": banner["feature_id"],
+                    "content": banner["content"],
+                    "is_active": banner["is_active"],
+                }
+                for banner in banners
+            ],
+        )).all()
+        links = [
+            (banner_id, tag_id, banner["feature_id"])
+            for banner_id, banner in zip(banner_ids, banners)
+            for tag_id in banner["tag_ids"]
+        ]
+        if links:
+            await session.execute(insert(banner_tag), [
+                {"banner_id": banner_id, "tag_id": tag_id}
+                for banner_id, tag_id, _ in links
+            ])
+            await session.execute(insert(banner_lookup), [
+                {"banner_id": banner_id, "tag_id": tag_id, "feature_id": feature_id}
+                for banner_id, tag_id, feature_id in links
+            ])
+        await session.execute(insert(BannerVersion), [
+            {
+                "banner_id": banner_id,
+                "version": 1,
+                "tag_ids": banner["tag_ids"],
+                "feature_id": banner["feature_id"],
+                "content": banner["content"],
+                "is_active": banner["is_active"],
+            }
+            for banner_id, banner in zip(banner_ids, banners)
+        ])
+        return banner_ids
+
+    @classmethod
+    async def stream(
+            cls,
+            session: AsyncSession,
+            batch_size: int,
+            feature_id: int = None,
+            tag_id: int = None,
+            limit: int = None,
+            offset: int = None,
+    ):
+        """
+        Баннеры в порядке id с их тегами: (banner, [tag_id, ...]), с теми же
+        фильтрами, что get_by_one_tag_and_feature. Строки читаются серверным
+        курсором пачками по batch_size, ORM-объекты не создаются
+        """
+        banner_ids = select(cls.id)
+        if feature_id:
+            banner_ids = banner_ids.filter_by(feature_id=feature_id)
+        if tag_id:
+            banner_ids = banner_ids.join(
+                banner_lookup, banner_lookup.c.banner_id == cls.id
+            ).where(banner_lookup.c.tag_id == tag_id)
+        if offset or limit:
+            #  limit и offset считаются по баннерам, а не по строкам с тегами
+            banner_ids = banner_ids.order_by(cls.id).offset(offset).limit(limit)
+        banner_ids = banner_ids.subquery()
+        rows = await session.stream(
+            select(
+                cls.id,
+                cls.feature_id,
+                cls.content,
+                cls.is_active,
+                cls.created_at,
+                cls.updated_at,
+                cls.version,
+                banner_tag.c.tag_id,
+            )
+            .join(banner_ids, banner_ids.c.id == cls.id)
+            .outerjoin(banner_tag, banner_tag.c.banner_id == cls.id)
+            .order_by(cls.id, banner_tag.c.tag_id)
+            .execution_options(yield_per=batch_size)
+        )
+        current, tag_ids = None, []
+        async for row in rows:
+            if current is not None and row.id != current.id:
+                yield current, tag_ids
+                tag_ids = []
+            current = row
+            if row.tag_id is not None:
+                tag_ids.append(row.tag_id)
+        if current is not None:
+            yield current, tag_ids
+
+    @classmethod
+    async def get_many(cls, session: AsyncSession, pairs):
+        """
+        Баннеры для набора пар (tag_id, feature_id) одним запросом:
+        строки (tag_id, feature_id, id, version, content, is_active)
+        """
+        rows = await session.execute(
+            select(
+                banner_lookup.c.tag_id,
+                banner_lookup.c.feature_id,
+                cls.id,
+                cls.version,
+                cls.content,
+                cls.is_active,
+            )
+            .join(cls, cls.id == banner_lookup.c.banner_id)
+            .where(
+                tuple_(banner_lookup.c.tag_id, banner_lookup.c.feature_id).in_(pairs)
+            )
+        )
+        return rows.all()
+
+    @classmethod
+    async def get(cls, session: AsyncSession, feature_id: int, tag_id: int):
+        banner = await session.scalar(
+            select(cls)
+            .join(banner_lookup, banner_lookup.c.banner_id == cls.id)
+            .where(
+                banner_lookup.c.feature_id == feature_id,
+                banner_lookup.c.tag_id == tag_id,
+            )
+        )
         return banner
+
+
+class BannerVersion(Base):
+    """
+    Снимок баннера после каждого изменения. Хранятся последние
+    BANNER_VERSIONS_KEEP версий, последняя совпадает с текущим состоянием
+    """
+    __tablename__ = "banner_versions"
+
+    banner_id = Column(
+        Integer,
+        ForeignKey('banners.id', ondelete='CASCADE'),
+        primary_key=True,
+    )
+    version = Column(Integer, primary_key=True)
+    tag_ids = Column(JSON)
+    feature_id = Column(Integer)
+    content = Column(JSON)
+    is_active = Column(Boolean)
+    created_at = Column(DateTime, default=datetime.now)
+
+    def to_response(self):
+        return BannerVersionResponse(
+            banner_id=self.banner_id,
+            version=self.version,
+            tag_ids=self.tag_ids,
+            feature_id=self.feature_id,
+            content=self.content,
+            is_active=self.is_active,
+            created_at=str(self.created_at),
+        )
+
+    @classmethod
+    async def save(cls, session: AsyncSession, banner: Banner):
+        session.add(cls(
+            banner_id=banner.id,
+            version=banner.version,
+            tag_ids=[tag.id for tag in banner.tags],
+            feature_id=banner.feature_id,
+            content=banner.content,
+            is_active=banner.is_active,
+        ))
+        await session.execute(
+            delete(cls).where(
+                cls.banner_id == banner.id,
+                cls.version <= banner.version - settings.BANNER_VERSIONS_KEEP,
+            )
+        )
+
+    @classmethod
+    async def last(cls, session: AsyncSession, banner_id: int, limit: int = None):
+        query = (
+            select(cls)
+            .where(cls.banner_id == banner_id)
+            .order_by(cls.version.desc())
+        )
+        if limit:
+            query = query.limit(limit)
+        versions = (await session.scalars(query)).all()
+        return versions
+
+    @classmethod
+    async def get(cls, session: AsyncSession, banner_id: int, version: int):
+        return await session.get(cls, (banner_id, version))
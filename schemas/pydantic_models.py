@@ -5,6 +5,16 @@ class BannerResponse(BaseModel):
     content: dict
 
 
+class BannerPair(BaseModel):
+    tag_id: int
+    feature_id: int
+
+
+class BannerBatchRequest(BaseModel):
+    items: list[BannerPair]
+    use_last_revision: bool = False
+
+
 class BannerCreate(BaseModel):
     tag_ids: list[int]
     feature_id: int
@@ -27,6 +37,22 @@ class BannerAdminResponse(BaseModel):
     is_active: bool
     created_at: str
     updated_at: str = None
+    version: int = 1
+
+
+class BannerVersionResponse(BaseModel):
+    banner_id: int
+    version: int
+    tag_ids: list[int]
+    feature_id: int
+    content: dict
+    is_active: bool
+    created_at: str
+
+
+class BannerPageResponse(BaseModel):
+    banners: list[BannerAdminResponse]
+    next_cursor: str | None = None
 
 
 class UserCreate(BaseModel):
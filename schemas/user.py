@@ -1,10 +1,10 @@
 from datetime import datetime
-from passlib.hash import bcrypt
 from sqlalchemy import Column, String, Integer, DateTime, Boolean
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import validates
-from sqlalchemy.orm import Session
 from database.base import Base
 from schemas.pydantic_models import UserResponse
+from services.password import password_hasher
 
 
 class User(Base):
@@ -21,14 +21,18 @@ class User(Base):
             raise ValueError("Имя пользователя должно состоять из хотя бы 4 символов")
         return username
 
-    def verify_password(self, password):
-        return bcrypt.verify(password, self.password)
+    async def verify_password(self, password):
+        return await password_hasher.verify(password, self.password)
 
     @classmethod
-    def add(cls, session: Session, username, password, is_admin=False):
-        user = cls(username=username, password=bcrypt.hash(password), is_admin=is_admin)
+    async def add(cls, session: AsyncSession, username, password, is_admin=False):
+        user = cls(
+            username=username,
+            password=await password_hasher.hash(password),
+            is_admin=is_admin,
+        )
         session.add(user)
-        session.commit()
+        await session.commit()
         return user
 
     def to_response(self):
@@ -1,84 +1,669 @@
-import pickle
-from fastapi import Depends, HTTPException, status
+import base64
+import binascii
+import json
+import random
+import time
+from fastapi import BackgroundTasks, Depends, HTTPException, Response, status
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
+from redis.exceptions import RedisError
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy.orm import selectinload, Session
-from schemas.banner import Banner, Tag, Feature
-from schemas.pydantic_models import BannerCreate, BannerPatch
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+from database.replica import use_primary
+from schemas.banner import Banner, BannerVersion, Tag, Feature
+from schemas.pydantic_models import (
+    BannerCreate,
+    BannerPatch,
+    BannerPageResponse,
+    BannerPair,
+)
 from schemas.user import User
+from services.banner_cache import (
+    banner_cache,
+    banner_etag,
+    cache_key,
+    CachedBanner,
+    etag_matches,
+    needs_refresh,
+    render_banner_body,
+)
+from services.banner_events import (
+    EVICT_FEATURE,
+    EVICT_TAG,
+    REFRESH,
+    REMOVE,
+    REMOVE_BY_TAG,
+    publish_event,
+)
+from services.banner_index import banner_index
+from services.config import settings
+from services.metrics import BANNER_CACHE_REQUESTS
+from services.single_flight import banner_single_flight, banner_redis_single_flight
 from services.user import UserService
 from services.celery_tasks import delete_banners_by_tag, delete_banners_by_feature
 
 
 user_service = UserService()
+#  Ответы на отказы, которые кешируются вместе с баннерами
+ERROR_DETAILS = {
+    status.HTTP_400_BAD_REQUEST: "Некорректные данные.",
+    status.HTTP_404_NOT_FOUND: "Баннер не найден",
+}
+
+
+def missing_tags_detail(tag_ids) -> str:
+    return "Один или несколько тегов отсутствуют: " + ", ".join(
+        map(str, sorted(tag_ids))
+    )
+
+
+def render_admin_banner(banner, tag_ids) -> bytes:
+    #  Тот же JSON, что BannerAdminResponse в ответе FastAPI, но без модели
+    return json.dumps(
+        {
+            "banner_id": banner.id,
+            "tag_ids": tag_ids,
+            "feature_id": banner.feature_id,
+            "content": banner.content,
+            "is_active": banner.is_active,
+            "created_at": str(banner.created_at),
+            "updated_at": str(banner.updated_at),
+            "version": banner.version,
+        },
+        ensure_ascii=False,
+        allow_nan=False,
+        separators=(",", ":"),
+    ).encode("utf-8")
+
+
+async def render_admin_banners(banners, json_array: bool):
+    """
+    Поток баннеров (banner, [tag_id, ...]) в JSON-массив или NDJSON.
+    Строки склеиваются в куски по BANNER_BULK_BATCH_SIZE, чтобы не писать
+    в сокет по одному баннеру
+    """
+    separator = b"," if json_array else b""
+    if json_array:
+        yield b"["
+    chunk, written = [], False
+    async for banner, tag_ids in banners:
+        line = render_admin_banner(banner, tag_ids)
+        chunk.append(line if json_array else line + b"\n")
+        if len(chunk) >= settings.BANNER_BULK_BATCH_SIZE:
+            yield (separator if written else b"") + separator.join(chunk)
+            chunk, written = [], True
+    if chunk:
+        yield (separator if written else b"") + separator.join(chunk)
+    if json_array:
+        yield b"]"
+
+
+async def ndjson_lines(chunks, max_line: int):
+    #  Разбивает поток байт на строки, не держа в памяти больше одной строки
+    buffer = b""
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            yield line
+        if len(buffer) > max_line:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Некорректные данные.Строка длиннее {max_line} байт",
+            )
+    if buffer:
+        yield buffer
 
 
 class BannerService:
-    def get_banner_to_user(
+    def __init__(self):
+        #  Ключи, перезагрузка которых уже запланирована в этом процессе
+        self.__refreshing = set()
+
+    async def get_banner_to_user(
             self,
-            session: Session,
+            session: AsyncSession,
             redis_client,
             use_last_revision: bool,
             user: User,
             tag_id: int = None,
             feature_id: int = None,
+            background_tasks: BackgroundTasks = None,
+            if_none_match: str = None,
     ):
+        self.__route_reads(
+            session=session,
+            user=user,
+            use_last_revision=use_last_revision,
+        )
         try:
-            cache_key = f"{tag_id}_{feature_id}"
-
             if not use_last_revision:
-                banner = None
-                cached_result = redis_client.get(cache_key)
-                if cached_result:
-                    banner = pickle.loads(cached_result)
-                if banner:
-                    if banner.is_active or user.is_admin:
-                        return banner
-                    raise HTTPException(
-                        status_code=status.HTTP_403_FORBIDDEN,
-                        detail="Пользователь не имеет доступа"
+                entry = None
+                if banner_index.ready:
+                    entry = banner_index.get(feature_id=feature_id, tag_id=tag_id)
+                    BANNER_CACHE_REQUESTS.labels(
+                        layer="index",
+                        result="miss" if entry is None else "hit",
+                    ).inc()
+                if entry is None:
+                    entry = await self.__read_cache(banner_cache.get(
+                        redis_client=redis_client,
+                        tag_id=tag_id,
+                        feature_id=feature_id,
+                    ))
+                    if entry is not None and needs_refresh(entry):
+                        self.__schedule_refresh(
+                            background_tasks=background_tasks,
+                            session=session,
+                            redis_client=redis_client,
+                            pairs=[(tag_id, feature_id)],
+                        )
+                if entry is None:
+                    #  Одновременные промахи по одному ключу ждут одну загрузку
+                    entry = await banner_single_flight.do(
+                        key=cache_key(tag_id, feature_id),
+                        loader=lambda: self.__load_banner_coalesced(
+                            session=session,
+                            redis_client=redis_client,
+                            tag_id=tag_id,
+                            feature_id=feature_id,
+                        ),
                     )
-            if not Tag.exists(
-                    session=session,
-                    item_id=tag_id
-            ) or not Feature.exists(
-                session=session,
-                item_id=feature_id
-            ):
-                self.__raise400()
-            banner = Banner.get(session=session, feature_id=feature_id, tag_id=tag_id)
-            if banner is None:
-                exc = HTTPException(
-                    status_code=status.HTTP_404_NOT_FOUND,
-                    detail="Баннер не найден"
-                )
-                raise exc
-            if not banner.is_active and not user.is_admin:
-                exc = HTTPException(
-                    status_code=status.HTTP_403_FORBIDDEN,
-                    detail="Пользователь не имеет доступа"
-                )
-                raise exc
-            redis_client.set(cache_key, pickle.dumps(banner), ex=300)
-            return banner
+            else:
+                #  Запись из кеша годится, если ее версия совпадает с текущей
+                entry = await self.__read_cache(banner_cache.get_current(
+                    redis_client=redis_client,
+                    tag_id=tag_id,
+                    feature_id=feature_id,
+                ))
+                if entry is None:
+                    entry = await self.__load_banner(
+                        session=session,
+                        redis_client=redis_client,
+                        tag_id=tag_id,
+                        feature_id=feature_id,
+                    )
+            self.__record_hits(
+                background_tasks=background_tasks,
+                redis_client=redis_client,
+                pairs=[(tag_id, feature_id)],
+                entries={(tag_id, feature_id): entry},
+            )
+            return self.__banner_response(
+                entry=entry,
+                user=user,
+                if_none_match=if_none_match,
+                use_last_revision=use_last_revision,
+            )
         except ValueError:
             self.__raise400()
             return None
 
-    def get_banners(
+    @staticmethod
+    async def __read_cache(read):
+        #  Недоступный Redis -- промах: ответ строится из бд
+        try:
+            entry = await read
+        except RedisError:
+            BANNER_CACHE_REQUESTS.labels(layer="redis", result="error").inc()
+            return None
+        BANNER_CACHE_REQUESTS.labels(
+            layer="redis",
+            result="miss" if entry is None else "hit",
+        ).inc()
+        return entry
+
+    @staticmethod
+    async def __write_cache(write):
+        #  Запись прочитанного из бд в кеш не должна ронять ответ
+        try:
+            await write
+        except RedisError:
+            BANNER_CACHE_REQUESTS.labels(layer="redis", result="error").inc()
+
+    @staticmethod
+    async def __sync_cache(write, redis_client, pairs, banner_id: int = None):
+        #  Изменение уже закоммичено, поэтому ошибка Redis не ломает ответ.
+        #  Ключи, которые не удалось перезаписать, сбрасываются с повторами
+        try:
+            await write
+            return
+        except RedisError:
+            BANNER_CACHE_REQUESTS.labels(layer="redis", result="error").inc()
+        await banner_cache.invalidate_retrying(
+            redis_client=redis_client,
+            pairs=pairs,
+            banner_id=banner_id,
+        )
+
+    def __schedule_refresh(
+            self,
+            background_tasks: BackgroundTasks,
+            session: AsyncSession,
+            redis_client,
+            pairs,
+    ):
+        #  Устаревшая запись уже отдана, баннер перезагружается после ответа.
+        #  Без background_tasks запись доживает до жесткого срока
+        if background_tasks is None:
+            return
+        pairs = [pair for pair in pairs if pair not in self.__refreshing]
+        if not pairs:
+            return
+        self.__refreshing.update(pairs)
+        background_tasks.add_task(
+            self.__refresh_banners,
+            session=session,
+            redis_client=redis_client,
+            pairs=pairs,
+        )
+
+    @staticmethod
+    def __record_hits(background_tasks: BackgroundTasks, redis_client, pairs, entries):
+        #  Выборочный учет популярности пар для прогрева после рестарта.
+        #  Учитываются только найденные баннеры: несуществующие пары
+        #  не должны засорять HITS_KEY
+        if (
+            background_tasks is None
+            or not settings.BANNER_WARMUP_SIZE
+            or random.random() >= settings.BANNER_HITS_SAMPLE_RATE
+        ):
+            return
+        pairs = [
+            pair for pair in pairs
+            if pair in entries and entries[pair].status == status.HTTP_200_OK
+        ]
+        if not pairs:
+            return
+        background_tasks.add_task(
+            banner_cache.record_hits,
+            redis_client=redis_client,
+            pairs=pairs,
+        )
+
+    async def __refresh_banners(self, session: AsyncSession, redis_client, pairs):
+        try:
+            for tag_id, feature_id in pairs:
+                try:
+                    await banner_single_flight.do(
+                        key=cache_key(tag_id, feature_id),
+                        loader=lambda: self.__load_banner(
+                            session=session,
+                            redis_client=redis_client,
+                            tag_id=tag_id,
+                            feature_id=feature_id,
+                        ),
+                    )
+                except HTTPException:
+                    #  Баннера, тега или фичи больше нет
+                    await self.__write_cache(banner_cache.invalidate(
+                        redis_client=redis_client,
+                        pairs=[(tag_id, feature_id)],
+                    ))
+        finally:
+            self.__refreshing.difference_update(pairs)
+
+    async def __load_banner_coalesced(
+            self,
+            session: AsyncSession,
+            redis_client,
+            tag_id: int,
+            feature_id: int,
+    ):
+        if not settings.BANNER_CACHE_LOCK_ENABLED:
+            return await self.__load_banner(
+                session=session,
+                redis_client=redis_client,
+                tag_id=tag_id,
+                feature_id=feature_id,
+            )
+        return await banner_redis_single_flight.do(
+            redis_client=redis_client,
+            key=cache_key(tag_id, feature_id),
+            loader=lambda: self.__load_banner(
+                session=session,
+                redis_client=redis_client,
+                tag_id=tag_id,
+                feature_id=feature_id,
+            ),
+            fetch=lambda: banner_cache.get(
+                redis_client=redis_client,
+                tag_id=tag_id,
+                feature_id=feature_id,
+            ),
+        )
+
+    async def __load_banner(
             self,
-            session: Session,
+            session: AsyncSession,
+            redis_client,
+            tag_id: int,
+            feature_id: int,
+    ):
+        if not await Tag.exists(
+                session=session,
+                item_id=tag_id
+        ) or not await Feature.exists(
+            session=session,
+            item_id=feature_id
+        ):
+            await self.__raise_cached(
+                redis_client=redis_client,
+                pair=(tag_id, feature_id),
+                status_code=status.HTTP_400_BAD_REQUEST,
+            )
+        banner = await Banner.get(
+            session=session,
+            feature_id=feature_id,
+            tag_id=tag_id,
+        )
+        if banner is None:
+            await self.__raise_cached(
+                redis_client=redis_client,
+                pair=(tag_id, feature_id),
+                status_code=status.HTTP_404_NOT_FOUND,
+            )
+        entry = CachedBanner.from_banner(banner)
+        await self.__write_cache(banner_cache.set_loaded(
+            redis_client=redis_client,
+            entries={(tag_id, feature_id): entry},
+        ))
+        return entry
+
+    async def get_banners_to_user(
+            self,
+            session: AsyncSession,
+            redis_client,
+            use_last_revision: bool,
+            user: User,
+            items: list[BannerPair],
+            background_tasks: BackgroundTasks = None,
+    ):
+        """
+        Пакетное получение баннеров: in-process индекс, один MGET по тем же
+        ключам, что и get_banner_to_user, и один запрос в бд на все промахи.
+        Для каждой пары возвращается либо content, либо статус ошибки
+        """
+        if len(items) > settings.BANNER_BATCH_MAX_SIZE:
+            self.__raise400(
+                detail=f"Не более {settings.BANNER_BATCH_MAX_SIZE} пар за запрос"
+            )
+        self.__route_reads(
+            session=session,
+            user=user,
+            use_last_revision=use_last_revision,
+        )
+        pairs = list(dict.fromkeys((item.tag_id, item.feature_id) for item in items))
+        entries = {}
+        if not use_last_revision:
+            if banner_index.ready:
+                for tag_id, feature_id in pairs:
+                    entry = banner_index.get(feature_id=feature_id, tag_id=tag_id)
+                    if entry is not None:
+                        entries[(tag_id, feature_id)] = entry
+            cached = await self.__read_cache_many(
+                redis_client=redis_client,
+                pairs=[pair for pair in pairs if pair not in entries],
+            )
+            self.__schedule_refresh(
+                background_tasks=background_tasks,
+                session=session,
+                redis_client=redis_client,
+                pairs=[pair for pair, entry in cached.items() if needs_refresh(entry)],
+            )
+            entries.update(cached)
+        else:
+            #  Как в get_banner_to_user: записи, совпадающие с текущей
+            #  версией баннера, остальные пары читаются из бд
+            entries.update(await self.__read_cache_many(
+                redis_client=redis_client,
+                pairs=pairs,
+                current=True,
+            ))
+        missed = [pair for pair in pairs if pair not in entries]
+        errors = {}
+        if missed:
+            loaded = await self.__load_many(
+                session=session,
+                redis_client=redis_client,
+                pairs=missed,
+            )
+            entries.update(loaded)
+            errors = await self.__batch_errors(
+                session=session,
+                pairs=[pair for pair in missed if pair not in loaded],
+            )
+            await self.__write_cache(banner_cache.set_negative(
+                redis_client=redis_client,
+                statuses={
+                    pair: status_code for pair, (status_code, _) in errors.items()
+                },
+            ))
+        self.__record_hits(
+            background_tasks=background_tasks,
+            redis_client=redis_client,
+            pairs=pairs,
+            entries=entries,
+        )
+        results = []
+        for item in items:
+            pair = (item.tag_id, item.feature_id)
+            entry = entries.get(pair)
+            if entry is not None and entry.status != status.HTTP_200_OK:
+                errors[pair] = (entry.status, ERROR_DETAILS[entry.status])
+            elif entry is not None and not entry.is_active and not user.is_admin:
+                errors[pair] = (
+                    status.HTTP_403_FORBIDDEN, "Пользователь не имеет доступа"
+                )
+            if pair in errors:
+                status_code, detail = errors[pair]
+                results.append(json.dumps({
+                    "tag_id": item.tag_id,
+                    "feature_id": item.feature_id,
+                    "status": status_code,
+                    "detail": detail,
+                }, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+            else:
+                #  Готовое тело {"content":...} дополняется полями пары без
+                #  повторной сериализации
+                results.append(
+                    f'{{"tag_id":{item.tag_id},"feature_id":{item.feature_id},'
+                    f'"status":200,'.encode() + entry.body[1:]
+                )
+        return Response(
+            content=b'{"results":[' + b",".join(results) + b"]}",
+            media_type="application/json",
+        )
+
+    @staticmethod
+    async def __read_cache_many(redis_client, pairs, current: bool = False):
+        #  То же, что __read_cache, для одного MGET на все пары пакета.
+        #  current -- только записи текущих версий баннеров
+        if not pairs:
+            return {}
+        read = banner_cache.get_many_current if current else banner_cache.get_many
+        try:
+            entries = await read(redis_client=redis_client, pairs=pairs)
+        except RedisError:
+            BANNER_CACHE_REQUESTS.labels(layer="redis", result="error").inc()
+            return {}
+        BANNER_CACHE_REQUESTS.labels(layer="redis", result="hit").inc(len(entries))
+        BANNER_CACHE_REQUESTS.labels(layer="redis", result="miss").inc(
+            len(pairs) - len(entries)
+        )
+        return entries
+
+    async def __load_many(self, session: AsyncSession, redis_client, pairs):
+        #  Баннеры пар одним запросом в бд с записью в кеш
+        loaded = {
+            (row.tag_id, row.feature_id): CachedBanner(
+                body=render_banner_body(row.content),
+                is_active=bool(row.is_active),
+                banner_id=row.id,
+                version=row.version,
+            )
+            for row in await Banner.get_many(session=session, pairs=pairs)
+        }
+        await self.__write_cache(banner_cache.set_loaded(
+            redis_client=redis_client,
+            entries=loaded,
+        ))
+        return loaded
+
+    async def warm_up(self, session: AsyncSession, redis_client):
+        """
+        Загружает в Redis баннеры BANNER_WARMUP_SIZE самых запрашиваемых пар,
+        которых там нет, чтобы после рестарта первые запросы не шли в бд.
+        Без Redis прогрев пропускается: старт от него не зависит
+        """
+        loaded = {}
+        try:
+            pairs = await banner_cache.hottest(
+                redis_client=redis_client,
+                limit=settings.BANNER_WARMUP_SIZE,
+            )
+            cached = await banner_cache.get_many(
+                redis_client=redis_client,
+                pairs=pairs,
+            )
+            missed = [pair for pair in pairs if pair not in cached]
+            for start in range(0, len(missed), settings.BANNER_BULK_BATCH_SIZE):
+                loaded.update(await self.__load_many(
+                    session=session,
+                    redis_client=redis_client,
+                    pairs=missed[start:start + settings.BANNER_BULK_BATCH_SIZE],
+                ))
+        except RedisError:
+            pass
+        return len(loaded)
+
+    @staticmethod
+    async def __batch_errors(session: AsyncSession, pairs):
+        #  Для ненайденных пар -- 400, если нет тега или фичи, иначе 404
+        if not pairs:
+            return {}
+        tag_ids = await Tag.existing_ids(
+            session=session, item_ids=[tag_id for tag_id, _ in pairs]
+        )
+        feature_ids = await Feature.existing_ids(
+            session=session, item_ids=[feature_id for _, feature_id in pairs]
+        )
+        errors = {}
+        for tag_id, feature_id in pairs:
+            if tag_id in tag_ids and feature_id in feature_ids:
+                status_code = status.HTTP_404_NOT_FOUND
+            else:
+                status_code = status.HTTP_400_BAD_REQUEST
+            errors[(tag_id, feature_id)] = (status_code, ERROR_DETAILS[status_code])
+        return errors
+
+    async def __raise_cached(self, redis_client, pair, status_code: int):
+        #  Отказ кешируется на короткое время, чтобы повторные запросы
+        #  несуществующих пар не ходили в бд
+        await self.__write_cache(banner_cache.set_negative(
+            redis_client=redis_client,
+            statuses={pair: status_code},
+        ))
+        raise HTTPException(status_code=status_code, detail=ERROR_DETAILS[status_code])
+
+    @staticmethod
+    def __banner_response(
+            entry,
+            user: User,
+            if_none_match: str = None,
+            use_last_revision: bool = False,
+    ):
+        #  Тело ответа уже сериализовано, модель ответа не строится
+        if entry.status != status.HTTP_200_OK:
+            raise HTTPException(
+                status_code=entry.status,
+                detail=ERROR_DETAILS[entry.status],
+            )
+        if not entry.is_active and not user.is_admin:
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="Пользователь не имеет доступа"
+            )
+        headers = {"Cache-Control": BannerService.__cache_control(
+            entry=entry,
+            use_last_revision=use_last_revision,
+        )}
+        etag = banner_etag(entry)
+        if etag is not None:
+            headers["ETag"] = etag
+            if if_none_match and etag_matches(if_none_match, etag):
+                return Response(
+                    status_code=status.HTTP_304_NOT_MODIFIED,
+                    headers=headers,
+                )
+        return Response(
+            content=entry.body,
+            media_type="application/json",
+            headers=headers,
+        )
+
+    @staticmethod
+    def __cache_control(entry, use_last_revision: bool) -> str:
+        #  Неактивный баннер видит только администратор -- общим кешам его
+        #  не отдаем; use_last_revision проверяется по ETag на каждом запросе
+        if not entry.is_active:
+            return "private, no-cache"
+        scope = "public" if settings.BANNER_HTTP_CACHE_PUBLIC else "private"
+        if use_last_revision:
+            return f"{scope}, no-cache"
+        soft_expires_at = getattr(entry, "soft_expires_at", 0)
+        remaining = (
+            soft_expires_at - time.time()
+            if soft_expires_at
+            else settings.BANNER_CACHE_SOFT_TTL
+        )
+        max_age = int(max(0, min(remaining, settings.BANNER_HTTP_MAX_AGE)))
+        return f"{scope}, max-age={max_age}"
+
+    async def get_banners(
+            self,
+            session: AsyncSession,
             user: User = Depends(user_service.get_current_user),
             feature_id: int = None,
             tag_id: int = None,
             limit: int = None,
             offset: int = None,
+            after: str = None,
+            stream: bool = False,
     ):
         user_service.check_admin(user)
+        self.__route_reads(session=session, user=user)
         if limit is not None and limit < 1:
             self.__raise400(detail="Значение limit не может быть < 1")
         if offset is not None and offset < 1:
             self.__raise400(detail="Значение offset не может быть < 1")
-        banners = Banner.get_by_one_tag_and_feature(
+        if stream:
+            if after is not None:
+                self.__raise400(detail="stream и after нельзя задавать вместе")
+            banners = Banner.stream(
+                session=session,
+                batch_size=settings.BANNER_BULK_BATCH_SIZE,
+                feature_id=feature_id,
+                tag_id=tag_id,
+                limit=limit,
+                offset=offset,
+            )
+            return StreamingResponse(
+                render_admin_banners(banners, json_array=True),
+                media_type="application/json",
+            )
+        if after is not None:
+            if offset is not None:
+                self.__raise400(detail="offset и after нельзя задавать вместе")
+            return await self.__get_banners_page(
+                session=session,
+                feature_id=feature_id,
+                tag_id=tag_id,
+                limit=limit or settings.BANNER_PAGE_SIZE,
+                after=after,
+            )
+        banners = await Banner.get_by_one_tag_and_feature(
             session=session,
             feature_id=feature_id,
             tag_id=tag_id,
@@ -88,47 +673,204 @@ class BannerService:
         banners_response = [banner.to_admin_response() for banner in banners]
         return banners_response
 
-    def create_banner(
+    async def __get_banners_page(
+            self,
+            session: AsyncSession,
+            feature_id: int,
+            tag_id: int,
+            limit: int,
+            after: str,
+    ):
+        #  Лишняя строка показывает, есть ли следующая страница
+        banners = await Banner.get_by_one_tag_and_feature(
+            session=session,
+            feature_id=feature_id,
+            tag_id=tag_id,
+            limit=limit + 1,
+            after_id=self.__decode_cursor(after),
+        )
+        next_cursor = None
+        if len(banners) > limit:
+            banners = banners[:limit]
+            next_cursor = self.__encode_cursor(banners[-1].id)
+        return BannerPageResponse(
+            banners=[banner.to_admin_response() for banner in banners],
+            next_cursor=next_cursor,
+        )
+
+    @staticmethod
+    def __encode_cursor(banner_id: int) -> str:
+        raw = json.dumps({"id": banner_id}, separators=(",", ":")).encode()
+        return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+    def __decode_cursor(self, cursor: str):
+        #  Пустой курсор -- первая страница
+        if not cursor:
+            return None
+        try:
+            padded = cursor + "=" * (-len(cursor) % 4)
+            banner_id = json.loads(base64.urlsafe_b64decode(padded))["id"]
+            if not isinstance(banner_id, int):
+                raise ValueError
+            return banner_id
+        except (ValueError, KeyError, TypeError, binascii.Error):
+            self.__raise400(detail="Некорректный курсор")
+
+    async def create_banner(
             self,
             banner: BannerCreate,
             user: User,
-            session: Session,
+            session: AsyncSession,
+            redis_client,
     ):
         try:
             user_service.check_admin(user)
-            banners = Banner.get_by_tags_and_feature(
-                session=session,
-                tag_ids=banner.tag_ids,
-                feature_id=banner.feature_id
-            )
-            if len(banners) != 0:
-                self.__raise400(detail="Нарушение однозначности")
-            tags = self.get_tags_by_id(session=session, tag_ids=banner.tag_ids)
-            if None in tags:
-                self.__raise400()
-                return
-            feature = Feature.exists(session=session, item_id=banner.feature_id)
+            tags = await self.get_tags_by_id(session=session, tag_ids=banner.tag_ids)
+            feature = await Feature.exists(session=session, item_id=banner.feature_id)
             if not feature:
                 self.__raise400()
                 return
-            banner = Banner.add(
+            banner = await Banner.add(
                 session=session,
                 feature_id=banner.feature_id,
                 tags=tags,
                 content=banner.content,
                 is_active=banner.is_active,
             )
+            await banner_index.refresh(session=session, banner_ids=[banner.id])
+            await publish_event(redis_client, REFRESH, [banner.id])
+            pairs = banner.cache_pairs()
+            await self.__sync_cache(
+                banner_cache.set(
+                    redis_client=redis_client,
+                    entry=CachedBanner.from_banner(banner),
+                    pairs=pairs,
+                ),
+                redis_client=redis_client,
+                pairs=pairs,
+                banner_id=banner.id,
+            )
             return {'banner_id': banner.id}
         except ValueError:
             self.__raise400()
             return
         except IntegrityError:
-            self.__raise400()
+            #  Теги и фича уже проверены, значит пара (фича, тег) занята
+            await session.rollback()
+            self.__raise400(detail="Нарушение однозначности")
             return
 
-    def update_banner(
+    async def import_banners(
             self,
-            session: Session,
+            session: AsyncSession,
+            redis_client,
+            user: User,
+            chunks,
+    ):
+        """
+        Импорт NDJSON: строки копятся пачками по BANNER_BULK_BATCH_SIZE,
+        на пачку -- по запросу на теги, фичи и занятые пары и одна транзакция.
+        Некорректные строки пропускаются и попадают в errors
+        """
+        user_service.check_admin(user)
+        result = {"created": 0, "failed": 0, "errors": []}
+        batch = []
+        line_number = 0
+        async for line in ndjson_lines(chunks, settings.BANNER_BULK_MAX_LINE):
+            line_number += 1
+            if not line.strip():
+                continue
+            try:
+                banner = BannerCreate.model_validate_json(line)
+            except ValidationError:
+                self.__import_error(result, line_number, "")
+                continue
+            batch.append((line_number, banner))
+            if len(batch) >= settings.BANNER_BULK_BATCH_SIZE:
+                await self.__import_batch(session, redis_client, batch, result)
+                batch = []
+        if batch:
+            await self.__import_batch(session, redis_client, batch, result)
+        return result
+
+    async def __import_batch(self, session: AsyncSession, redis_client, batch, result):
+        tag_ids = await Tag.existing_ids(
+            session=session,
+            item_ids={tag_id for _, banner in batch for tag_id in banner.tag_ids},
+        )
+        feature_ids = await Feature.existing_ids(
+            session=session,
+            item_ids={banner.feature_id for _, banner in batch},
+        )
+        taken = await Banner.taken_pairs(session=session, pairs=[
+            (tag_id, banner.feature_id)
+            for _, banner in batch for tag_id in banner.tag_ids
+        ])
+        accepted = []
+        for line_number, banner in batch:
+            banner_tag_ids = list(dict.fromkeys(banner.tag_ids))
+            pairs = {(tag_id, banner.feature_id) for tag_id in banner_tag_ids}
+            if not set(banner_tag_ids) <= tag_ids:
+                self.__import_error(
+                    result,
+                    line_number,
+                    missing_tags_detail(set(banner_tag_ids) - tag_ids),
+                )
+            elif banner.feature_id not in feature_ids:
+                self.__import_error(result, line_number, "")
+            elif pairs & taken:
+                #  Пара занята в бд или предыдущей строкой пачки
+                self.__import_error(result, line_number, "Нарушение однозначности")
+            else:
+                taken |= pairs
+                accepted.append({**banner.model_dump(), "tag_ids": banner_tag_ids})
+        if not accepted:
+            return
+        try:
+            banner_ids = await Banner.bulk_add(session=session, banners=accepted)
+            await session.commit()
+        except IntegrityError:
+            #  Пару успели занять параллельно -- пачка не вставлена целиком
+            await session.rollback()
+            result["failed"] += len(accepted)
+            return
+        result["created"] += len(banner_ids)
+        await banner_index.refresh(session=session, banner_ids=banner_ids)
+        await publish_event(redis_client, REFRESH, banner_ids)
+        #  Отрицательные записи кеша для новых пар больше не верны
+        pairs = [
+            (tag_id, banner["feature_id"])
+            for banner in accepted for tag_id in banner["tag_ids"]
+        ]
+        await self.__sync_cache(
+            banner_cache.invalidate(redis_client=redis_client, pairs=pairs),
+            redis_client=redis_client,
+            pairs=pairs,
+        )
+
+    @staticmethod
+    def __import_error(result, line_number: int, detail: str):
+        result["failed"] += 1
+        if len(result["errors"]) < settings.BANNER_BULK_MAX_ERRORS:
+            result["errors"].append(
+                {"line": line_number, "detail": f"Некорректные данные.{detail}"}
+            )
+
+    async def export_banners(self, session: AsyncSession, user: User):
+        user_service.check_admin(user)
+        banners = Banner.stream(
+            session=session,
+            batch_size=settings.BANNER_BULK_BATCH_SIZE,
+        )
+        return StreamingResponse(
+            render_admin_banners(banners, json_array=False),
+            media_type="application/x-ndjson",
+        )
+
+    async def update_banner(
+            self,
+            session: AsyncSession,
+            redis_client,
             item_id: int,
             user: User,
             new_banner: BannerPatch,
@@ -136,61 +878,210 @@ class BannerService:
         user_service.check_admin(user)
         try:
             banner_to_update = (
-                session.get(Banner, item_id, options=[selectinload(Banner.tags)])
+                await session.get(Banner, item_id, options=[selectinload(Banner.tags)])
             )
             if banner_to_update is None:
                 self.__raise400()
+            old_pairs = banner_to_update.cache_pairs()
+            old_version = banner_to_update.version
             tags = []
             if new_banner.tag_ids:
-                banners = Banner.get_by_tags_and_feature(
+                tags = await self.get_tags_by_id(
                     session=session,
                     tag_ids=new_banner.tag_ids,
-                    feature_id=new_banner.feature_id
                 )
-                if len(banners) != 0:
-                    if banners[0] != banner_to_update:
-                        self.__raise400(detail="Нарушение однозначности")
-                tags = self.get_tags_by_id(session=session, tag_ids=new_banner.tag_ids)
-            banner_to_update.update(
+            if new_banner.feature_id and not await Feature.exists(
+                session=session,
+                item_id=new_banner.feature_id,
+            ):
+                self.__raise400()
+            if await banner_to_update.update(
+                session=session,
                 tags=tags,
                 feature_id=new_banner.feature_id,
                 content=new_banner.content,
                 is_active=new_banner.is_active,
-            )
-            if session.is_modified(banner_to_update):
-                session.commit()
+            ):
+                await session.commit()
+                await banner_index.refresh(session=session, banner_ids=[item_id])
+                await publish_event(redis_client, REFRESH, [item_id])
+                new_pairs = banner_to_update.cache_pairs()
+                await self.__sync_cache(
+                    banner_cache.write_through(
+                        redis_client=redis_client,
+                        banner=banner_to_update,
+                        old_pairs=old_pairs,
+                        new_pairs=new_pairs,
+                    ),
+                    redis_client=redis_client,
+                    pairs=set(old_pairs) | set(new_pairs),
+                    banner_id=item_id,
+                )
             return "OK"
         except ValueError:
             self.__raise400()
             return None
         except IntegrityError:
-            self.__raise400()
+            await session.rollback()
+            #  Версия успела измениться -- это параллельное изменение баннера
+            #  (та же версия в banner_versions), а не занятая пара
+            if await Banner.get_version(
+                    session=session,
+                    item_id=item_id,
+            ) != old_version:
+                raise HTTPException(
+                    status_code=status.HTTP_409_CONFLICT,
+                    detail="Баннер изменен параллельным запросом, повторите",
+                )
+            self.__raise400(detail="Нарушение однозначности")
             return None
 
-    def delete_banner(
+    async def get_banner_versions(
             self,
-            session: Session,
+            session: AsyncSession,
             item_id: int,
             user: User,
+            limit: int = None,
     ):
         user_service.check_admin(user)
-        if Banner.exists(session=session, item_id=item_id):
-            Banner.delete(session=session, item_id=item_id)
-        else:
+        if limit is not None and limit < 1:
+            self.__raise400(detail="Значение limit не может быть < 1")
+        if not await Banner.exists(session=session, item_id=item_id):
             self.__raise400()
+        versions = await BannerVersion.last(
+            session=session,
+            banner_id=item_id,
+            limit=limit,
+        )
+        return [version.to_response() for version in versions]
 
-    @staticmethod
-    def create_tag(session: Session, user: User):
+    async def restore_banner_version(
+            self,
+            session: AsyncSession,
+            redis_client,
+            item_id: int,
+            version: int,
+            user: User,
+    ):
+        user_service.check_admin(user)
+        banner_version = await BannerVersion.get(
+            session=session,
+            banner_id=item_id,
+            version=version,
+        )
+        if banner_version is None:
+            self.__raise400(detail="Версия не найдена")
+        return await self.update_banner(
+            session=session,
+            redis_client=redis_client,
+            item_id=item_id,
+            user=user,
+            new_banner=BannerPatch(
+                tag_ids=banner_version.tag_ids,
+                feature_id=banner_version.feature_id,
+                content=banner_version.content,
+                is_active=banner_version.is_active,
+            ),
+        )
+
+    async def delete_banner(
+            self,
+            session: AsyncSession,
+            redis_client,
+            item_id: int,
+            user: User,
+    ):
+        user_service.check_admin(user)
+        banner = await session.get(Banner, item_id, options=[selectinload(Banner.tags)])
+        if banner is None:
+            self.__raise400()
+        pairs = banner.cache_pairs()
+        await Banner.delete(session=session, item_id=item_id)
+        banner_index.remove(banner_ids=[item_id])
+        await publish_event(redis_client, REMOVE, [item_id])
+        await self.__sync_cache(
+            banner_cache.invalidate(
+                redis_client=redis_client,
+                pairs=pairs,
+                banner_id=item_id,
+            ),
+            redis_client=redis_client,
+            pairs=pairs,
+            banner_id=item_id,
+        )
+
+    async def create_tag(self, session: AsyncSession, redis_client, user: User):
         user_service.check_admin(user)
-        tag = Tag.add(session=session)
+        tag = await Tag.add(session=session)
+        await self.__write_cache(banner_cache.invalidate_negative(
+            redis_client=redis_client,
+            tag_id=tag.id,
+        ))
         return tag
 
-    @staticmethod
-    def create_feature(session: Session, user: User):
+    async def delete_tag(
+            self,
+            session: AsyncSession,
+            redis_client,
+            item_id: int,
+            user: User,
+    ):
         user_service.check_admin(user)
-        feature = Feature.add(session=session)
+        banner_pairs = await Banner.get_cache_pairs(session=session, tag_id=item_id)
+        pairs = [pair for pair in banner_pairs if pair[0] == item_id]
+        await Tag.delete(session=session, item_id=item_id)
+        banner_index.evict_tag(tag_id=item_id)
+        await publish_event(redis_client, EVICT_TAG, [item_id])
+        await self.__sync_cache(
+            banner_cache.invalidate(redis_client=redis_client, pairs=pairs),
+            redis_client=redis_client,
+            pairs=pairs,
+        )
+        #  Отрицательные записи живут BANNER_NEGATIVE_CACHE_TTL, их сброс
+        #  без повторов
+        await self.__write_cache(banner_cache.invalidate_negative(
+            redis_client=redis_client,
+            tag_id=item_id,
+        ))
+
+    async def create_feature(self, session: AsyncSession, redis_client, user: User):
+        user_service.check_admin(user)
+        feature = await Feature.add(session=session)
+        await self.__write_cache(banner_cache.invalidate_negative(
+            redis_client=redis_client,
+            feature_id=feature.id,
+        ))
         return feature
 
+    async def delete_feature(
+            self,
+            session: AsyncSession,
+            redis_client,
+            item_id: int,
+            user: User,
+    ):
+        user_service.check_admin(user)
+        pairs = await Banner.get_cache_pairs(session=session, feature_id=item_id)
+        await Feature.delete(session=session, item_id=item_id)
+        banner_index.evict_feature(feature_id=item_id)
+        await publish_event(redis_client, EVICT_FEATURE, [item_id])
+        await self.__sync_cache(
+            banner_cache.invalidate(redis_client=redis_client, pairs=pairs),
+            redis_client=redis_client,
+            pairs=pairs,
+        )
+        await self.__write_cache(banner_cache.invalidate_negative(
+            redis_client=redis_client,
+            feature_id=item_id,
+        ))
+
+    @staticmethod
+    def __route_reads(session: AsyncSession, user: User, use_last_revision=False):
+        #  Свежие данные нужны use_last_revision и администраторам, которые
+        #  видят свои изменения; остальное чтение может идти с реплики
+        if use_last_revision or user.is_admin:
+            use_primary(session)
+
     @staticmethod
     def __raise400(detail: str = ""):
         raise HTTPException(
@@ -198,23 +1089,33 @@ class BannerService:
             detail=f"Некорректные данные.{detail}",
         )
 
-    def get_tags_by_id(self, session: Session, tag_ids: list[int]):
-        tags = Tag.get_tags_by_id(
+    async def get_tags_by_id(self, session: AsyncSession, tag_ids: list[int]):
+        #  Повторы в tag_ids дали бы одинаковые строки banner_tag
+        tag_ids = list(dict.fromkeys(tag_ids))
+        tags = await Tag.get_tags_by_id(
             tag_ids=tag_ids,
             session=session,
         )
-        if None in tags:
-            self.__raise400(detail="Один или несколько тегов отсутствуют")
+        missing = {tag_id for tag_id, tag in zip(tag_ids, tags) if tag is None}
+        if missing:
+            self.__raise400(detail=missing_tags_detail(missing))
         return tags
 
-    def delete_banners_by_tag_or_feature(
+    async def delete_banners_by_tag_or_feature(
             self,
+            redis_client,
             feature_id: int = None,
             tag_id: int = None,
     ):
         if feature_id and tag_id:
             self.__raise400()
+        #  Баннеры убираются из индексов всех воркеров сразу, не дожидаясь
+        #  событий REMOVE от задачи Celery
         if feature_id:
             delete_banners_by_feature.delay(feature_id)
+            banner_index.evict_feature(feature_id=feature_id)
+            await publish_event(redis_client, EVICT_FEATURE, [feature_id])
         if tag_id:
             delete_banners_by_tag.delay(tag_id)
+            banner_index.remove_by_tag(tag_id=tag_id)
+            await publish_event(redis_client, REMOVE_BY_TAG, [tag_id])
@@ -0,0 +1,358 @@
+import asyncio
+import json
+import random
+import struct
+import time
+from typing import NamedTuple
+from redis.exceptions import RedisError
+from services.config import settings
+
+
+#  Версия формата записи в кеше. Записи другой версии считаются промахом,
+#  поэтому смена формата не требует сброса Redis
+CACHE_SCHEMA_VERSION = 3
+#  Заголовок записи: версия схемы, флаги, мягкий срок годности (unix time, сек.),
+#  id и версия баннера
+_HEADER = struct.Struct("!BBIII")
+_FLAG_ACTIVE = 0x01
+#  Отрицательные записи: баннера нет (404) или нет тега/фичи (400)
+_FLAG_NOT_FOUND = 0x02
+_FLAG_INVALID = 0x04
+
+
+class CachedBanner(NamedTuple):
+    body: bytes
+    is_active: bool
+    #  После мягкого срока запись еще отдается, но ее пора перезагрузить.
+    #  Жесткий срок -- это TTL ключа в Redis
+    soft_expires_at: float = 0
+    #  200 -- баннер, 404 или 400 -- закешированный отказ, body пустой
+    status: int = 200
+    banner_id: int = 0
+    version: int = 0
+
+    @classmethod
+    def from_banner(cls, banner):
+        return cls(
+            body=render_banner_body(banner.content),
+            is_active=banner.is_active,
+            banner_id=banner.id,
+            version=banner.version,
+        )
+
+    @classmethod
+    def negative(cls, status_code: int):
+        return cls(body=b"", is_active=False, status=status_code)
+
+
+def cache_key(tag_id: int, feature_id: int) -> str:
+    return f"{tag_id}_{feature_id}"
+
+
+def version_key(banner_id: int) -> str:
+    #  Текущая версия баннера, по ней проверяется свежесть записей
+    return f"banner_version:{banner_id}"
+
+
+#  Выборочные счетчики запросов пар {tag_id}_{feature_id} для прогрева
+HITS_KEY = "banner_hits"
+#  Во сколько раз больше BANNER_WARMUP_SIZE пар хранится в HITS_KEY:
+#  запас для пар, которые только набирают популярность
+HITS_KEEP_FACTOR = 4
+
+
+def negative_keys_key(tag_id: int = None, feature_id: int = None) -> str:
+    #  Множество отрицательных ключей тега или фичи
+    if tag_id is not None:
+        return f"negative:tag:{tag_id}"
+    return f"negative:feature:{feature_id}"
+
+
+def cache_keys(pairs) -> list[str]:
+    return [cache_key(tag_id, feature_id) for tag_id, feature_id in pairs]
+
+
+def render_banner_body(content: dict) -> bytes:
+    #  Тот же формат, что отдает JSONResponse для BannerResponse
+    return json.dumps(
+        {"content": content},
+        ensure_ascii=False,
+        allow_nan=False,
+        separators=(",", ":"),
+    ).encode("utf-8")
+
+
+def encode_entry(entry: CachedBanner, soft_expires_at: float = None) -> bytes:
+    if soft_expires_at is None:
+        soft_expires_at = time.time() + settings.BANNER_CACHE_SOFT_TTL
+    flags = _FLAG_ACTIVE if entry.is_active else 0
+    if entry.status == 404:
+        flags |= _FLAG_NOT_FOUND
+    elif entry.status == 400:
+        flags |= _FLAG_INVALID
+    return _HEADER.pack(
+        CACHE_SCHEMA_VERSION,
+        flags,
+        int(soft_expires_at),
+        entry.banner_id,
+        entry.version,
+    ) + entry.body
+
+
+def decode_entry(raw: bytes):
+    #  Версия проверяется до разбора остального заголовка: его длина
+    #  у разных версий может отличаться
+    if not raw or raw[0] != CACHE_SCHEMA_VERSION or len(raw) < _HEADER.size:
+        return None
+    _, flags, soft_expires_at, banner_id, version = _HEADER.unpack_from(raw)
+    if flags & _FLAG_NOT_FOUND:
+        return CachedBanner.negative(404)
+    if flags & _FLAG_INVALID:
+        return CachedBanner.negative(400)
+    return CachedBanner(
+        body=raw[_HEADER.size:],
+        is_active=bool(flags & _FLAG_ACTIVE),
+        soft_expires_at=soft_expires_at,
+        banner_id=banner_id,
+        version=version,
+    )
+
+
+def banner_etag(entry):
+    #  Тело записи однозначно задано баннером и его версией, поэтому ETag
+    #  берется из заголовка записи без хеширования тела
+    if not getattr(entry, "banner_id", 0):
+        return None
+    return f'"{entry.banner_id}.{entry.version}"'
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    #  Слабое сравнение, как требует RFC 9110 для If-None-Match
+    if if_none_match.strip() == "*":
+        return True
+    return any(
+        candidate.strip().removeprefix("W/") == etag
+        for candidate in if_none_match.split(",")
+    )
+
+
+def needs_refresh(entry, now: float = None) -> bool:
+    """
+    Пора ли перезагрузить запись из Redis. Кроме истекших по мягкому сроку,
+    обновляются и записи в последние BANNER_CACHE_EARLY_REFRESH_WINDOW секунд
+    до него -- со случайной вероятностью, растущей к концу окна, чтобы
+    горячие ключи не перезагружались одновременно
+    """
+    soft_expires_at = getattr(entry, "soft_expires_at", 0)
+    if not soft_expires_at:
+        return False
+    if now is None:
+        now = time.time()
+    window = settings.BANNER_CACHE_EARLY_REFRESH_WINDOW * random.random()
+    return now >= soft_expires_at - window
+
+
+class BannerCache:
+    """
+    Кеш баннеров в Redis по ключу {tag_id}_{feature_id}.
+    В записи хранится только то, что нужно для ответа пользователю:
+    готовое тело BannerResponse и is_active.
+    Все мутации баннеров, тегов и фич обязаны либо перезаписать,
+    либо сбросить затронутые ключи
+    """
+    async def get(self, redis_client, tag_id: int, feature_id: int):
+        cached_result = await redis_client.get(cache_key(tag_id, feature_id))
+        if cached_result:
+            return decode_entry(cached_result)
+        return None
+
+    async def get_many(self, redis_client, pairs) -> dict:
+        #  Один MGET на все пары
+        pairs = list(pairs)
+        if not pairs:
+            return {}
+        cached_results = await redis_client.mget(cache_keys(pairs))
+        entries = {}
+        for pair, cached_result in zip(pairs, cached_results):
+            entry = decode_entry(cached_result) if cached_result else None
+            if entry is not None:
+                entries[pair] = entry
+        return entries
+
+    async def get_current(self, redis_client, tag_id: int, feature_id: int):
+        """
+        Запись, только если она соответствует текущей версии баннера.
+        Отказы здесь не отдаются, их проверяет бд
+        """
+        entry = await self.get(redis_client, tag_id, feature_id)
+        if entry is None or entry.status != 200:
+            return None
+        version = await redis_client.get(version_key(entry.banner_id))
+        if version is None or int(version) != entry.version:
+            return None
+        return entry
+
+    async def get_many_current(self, redis_client, pairs) -> dict:
+        """
+        То же, что get_current, для нескольких пар: один MGET записей
+        и один MGET версий их баннеров
+        """
+        entries = {
+            pair: entry
+            for pair, entry in (await self.get_many(redis_client, pairs)).items()
+            if entry.status == 200
+        }
+        if not entries:
+            return {}
+        banner_ids = list({entry.banner_id for entry in entries.values()})
+        current = await redis_client.mget(
+            [version_key(banner_id) for banner_id in banner_ids]
+        )
+        versions = {
+            banner_id: int(version)
+            for banner_id, version in zip(banner_ids, current)
+            if version is not None
+        }
+        return {
+            pair: entry for pair, entry in entries.items()
+            if versions.get(entry.banner_id) == entry.version
+        }
+
+    async def set_loaded(self, redis_client, entries: dict):
+        """
+        Кеширует баннеры {(tag_id, feature_id): CachedBanner}, прочитанные
+        из бд. Версия из бд становится текущей, только если текущей еще нет;
+        если баннер уже успели изменить, старая версия в кеш не попадает
+        """
+        if not entries:
+            return
+        ttl = settings.BANNER_CACHE_TTL
+        versions = {entry.banner_id: entry.version for entry in entries.values()}
+        pipe = redis_client.pipeline(transaction=False)
+        for banner_id, version in versions.items():
+            pipe.set(version_key(banner_id), version, ex=ttl, nx=True)
+        pipe.mget([version_key(banner_id) for banner_id in versions])
+        current = dict(zip(versions, (await pipe.execute())[-1]))
+        soft_expires_at = time.time() + settings.BANNER_CACHE_SOFT_TTL
+        pipe = redis_client.pipeline(transaction=False)
+        for (tag_id, feature_id), entry in entries.items():
+            if int(current[entry.banner_id] or 0) > entry.version:
+                continue
+            pipe.set(
+                cache_key(tag_id, feature_id),
+                encode_entry(entry, soft_expires_at),
+                ex=ttl,
+            )
+        await pipe.execute()
+
+    async def set(self, redis_client, entry: CachedBanner, pairs):
+        #  Запись после изменения баннера: версия становится текущей
+        payload = encode_entry(entry)
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.set(
+            version_key(entry.banner_id),
+            entry.version,
+            ex=settings.BANNER_CACHE_TTL,
+        )
+        for tag_id, feature_id in pairs:
+            pipe.set(
+                cache_key(tag_id, feature_id),
+                payload,
+                ex=settings.BANNER_CACHE_TTL,
+            )
+        await pipe.execute()
+
+    async def set_negative(self, redis_client, statuses: dict):
+        """
+        Кеширует отказы {(tag_id, feature_id): 400 | 404} на короткое время.
+        Ключи запоминаются во множествах своего тега и фичи, чтобы их можно
+        было сбросить, когда тег или фича появятся или будут удалены.
+        Появление баннера сбрасывать не нужно: он перезаписывает тот же ключ,
+        а уже записанный баннер отказ не затирает
+        """
+        if not statuses or not settings.BANNER_NEGATIVE_CACHE_TTL:
+            return
+        ttl = settings.BANNER_NEGATIVE_CACHE_TTL
+        pipe = redis_client.pipeline(transaction=False)
+        for (tag_id, feature_id), status_code in statuses.items():
+            key = cache_key(tag_id, feature_id)
+            pipe.set(
+                key,
+                encode_entry(CachedBanner.negative(status_code), 0),
+                ex=ttl,
+                nx=True,
+            )
+            for set_key in (
+                    negative_keys_key(tag_id=tag_id),
+                    negative_keys_key(feature_id=feature_id),
+            ):
+                pipe.sadd(set_key, key)
+                pipe.expire(set_key, ttl)
+        await pipe.execute()
+
+    async def invalidate_negative(
+            self,
+            redis_client,
+            tag_id: int = None,
+            feature_id: int = None,
+    ):
+        set_key = negative_keys_key(tag_id=tag_id, feature_id=feature_id)
+        keys = await redis_client.smembers(set_key)
+        await redis_client.delete(set_key, *keys)
+
+    async def invalidate(self, redis_client, pairs, banner_id: int = None):
+        keys = cache_keys(pairs)
+        if banner_id is not None:
+            keys.append(version_key(banner_id))
+        if keys:
+            await redis_client.delete(*keys)
+
+    async def invalidate_retrying(self, redis_client, pairs, banner_id: int = None):
+        """
+        Сброс ключей с повторами после неудачной записи в кеш: иначе
+        старое значение отдавалось бы до BANNER_CACHE_TTL.
+        Возвращает False, если Redis так и не ответил
+        """
+        for attempt in range(settings.BANNER_CACHE_INVALIDATE_RETRIES + 1):
+            if attempt:
+                await asyncio.sleep(settings.BANNER_CACHE_INVALIDATE_RETRY_MS / 1000)
+            try:
+                await self.invalidate(redis_client, pairs, banner_id=banner_id)
+                return True
+            except RedisError:
+                continue
+        return False
+
+    async def record_hits(self, redis_client, pairs):
+        #  Учет не должен ломать ответ, поэтому ошибки Redis пропускаются.
+        #  Наименее популярные пары сверх HITS_KEEP_FACTOR * BANNER_WARMUP_SIZE
+        #  удаляются, чтобы множество не росло без ограничений
+        pipe = redis_client.pipeline(transaction=False)
+        for tag_id, feature_id in pairs:
+            pipe.zincrby(HITS_KEY, 1, cache_key(tag_id, feature_id))
+        pipe.zremrangebyrank(
+            HITS_KEY, 0, -HITS_KEEP_FACTOR * settings.BANNER_WARMUP_SIZE - 1
+        )
+        try:
+            await pipe.execute()
+        except RedisError:
+            pass
+
+    async def hottest(self, redis_client, limit: int):
+        #  Самые запрашиваемые пары (tag_id, feature_id)
+        if limit <= 0:
+            return []
+        keys = await redis_client.zrevrange(HITS_KEY, 0, limit - 1)
+        return [tuple(map(int, key.split(b"_"))) for key in keys]
+
+    async def write_through(self, redis_client, banner, old_pairs, new_pairs):
+        """
+        Перезаписывает ключи баннера новым значением и сбрасывает ключи пар,
+        которые баннеру больше не принадлежат
+        """
+        new_pairs = set(new_pairs)
+        await self.invalidate(redis_client, set(old_pairs) - new_pairs)
+        await self.set(redis_client, CachedBanner.from_banner(banner), new_pairs)
+
+
+banner_cache = BannerCache()
@@ -0,0 +1,123 @@
+import asyncio
+import json
+import uuid
+from redis.exceptions import RedisError
+from services.banner_index import banner_index
+from services.config import settings
+from services.metrics import BANNER_INDEX_EVENTS
+
+#  Виды событий, ids -- id баннеров, тегов или фич
+REFRESH = "refresh"  # баннеры созданы или изменены
+REMOVE = "remove"  # баннеры удалены
+EVICT_TAG = "evict_tag"  # тег удален
+EVICT_FEATURE = "evict_feature"  # фича удалена или удаляются ее баннеры
+REMOVE_BY_TAG = "remove_by_tag"  # удаляются баннеры тега
+
+#  Id процесса: свои события подписчик пропускает, они уже применены
+ORIGIN = uuid.uuid4().hex
+
+
+def encode_event(kind: str, ids) -> str:
+    return json.dumps({"origin": ORIGIN, "kind": kind, "ids": list(ids)})
+
+
+async def publish_event(redis_client, kind: str, ids):
+    """
+    Сообщает остальным воркерам об изменении баннеров. Недоступность Redis
+    запрос не ломает: подписчики без соединения перестроят индекс целиком,
+    когда переподпишутся
+    """
+    if not settings.BANNER_EVENTS_ENABLED:
+        return
+    try:
+        await redis_client.publish(
+            settings.BANNER_EVENTS_CHANNEL, encode_event(kind, ids)
+        )
+    except RedisError:
+        BANNER_INDEX_EVENTS.labels(kind=kind, result="publish_error").inc()
+        return
+    BANNER_INDEX_EVENTS.labels(kind=kind, result="published").inc()
+
+
+def publish_event_sync(redis_client, kind: str, ids):
+    #  То же для задач Celery с синхронным клиентом
+    if not settings.BANNER_EVENTS_ENABLED:
+        return
+    try:
+        redis_client.publish(settings.BANNER_EVENTS_CHANNEL, encode_event(kind, ids))
+    except RedisError:
+        BANNER_INDEX_EVENTS.labels(kind=kind, result="publish_error").inc()
+        return
+    BANNER_INDEX_EVENTS.labels(kind=kind, result="published").inc()
+
+
+class BannerEventSubscriber:
+    """
+    Подписка воркера на канал событий: изменения, сделанные другими
+    воркерами, узлами и задачами Celery, применяются к in-process индексу.
+    Индекс строится после каждой (пере)подписки, поэтому события, пропущенные
+    без соединения с Redis, не оставляют в нем устаревших баннеров
+    """
+    def __init__(self):
+        self._task = None
+
+    def start(self, redis_client, session_maker):
+        self._task = asyncio.create_task(self._run(redis_client, session_maker))
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self, redis_client, session_maker):
+        while True:
+            try:
+                async with redis_client.pubsub() as pubsub:
+                    await pubsub.subscribe(settings.BANNER_EVENTS_CHANNEL)
+                    async with session_maker() as session:
+                        await banner_index.build(session=session)
+                    async for message in pubsub.listen():
+                        if message["type"] == "message":
+                            await self.apply(message["data"], session_maker)
+            except Exception:
+                #  Пока подписки нет, индекс не используется
+                banner_index.clear()
+                await asyncio.sleep(settings.BANNER_EVENTS_RETRY_SECONDS)
+
+    @staticmethod
+    async def apply(data, session_maker):
+        event = json.loads(data)
+        kind, ids = event["kind"], event["ids"]
+        if event["origin"] == ORIGIN:
+            BANNER_INDEX_EVENTS.labels(kind=kind, result="skipped").inc()
+            return
+        if kind == REFRESH:
+            try:
+                async with session_maker() as session:
+                    await banner_index.refresh(session=session, banner_ids=ids)
+            except Exception:
+                #  Бд недоступна -- баннеры убираются из индекса, и запросы
+                #  к ним идут в Redis и бд
+                banner_index.remove(banner_ids=ids)
+                BANNER_INDEX_EVENTS.labels(kind=kind, result="apply_error").inc()
+                return
+        elif kind == REMOVE:
+            banner_index.remove(banner_ids=ids)
+        elif kind == EVICT_TAG:
+            for tag_id in ids:
+                banner_index.evict_tag(tag_id=tag_id)
+        elif kind == EVICT_FEATURE:
+            for feature_id in ids:
+                banner_index.evict_feature(feature_id=feature_id)
+        elif kind == REMOVE_BY_TAG:
+            for tag_id in ids:
+                banner_index.remove_by_tag(tag_id=tag_id)
+        BANNER_INDEX_EVENTS.labels(kind=kind, result="applied").inc()
+
+
+banner_event_subscriber = BannerEventSubscriber()
@@ -0,0 +1,124 @@
+from typing import NamedTuple
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from schemas.banner import Banner, banner_lookup
+from services.banner_cache import render_banner_body
+
+
+class IndexEntry(NamedTuple):
+    banner_id: int
+    body: bytes
+    is_active: bool
+    status: int = 200
+    version: int = 0
+
+
+class BannerIndex:
+    """
+    In-process индекс баннеров по паре (feature_id, tag_id).
+    Хранит уже сериализованный ответ пользователю и is_active, поэтому
+    чтение не ходит ни в Postgres, ни в Redis.
+    Строится при старте и обновляется точечно при изменении баннеров
+    """
+    def __init__(self):
+        self.ready = False
+        self._entries: dict[tuple[int, int], IndexEntry] = {}
+        self._pairs_by_banner: dict[int, set[tuple[int, int]]] = {}
+
+    async def build(self, session: AsyncSession):
+        entries, pairs_by_banner = {}, {}
+        await self._load(session, entries, pairs_by_banner)
+        self._entries, self._pairs_by_banner = entries, pairs_by_banner
+        self.ready = True
+
+    def clear(self):
+        self._entries, self._pairs_by_banner = {}, {}
+        self.ready = False
+
+    def get(self, feature_id: int, tag_id: int):
+        return self._entries.get((feature_id, tag_id))
+
+    async def refresh(self, session: AsyncSession, banner_ids: list[int]):
+        if not self.ready:
+            return
+        entries, pairs_by_banner = {}, {}
+        await self._load(session, entries, pairs_by_banner, banner_ids)
+        #  Замена без await между удалением и вставкой: чтения не видят
+        #  баннер пропавшим на время загрузки
+        for banner_id in banner_ids:
+            self._remove(banner_id)
+        self._entries.update(entries)
+        self._pairs_by_banner.update(pairs_by_banner)
+
+    def remove(self, banner_ids: list[int]):
+        for banner_id in banner_ids:
+            self._remove(banner_id)
+
+    def evict_tag(self, tag_id: int):
+        for feature_id, entry_tag_id in list(self._entries):
+            if entry_tag_id == tag_id:
+                entry = self._entries.pop((feature_id, entry_tag_id))
+                self._pairs_by_banner.get(entry.banner_id, set()).discard(
+                    (feature_id, entry_tag_id)
+                )
+
+    def evict_feature(self, feature_id: int):
+        banner_ids = {
+            entry.banner_id
+            for (entry_feature_id, _), entry in list(self._entries.items())
+            if entry_feature_id == feature_id
+        }
+        self.remove(list(banner_ids))
+
+    def remove_by_tag(self, tag_id: int):
+        self.remove(banner_ids=list(self.banner_ids_by_tag(tag_id)))
+
+    def banner_ids_by_tag(self, tag_id: int):
+        return {
+            entry.banner_id
+            for (_, entry_tag_id), entry in list(self._entries.items())
+            if entry_tag_id == tag_id
+        }
+
+    def _remove(self, banner_id: int):
+        for pair in self._pairs_by_banner.pop(banner_id, set()):
+            self._entries.pop(pair, None)
+
+    @staticmethod
+    async def _load(
+            session: AsyncSession,
+            entries: dict,
+            pairs_by_banner: dict,
+            banner_ids: list[int] = None,
+    ):
+        query = (
+            select(
+                Banner.id,
+                Banner.feature_id,
+                Banner.content,
+                Banner.is_active,
+                Banner.version,
+                banner_lookup.c.tag_id,
+            )
+            .join(banner_lookup, banner_lookup.c.banner_id == Banner.id)
+            .order_by(Banner.id)
+        )
+        if banner_ids is not None:
+            query = query.where(Banner.id.in_(banner_ids))
+        rows = await session.stream(query.execution_options(yield_per=1000))
+        body, last_banner_id = None, None
+        async for banner_id, feature_id, content, is_active, version, tag_id in rows:
+            #  Контент рендерится один раз на баннер, а не на каждый его тег
+            if banner_id != last_banner_id:
+                body, last_banner_id = render_banner_body(content), banner_id
+            pair = (feature_id, tag_id)
+            entries[pair] = IndexEntry(
+                banner_id=banner_id,
+                body=body,
+                is_active=bool(is_active),
+                version=version,
+            )
+            pairs_by_banner.setdefault(banner_id, set()).add(pair)
+
+
+banner_index = BannerIndex()
@@ -1,36 +1,135 @@
+import time
 from celery import Celery
+from celery.signals import task_postrun, task_prerun, worker_init
+from celery.utils.log import get_task_logger
+from prometheus_client import start_http_server
+from redis.exceptions import RedisError
+from sqlalchemy import delete, select
+from sqlalchemy.orm import Session
 from services.config import settings
-from database.base import get_session
-from schemas.banner import Banner
+from services.banner_cache import cache_keys
+from services.banner_events import REMOVE, publish_event_sync
+from services.metrics import BANNER_CACHE_REQUESTS, CELERY_TASK_SECONDS
+from database.base import SyncSession
+from database.redis import sync_redis_client
+from schemas.banner import Banner, banner_lookup, banner_tag
 
 REDIS_URL = (f"redis://{settings.REDIS_HOST}:{settings.REDIS_PORT}/"
              f"{settings.REDIS_CELERY_DB}")
 
 celery = Celery('tasks', broker=REDIS_URL, backend=REDIS_URL)
+logger = get_task_logger(__name__)
 
+#  Время старта выполняющихся задач по task_id
+_task_started = {}
 
-@celery.task
-def delete_banners_by_feature(feature_id):
-    session = next(get_session())
-    banners = (
-        session.query(Banner)
-        .filter(Banner.feature_id == feature_id)
-        .all()
-    )
-    for banner in banners:
-        session.delete(banner)
-    session.commit()
-    return
-
-
-@celery.task
-def delete_banners_by_tag(tag_id):
-    session = next(get_session())
-    banners = (
-        session.query(Banner)
-        .filter(Banner.tags.any(id=tag_id))
-        .all()
-    )
-    for banner in banners:
-        session.delete(banner)
-    session.commit()
+
+@task_prerun.connect
+def start_task_timer(task_id=None, **kwargs):
+    _task_started[task_id] = time.perf_counter()
+
+
+@task_postrun.connect
+def observe_task_duration(task_id=None, task=None, state=None, **kwargs):
+    started = _task_started.pop(task_id, None)
+    if started is not None:
+        CELERY_TASK_SECONDS.labels(task=task.name, state=state).observe(
+            time.perf_counter() - started
+        )
+
+
+@worker_init.connect
+def start_metrics_server(**kwargs):
+    #  Метрики воркера отдаются его собственным http-сервером
+    if settings.CELERY_METRICS_PORT:
+        start_http_server(settings.CELERY_METRICS_PORT)
+
+
+def invalidate_cache(pairs):
+    """
+    Сбрасывает ключи пар с повторами, как BannerCache.invalidate_retrying.
+    Пачка в бд уже удалена, поэтому ошибка Redis не прерывает задачу:
+    иначе баннеры остальных пачек так и не были бы удалены
+    """
+    keys = cache_keys(pairs)
+    if not keys:
+        return True
+    for attempt in range(settings.BANNER_CACHE_INVALIDATE_RETRIES + 1):
+        if attempt:
+            time.sleep(settings.BANNER_CACHE_INVALIDATE_RETRY_MS / 1000)
+        try:
+            sync_redis_client.delete(*keys)
+            return True
+        except RedisError:
+            continue
+    BANNER_CACHE_REQUESTS.labels(layer="redis", result="error").inc()
+    logger.warning("Не удалось сбросить ключи кеша: %s", ", ".join(keys))
+    return False
+
+
+def delete_banners_in_batches(
+        session: Session,
+        banner_ids_query,
+        batch_size: int,
+        on_progress=None,
+):
+    """
+    Удаляет баннеры, id которых выбирает banner_ids_query, пачками по
+    batch_size: каждая пачка -- отдельная транзакция из DELETE ... WHERE id IN,
+    поэтому память и длина транзакции не зависят от числа баннеров
+    """
+    deleted = 0
+    while True:
+        banner_ids = session.scalars(banner_ids_query.limit(batch_size)).all()
+        if not banner_ids:
+            return deleted
+        pairs = session.execute(
+            select(banner_lookup.c.tag_id, banner_lookup.c.feature_id)
+            .where(banner_lookup.c.banner_id.in_(banner_ids))
+        ).all()
+        session.execute(
+            delete(banner_lookup).where(banner_lookup.c.banner_id.in_(banner_ids))
+        )
+        session.execute(
+            delete(banner_tag).where(banner_tag.c.banner_id.in_(banner_ids))
+        )
+        session.execute(delete(Banner).where(Banner.id.in_(banner_ids)))
+        session.commit()
+        invalidate_cache(pairs)
+        publish_event_sync(sync_redis_client, REMOVE, banner_ids)
+        deleted += len(banner_ids)
+        if on_progress:
+            on_progress(deleted)
+
+
+def report_progress(task):
+    def on_progress(deleted):
+        task.update_state(state="PROGRESS", meta={"deleted": deleted})
+    return on_progress
+
+
+@celery.task(bind=True)
+def delete_banners_by_feature(self, feature_id):
+    with SyncSession() as session:
+        deleted = delete_banners_in_batches(
+            session=session,
+            banner_ids_query=select(Banner.id).where(Banner.feature_id == feature_id),
+            batch_size=settings.CELERY_DELETE_BATCH_SIZE,
+            on_progress=report_progress(self),
+        )
+    return {"deleted": deleted}
+
+
+@celery.task(bind=True)
+def delete_banners_by_tag(self, tag_id):
+    with SyncSession() as session:
+        deleted = delete_banners_in_batches(
+            session=session,
+            banner_ids_query=(
+                select(banner_lookup.c.banner_id)
+                .where(banner_lookup.c.tag_id == tag_id)
+            ),
+            batch_size=settings.CELERY_DELETE_BATCH_SIZE,
+            on_progress=report_progress(self),
+        )
+    return {"deleted": deleted}
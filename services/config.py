@@ -7,14 +7,126 @@ class Settings:
     DB_HOST = os.getenv("DB_HOST", "localhost")
     DB_PORT = os.getenv("DB_PORT", "5432")
     DB_NAME = os.getenv("DB_NAME", "avito-test")
-    DATABASE_URL = f"postgresql://{DB_USERNAME}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+    DATABASE_URL = f"postgresql+asyncpg://{DB_USERNAME}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+    # Синхронное подключение для задач Celery
+    SYNC_DATABASE_URL = f"postgresql://{DB_USERNAME}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+    # Реплика для чтения, без DB_REPLICA_HOST все запросы идут в основную бд
+    DB_REPLICA_HOST = os.getenv("DB_REPLICA_HOST", "")
+    DB_REPLICA_PORT = os.getenv("DB_REPLICA_PORT", DB_PORT)
+    REPLICA_DATABASE_URL = (
+        f"postgresql+asyncpg://{DB_USERNAME}:{DB_PASSWORD}@{DB_REPLICA_HOST}:{DB_REPLICA_PORT}/{DB_NAME}"
+        if DB_REPLICA_HOST else ""
+    )
+    # Сколько ждать подключения к реплике и сколько после неудачи читать
+    # из основной бд (сек.)
+    DB_REPLICA_CONNECT_TIMEOUT = float(os.getenv("DB_REPLICA_CONNECT_TIMEOUT", 2))
+    DB_REPLICA_RETRY_SECONDS = float(os.getenv("DB_REPLICA_RETRY_SECONDS", 30))
+    # Пул соединений с бд, по умолчанию -- значения SQLAlchemy
+    DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))
+    DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 10))
+    # Сколько ждать свободное соединение (сек.)
+    DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 30))
+    # Пересоздавать соединения старше (сек.), -1 -- никогда
+    DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", -1))
+    # Проверять соединение перед выдачей из пула
+    DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "false").lower() == "true"
     REDIS_HOST = os.getenv("REDIS_HOST", "localhost")
     REDIS_PORT = os.getenv("REDIS_PORT", 6379)
     REDIS_CACHE_DB = os.getenv("REDIS_CACHE_DB", 0)
     REDIS_CELERY_DB = os.getenv("REDIS_CELERY_DB", 1)
 
+    # Жесткий срок жизни записи баннера в Redis (сек.)
+    BANNER_CACHE_TTL = int(os.getenv("BANNER_CACHE_TTL", 3600))
+    # Мягкий срок (сек.): после него запись отдается как есть,
+    # а баннер перезагружается в фоне
+    BANNER_CACHE_SOFT_TTL = int(os.getenv("BANNER_CACHE_SOFT_TTL", 300))
+    # Время жизни закешированных 400/404 (сек.), 0 -- не кешировать
+    BANNER_NEGATIVE_CACHE_TTL = int(os.getenv("BANNER_NEGATIVE_CACHE_TTL", 30))
+    # Если запись в кеш после изменения баннера не удалась, его ключи
+    # сбрасываются: число повторов и пауза между ними (мс)
+    BANNER_CACHE_INVALIDATE_RETRIES = int(
+        os.getenv("BANNER_CACHE_INVALIDATE_RETRIES", 3)
+    )
+    BANNER_CACHE_INVALIDATE_RETRY_MS = int(
+        os.getenv("BANNER_CACHE_INVALIDATE_RETRY_MS", 50)
+    )
+    # Окно досрочного обновления перед мягким сроком (сек.), 0 -- отключено
+    BANNER_CACHE_EARLY_REFRESH_WINDOW = int(
+        os.getenv("BANNER_CACHE_EARLY_REFRESH_WINDOW", 30)
+    )
+    # In-process индекс баннеров для /user_banner
+    BANNER_INDEX_ENABLED = os.getenv("BANNER_INDEX_ENABLED", "false").lower() == "true"
+    # Рассылка изменений баннеров через pub/sub Redis, по которой воркеры
+    # сбрасывают записи своих in-process индексов
+    BANNER_EVENTS_ENABLED = (
+        os.getenv("BANNER_EVENTS_ENABLED", "true").lower() == "true"
+    )
+    BANNER_EVENTS_CHANNEL = os.getenv("BANNER_EVENTS_CHANNEL", "banner_events")
+    # Пауза перед переподпиской после потери соединения с Redis (сек.)
+    BANNER_EVENTS_RETRY_SECONDS = float(os.getenv("BANNER_EVENTS_RETRY_SECONDS", 1))
+    # Схлопывание промахов кеша между воркерами через блокировку в Redis
+    BANNER_CACHE_LOCK_ENABLED = (
+        os.getenv("BANNER_CACHE_LOCK_ENABLED", "false").lower() == "true"
+    )
+    # Время жизни блокировки, сколько ждать чужую загрузку и как часто
+    # проверять кеш (мс)
+    BANNER_CACHE_LOCK_TTL_MS = int(os.getenv("BANNER_CACHE_LOCK_TTL_MS", 5000))
+    BANNER_CACHE_LOCK_WAIT_MS = int(os.getenv("BANNER_CACHE_LOCK_WAIT_MS", 500))
+    BANNER_CACHE_LOCK_POLL_MS = int(os.getenv("BANNER_CACHE_LOCK_POLL_MS", 20))
+    # Прогрев при старте: сколько самых запрашиваемых пар загрузить в Redis,
+    # 0 -- без прогрева и без учета запросов
+    BANNER_WARMUP_SIZE = int(os.getenv("BANNER_WARMUP_SIZE", 0))
+    # Доля запросов /user_banner, которые учитываются для прогрева
+    BANNER_HITS_SAMPLE_RATE = float(os.getenv("BANNER_HITS_SAMPLE_RATE", 0.01))
+    # /health/ready: сколько кешировать результат проверок (сек.), таймаут
+    # каждой проверки и пороги, после которых воркер не готов (мс)
+    HEALTH_CACHE_SECONDS = float(os.getenv("HEALTH_CACHE_SECONDS", 2))
+    HEALTH_TIMEOUT_MS = int(os.getenv("HEALTH_TIMEOUT_MS", 1000))
+    HEALTH_DB_CHECKOUT_MAX_MS = int(os.getenv("HEALTH_DB_CHECKOUT_MAX_MS", 500))
+    HEALTH_REDIS_MAX_LATENCY_MS = int(os.getenv("HEALTH_REDIS_MAX_LATENCY_MS", 100))
+    # Проверять при старте, что бд мигрирована до последней ревизии
+    DB_SCHEMA_CHECK = os.getenv("DB_SCHEMA_CHECK", "true").lower() == "true"
+    # Cache-Control ответа /user_banner: max-age -- остаток мягкого срока записи,
+    # но не больше BANNER_HTTP_MAX_AGE (сек.); public разрешает кешировать
+    # активные баннеры CDN, иначе только браузеру
+    BANNER_HTTP_MAX_AGE = int(os.getenv("BANNER_HTTP_MAX_AGE", 60))
+    BANNER_HTTP_CACHE_PUBLIC = (
+        os.getenv("BANNER_HTTP_CACHE_PUBLIC", "false").lower() == "true"
+    )
+    # Максимум пар в POST /user_banner/batch
+    BANNER_BATCH_MAX_SIZE = int(os.getenv("BANNER_BATCH_MAX_SIZE", 100))
+    # Размер пачки POST /banner/bulk и GET /banner/export
+    BANNER_BULK_BATCH_SIZE = int(os.getenv("BANNER_BULK_BATCH_SIZE", 1000))
+    # Максимальная длина строки NDJSON (байт) и сколько ошибок вернуть в ответе
+    BANNER_BULK_MAX_LINE = int(os.getenv("BANNER_BULK_MAX_LINE", 1024 * 1024))
+    BANNER_BULK_MAX_ERRORS = int(os.getenv("BANNER_BULK_MAX_ERRORS", 100))
+    # Размер страницы GET /banner в режиме курсора, если не задан limit
+    BANNER_PAGE_SIZE = int(os.getenv("BANNER_PAGE_SIZE", 100))
+    # Сколько последних версий баннера хранить
+    BANNER_VERSIONS_KEEP = int(os.getenv("BANNER_VERSIONS_KEEP", 10))
+    # Размер пачки при удалении баннеров по тегу или фиче в задачах Celery
+    CELERY_DELETE_BATCH_SIZE = int(os.getenv("CELERY_DELETE_BATCH_SIZE", 1000))
+
+    # Метрики Prometheus на /metrics и порт, на котором их отдает воркер
+    # Celery (0 -- не отдавать)
+    METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+    CELERY_METRICS_PORT = int(os.getenv("CELERY_METRICS_PORT", 0))
+
     SECRET_KEY = os.getenv("SECRET_KEY", default="AWESOME_SECRET_KEY")  # JWT Secret key
     ALGORITHM = "HS256"  # JWT Algorithm
 
+    # Время жизни кеша аутентифицированных пользователей (сек.), 0 -- отключен
+    USER_CACHE_TTL = int(os.getenv("USER_CACHE_TTL", 30))
+    USER_CACHE_MAX_SIZE = int(os.getenv("USER_CACHE_MAX_SIZE", 10000))
+    # Строить пользователя из claims токена, не обращаясь к бд
+    TRUST_TOKEN_CLAIMS = os.getenv("TRUST_TOKEN_CLAIMS", "false").lower() == "true"
+
+    # Стоимость bcrypt и пул потоков для хеширования паролей
+    BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", 12))
+    # 0 -- хешировать прямо в event loop
+    PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", 4))
+    # Сколько запросов может ждать свободный поток, сверх этого -- 503
+    PASSWORD_HASH_QUEUE_SIZE = int(os.getenv("PASSWORD_HASH_QUEUE_SIZE", 32))
+
 
 settings = Settings()
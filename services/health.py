@@ -0,0 +1,90 @@
+import asyncio
+import time
+from redis.exceptions import RedisError
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
+from services.config import settings
+from services.single_flight import SingleFlight
+
+
+def elapsed_ms(start: float) -> float:
+    return round((time.perf_counter() - start) * 1000, 2)
+
+
+class HealthService:
+    """
+    Проверки готовности воркера: бд, кеш Redis и брокер Celery.
+    Результат кешируется на HEALTH_CACHE_SECONDS, а одновременные пробы
+    ждут одну проверку, поэтому частые пробы не нагружают зависимости
+    """
+    def __init__(self):
+        self._result = None
+        self._checked_at = 0.0
+        self._single_flight = SingleFlight(flight="health")
+
+    async def ready(self, session: AsyncSession, redis_client, broker_client):
+        if (
+            self._result is not None
+            and time.monotonic() - self._checked_at < settings.HEALTH_CACHE_SECONDS
+        ):
+            return self._result
+        return await self._single_flight.do(
+            key="ready",
+            loader=lambda: self.__check_all(session, redis_client, broker_client),
+        )
+
+    def clear(self):
+        self._result = None
+
+    async def __check_all(self, session: AsyncSession, redis_client, broker_client):
+        db, redis, broker = await asyncio.gather(
+            self.__check(
+                self.__ping_db(session),
+                "checkout_ms",
+                settings.HEALTH_DB_CHECKOUT_MAX_MS,
+            ),
+            self.__check(
+                self.__ping_redis(redis_client),
+                "latency_ms",
+                settings.HEALTH_REDIS_MAX_LATENCY_MS,
+            ),
+            self.__check(self.__ping_redis(broker_client)),
+        )
+        checks = {"db": db, "redis": redis, "broker": broker}
+        ready = all(check["status"] == "ok" for check in checks.values())
+        self._result = {"status": "ok" if ready else "fail", "checks": checks}
+        self._checked_at = time.monotonic()
+        return self._result
+
+    @staticmethod
+    async def __check(ping, limit_key: str = None, limit_ms: int = None):
+        try:
+            result = await asyncio.wait_for(
+                ping, timeout=settings.HEALTH_TIMEOUT_MS / 1000
+            )
+        except asyncio.TimeoutError:
+            return {"status": "fail", "error": "timeout"}
+        except (RedisError, SQLAlchemyError, OSError) as error:
+            return {"status": "fail", "error": type(error).__name__}
+        if limit_key is not None and result[limit_key] > limit_ms:
+            return {**result, "status": "fail", "error": f"{limit_key} > {limit_ms}"}
+        return {**result, "status": "ok"}
+
+    @staticmethod
+    async def __ping_db(session: AsyncSession):
+        #  Время получения соединения из пула -- отдельно от самого запроса
+        start = time.perf_counter()
+        await session.connection()
+        checkout_ms = elapsed_ms(start)
+        await session.execute(text("SELECT 1"))
+        return {"checkout_ms": checkout_ms, "latency_ms": elapsed_ms(start)}
+
+    @staticmethod
+    async def __ping_redis(redis_client):
+        start = time.perf_counter()
+        await redis_client.ping()
+        return {"latency_ms": elapsed_ms(start)}
+
+
+health_service = HealthService()
@@ -0,0 +1,91 @@
+import os
+import time
+from fastapi import Response
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    REGISTRY,
+    generate_latest,
+)
+from prometheus_client import multiprocess
+
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds",
+    "Время обработки http-запроса",
+    ["method", "route", "status"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+#  layer -- index (in-process индекс) или redis,
+#  result -- hit, miss или error (Redis недоступен, запрос ушел в бд)
+BANNER_CACHE_REQUESTS = Counter(
+    "banner_cache_requests",
+    "Обращения к кешу баннеров из /user_banner",
+    ["layer", "result"],
+)
+#  result -- published, publish_error, applied, skipped (свое событие)
+#  или apply_error
+BANNER_INDEX_EVENTS = Counter(
+    "banner_index_events",
+    "События изменения баннеров для in-process индексов воркеров",
+    ["kind", "result"],
+)
+#  flight -- экземпляр SingleFlight/RedisSingleFlight (banner, banner_lock,
+#  health), result -- load (вызван loader), collapsed (получен чужой
+#  результат), acquired (взята блокировка в Redis), timeout (не дождались
+#  чужой загрузки) или error (Redis недоступен, загрузка без блокировки)
+SINGLE_FLIGHT_CALLS = Counter(
+    "single_flight_calls",
+    "Схлопывание одновременных загрузок одного ключа",
+    ["flight", "result"],
+)
+CELERY_TASK_SECONDS = Histogram(
+    "celery_task_duration_seconds",
+    "Время выполнения задачи Celery",
+    ["task", "state"],
+    buckets=(0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300),
+)
+
+
+class MetricsMiddleware:
+    """
+    Гистограмма времени ответа по шаблону маршрута (/banner/{item_id}),
+    а не по пути, чтобы число рядов не зависело от id
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status_code = 500
+        start = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = scope.get("route")
+            HTTP_REQUEST_SECONDS.labels(
+                method=scope["method"],
+                route=route.path if route is not None else "unmatched",
+                status=status_code,
+            ).observe(time.perf_counter() - start)
+
+
+def metrics_response() -> Response:
+    #  Несколько процессов (воркеры uvicorn/gunicorn) пишут метрики в общий
+    #  каталог PROMETHEUS_MULTIPROC_DIR, тогда они собираются оттуда
+    registry = REGISTRY
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return Response(content=generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
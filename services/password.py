@@ -0,0 +1,55 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import HTTPException, status
+from passlib.hash import bcrypt
+from services.config import settings
+
+
+class PasswordHasher:
+    """
+    Хеширование и проверка паролей bcrypt вне event loop, в ограниченном
+    пуле потоков (bcrypt отпускает GIL). Если пул и очередь заполнены,
+    запрос сразу получает 503, а не ждет, блокируя остальных
+    """
+    def __init__(self, workers: int, queue_size: int, rounds: int):
+        self._executor = (
+            ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+            if workers > 0 else None
+        )
+        self._limit = workers + queue_size
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._context = bcrypt.using(rounds=rounds)
+
+    async def hash(self, password: str) -> str:
+        return await self._run(self._context.hash, password)
+
+    async def verify(self, password: str, password_hash: str) -> bool:
+        return await self._run(self._context.verify, password, password_hash)
+
+    async def _run(self, func, *args):
+        #  Без пула (workers=0) хеширование выполняется прямо в event loop
+        if self._executor is None:
+            return func(*args)
+        with self._lock:
+            if self._in_flight >= self._limit:
+                raise HTTPException(
+                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                    detail="Сервис перегружен, повторите попытку позже",
+                    headers={"Retry-After": "1"},
+                )
+            self._in_flight += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, func, *args)
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+
+password_hasher = PasswordHasher(
+    workers=settings.PASSWORD_HASH_WORKERS,
+    queue_size=settings.PASSWORD_HASH_QUEUE_SIZE,
+    rounds=settings.BCRYPT_ROUNDS,
+)
@@ -0,0 +1,120 @@
+import asyncio
+import uuid
+from redis.exceptions import RedisError, WatchError
+from services.config import settings
+from services.metrics import SINGLE_FLIGHT_CALLS
+
+
+class SingleFlight:
+    """
+    Схлопывание одновременных загрузок одного ключа внутри процесса:
+    первый запрос выполняет loader, остальные ждут его результат
+    (или его исключение) вместо собственного похода в бд.
+    Счетчики -- в single_flight_calls с меткой flight
+    """
+    def __init__(self, flight: str):
+        self._calls: dict[str, asyncio.Future] = {}
+        self._loads = SINGLE_FLIGHT_CALLS.labels(flight=flight, result="load")
+        self._collapsed = SINGLE_FLIGHT_CALLS.labels(flight=flight, result="collapsed")
+
+    async def do(self, key: str, loader):
+        while True:
+            future = self._calls.get(key)
+            if future is None:
+                break
+            self._collapsed.inc()
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                #  Отменили ведущий запрос, а не нас -- загружаем сами
+                if not future.cancelled():
+                    raise
+        future = asyncio.get_running_loop().create_future()
+        self._calls[key] = future
+        self._loads.inc()
+        try:
+            result = await loader()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as exc:
+            future.set_exception(exc)
+            #  Исключение могло никому не понадобиться, не пишем об этом в лог
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            self._calls.pop(key, None)
+
+
+class RedisSingleFlight:
+    """
+    Схлопывание загрузок между воркерами через короткую блокировку в Redis.
+    Загружает тот, кто взял блокировку, остальные опрашивают fetch, пока
+    результат не появится, блокировка не будет снята или не выйдет время
+    ожидания, после чего загружают сами. Без Redis каждый загружает сам
+    """
+    def __init__(self, flight: str):
+        self._acquired = SINGLE_FLIGHT_CALLS.labels(flight=flight, result="acquired")
+        self._collapsed = SINGLE_FLIGHT_CALLS.labels(flight=flight, result="collapsed")
+        self._timeouts = SINGLE_FLIGHT_CALLS.labels(flight=flight, result="timeout")
+        self._errors = SINGLE_FLIGHT_CALLS.labels(flight=flight, result="error")
+
+    @staticmethod
+    def lock_key(key: str) -> str:
+        return f"lock:{key}"
+
+    async def do(self, redis_client, key: str, loader, fetch):
+        lock_key = self.lock_key(key)
+        token = uuid.uuid4().hex
+        try:
+            acquired = await redis_client.set(
+                lock_key, token, nx=True, px=settings.BANNER_CACHE_LOCK_TTL_MS
+            )
+        except RedisError:
+            self._errors.inc()
+            return await loader()
+        if acquired:
+            self._acquired.inc()
+            try:
+                return await loader()
+            finally:
+                await self._release(redis_client, lock_key, token)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + settings.BANNER_CACHE_LOCK_WAIT_MS / 1000
+        try:
+            while loop.time() < deadline:
+                await asyncio.sleep(settings.BANNER_CACHE_LOCK_POLL_MS / 1000)
+                result = await fetch()
+                if result is not None:
+                    self._collapsed.inc()
+                    return result
+                if not await redis_client.exists(lock_key):
+                    break
+            else:
+                self._timeouts.inc()
+        except RedisError:
+            self._errors.inc()
+        return await loader()
+
+    async def _release(self, redis_client, lock_key: str, token: str):
+        #  Снимаем только свою блокировку: она могла истечь и достаться другому.
+        #  Без Redis она истечет сама через BANNER_CACHE_LOCK_TTL_MS
+        try:
+            async with redis_client.pipeline(transaction=True) as pipe:
+                await pipe.watch(lock_key)
+                current = await pipe.get(lock_key)
+                if current is not None and current.decode() == token:
+                    pipe.multi()
+                    pipe.delete(lock_key)
+                    await pipe.execute()
+        except WatchError:
+            pass
+        except RedisError:
+            self._errors.inc()
+
+
+banner_single_flight = SingleFlight(flight="banner")
+banner_redis_single_flight = RedisSingleFlight(flight="banner_lock")
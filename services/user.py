@@ -1,7 +1,9 @@
+import time
 import jwt
 from fastapi import HTTPException, status, Depends
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from services.config import settings
 from database.base import get_session
 from schemas.user import User
@@ -11,18 +13,61 @@ from schemas.pydantic_models import UserCreate
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
 
+class UserCache:
+    """
+    Кеш аутентифицированных пользователей по username с коротким TTL,
+    чтобы не ходить в таблицу users на каждый запрос. Хранит объекты,
+    не привязанные к сессии (UserService.principal)
+    """
+    def __init__(self):
+        self._users: dict[str, tuple[float, User]] = {}
+
+    def get(self, username: str):
+        cached = self._users.get(username)
+        if cached is None:
+            return None
+        expires_at, user = cached
+        if expires_at < time.monotonic():
+            self._users.pop(username, None)
+            return None
+        return user
+
+    def set(self, username: str, user: User):
+        if settings.USER_CACHE_TTL <= 0:
+            return
+        if len(self._users) >= settings.USER_CACHE_MAX_SIZE:
+            self._evict()
+        self._users[username] = (time.monotonic() + settings.USER_CACHE_TTL, user)
+
+    def invalidate(self, username: str):
+        self._users.pop(username, None)
+
+    def clear(self):
+        self._users.clear()
+
+    def _evict(self):
+        now = time.monotonic()
+        for username, (expires_at, _) in list(self._users.items()):
+            if expires_at < now:
+                self._users.pop(username, None)
+        #  Если просроченных нет, вытесняются самые старые записи
+        while len(self._users) >= settings.USER_CACHE_MAX_SIZE:
+            self._users.pop(next(iter(self._users)))
+
+
+user_cache = UserCache()
+
+
 class UserService:
-    def create_user(
+    async def create_user(
             self,
-            session: Session,
+            session: AsyncSession,
             user: UserCreate,
             is_admin: bool = False
     ) -> User:
         try:
-            existing_user = (
-                session.query(User)
-                .filter(User.username == user.username)
-                .scalar()
+            existing_user = await session.scalar(
+                select(User).where(User.username == user.username)
             )
             if existing_user:
                 raise HTTPException(
@@ -34,12 +79,13 @@ class UserService:
                     status_code=status.HTTP_400_BAD_REQUEST,
                     detail=f"Длина пароля '{user.password}' {len(user.password)} < 8"
                 )
-            new_user = User.add(
+            new_user = await User.add(
                 session=session,
                 username=user.username,
                 password=user.password,
                 is_admin=is_admin
             )
+            user_cache.invalidate(new_user.username)
             return new_user
         except ValueError as exc:
             raise HTTPException(
@@ -47,10 +93,15 @@ class UserService:
                 detail=f"{exc}"
             ) from exc
 
-    def authenticate_user(self, session: Session, username: str, password: str) -> User:
+    async def authenticate_user(
+            self,
+            session: AsyncSession,
+            username: str,
+            password: str,
+    ) -> User:
         try:
-            user = session.query(User).filter(User.username == username).scalar()
-            if user is None or not user.verify_password(password):
+            user = await session.scalar(select(User).where(User.username == username))
+            if user is None or not await user.verify_password(password):
                 raise HTTPException(
                     status_code=status.HTTP_400_BAD_REQUEST,
                     detail="Неверное имя пользователя или пароль",
@@ -64,6 +115,7 @@ class UserService:
 
     def get_access_token(self, user: User):
         user_obj = {
+            "id": user.id,
             "username": user.username,
             "is_admin": user.is_admin,
         }
@@ -77,9 +129,9 @@ class UserService:
             "token_type": "bearer",
         }
 
-    def get_current_user(
+    async def get_current_user(
             self,
-            session: Session = Depends(get_session),
+            session: AsyncSession = Depends(get_session),
             access_token: str = Depends(oauth2_scheme)
     ):
         try:
@@ -93,16 +145,33 @@ class UserService:
                 settings.SECRET_KEY,
                 algorithms=[settings.ALGORITHM]
             )
-            user = (
-                session.query(User)
-                .filter(User.username == payload.get('username'))
-                .scalar()
+            username = payload.get('username')
+            #  В режиме доверия токену пользователь строится из его claims без бд
+            if settings.TRUST_TOKEN_CLAIMS and payload.get('id') is not None:
+                return self.principal(
+                    user_id=payload['id'],
+                    username=username,
+                    is_admin=bool(payload.get('is_admin')),
+                )
+            user = user_cache.get(username)
+            if user is not None:
+                return user
+            user = await session.scalar(
+                select(User).where(User.username == username)
             )
             if user is None:
                 raise HTTPException(
                     status_code=status.HTTP_401_UNAUTHORIZED,
                     detail="Пользователь не найден"
                 )
+            #  Кешируется копия вне сессии: сессию запроса может откатить
+            #  маршрут, и загруженный в нее объект станет недоступен
+            user = self.principal(
+                user_id=user.id,
+                username=user.username,
+                is_admin=user.is_admin,
+            )
+            user_cache.set(username, user)
             return user
         except ValueError as validation_error:
             raise HTTPException(
@@ -115,6 +184,11 @@ class UserService:
                 detail="Неверный токен"
             ) from exc
 
+    @staticmethod
+    def principal(user_id: int, username: str, is_admin: bool) -> User:
+        #  Пользователь без сессии бд: только то, что нужно маршрутам
+        return User(id=user_id, username=username, is_admin=is_admin)
+
     def check_admin(self, user: User):
         if not user.is_admin:
             raise HTTPException(
@@ -1,29 +1,58 @@
+import asyncio
+import os
+import tempfile
 import pytest
 import fakeredis
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy import create_engine
-from sqlalchemy.pool import StaticPool
+import fakeredis.aioredis
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import NullPool
 from fastapi.testclient import TestClient
-from app import app
-from database.base import get_session, Base
-from database.redis import get_redis
-from schemas.user import User
-from schemas.banner import Banner, Tag, Feature
 
+#  Минимальная стоимость bcrypt, чтобы не замедлять тесты
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
 
-DB_URL = "sqlite:///:memory:"
+from app import app  # noqa: E402
+from database.base import get_read_session, get_session, Base  # noqa: E402
+from database.instrumentation import instrument_engine  # noqa: E402
+from database.redis import get_broker_redis, get_redis  # noqa: E402
+from database.replica import RoutingSession  # noqa: E402
+from schemas.user import User  # noqa: E402
+from schemas.banner import Banner, Tag, Feature  # noqa: E402
+from services.banner_index import banner_index  # noqa: E402
+
+
+#  TestClient выполняет каждый запрос в своем event loop, поэтому бд -- файл,
+#  а соединения не переиспользуются между запросами
+DB_PATH = os.path.join(tempfile.mkdtemp(), "test.db")
+DB_URL = f"sqlite+aiosqlite:///{DB_PATH}"
 ADMIN_TOKEN = ""
 USER_TOKEN = ""
 
-engine = create_engine(
-    DB_URL,
-    connect_args={"check_same_thread": False},
-    poolclass=StaticPool,
+engine = create_async_engine(DB_URL, poolclass=NullPool)
+instrument_engine(engine)
+Session = async_sessionmaker(engine, expire_on_commit=False)
+#  Без реплики сессия для чтения ходит в ту же бд; test_replica подменяет
+#  info["replica"] второй бд SQLite
+ReadSession = async_sessionmaker(
+    engine,
+    expire_on_commit=False,
+    sync_session_class=RoutingSession,
+    info={"replica": None},
 )
-Session = sessionmaker(engine, expire_on_commit=False)
+
+
+#  Каскадное удаление по внешним ключам, как в Postgres
+@event.listens_for(engine.sync_engine, "connect")
+def enable_foreign_keys(dbapi_connection, _):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.close()
+
 
 app_client = TestClient(app)
-r = fakeredis.FakeStrictRedis()
+redis_server = fakeredis.FakeServer()
+r = fakeredis.FakeStrictRedis(server=redis_server)
 
 
 @pytest.fixture(scope="session")
@@ -41,46 +70,39 @@ def user_token():
     yield USER_TOKEN
 
 
-def create_tables():
-    global ADMIN_TOKEN, USER_TOKEN
-    Base.metadata.drop_all(bind=engine)
-    Base.metadata.create_all(bind=engine)
+async def fill_tables():
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
     session = Session()
     #  Создание админа
-    User.add(session=session, username="admin", password="admin", is_admin=True)
+    await User.add(session=session, username="admin", password="admin", is_admin=True)
     #  Создание обычного пользователя
-    User.add(session=session, username="user", password="user")
-
-    response = app_client.post(
-        "/token", data={"username": "admin", "password": "admin"}
-    )
-    ADMIN_TOKEN = response.json()["access_token"]
-    response = app_client.post("/token", data={"username": "user", "password": "user"})
-    USER_TOKEN = response.json()["access_token"]
+    await User.add(session=session, username="user", password="user")
 
     for _ in range(3):
-        tag = Tag.add(session=session)
-        feature = Feature.add(session=session)
+        tag = await Tag.add(session=session)
+        feature = await Feature.add(session=session)
         session.add(tag)
         session.add(feature)
 
-    tags = Tag.get_tags_by_id(session=session, tag_ids=[1, 3])
-    banner = Banner.add(
+    tags = await Tag.get_tags_by_id(session=session, tag_ids=[1, 3])
+    banner = await Banner.add(
         session=session,
         tags=tags,
         feature_id=1,
         content={"title": "some_title", "text": "some_text", "url": "some_url"},
     )
     session.add(banner)
-    tags = Tag.get_tags_by_id(session=session, tag_ids=[2, 3])
-    banner = Banner.add(
+    tags = await Tag.get_tags_by_id(session=session, tag_ids=[2, 3])
+    banner = await Banner.add(
         session=session,
         tags=tags,
         feature_id=2,
         content={"title": "some_title1", "text": "some_text1", "url": "some_url1"},
     )
     session.add(banner)
-    banner = Banner.add(
+    banner = await Banner.add(
         session=session,
         tags=tags,
         feature_id=3,
@@ -88,7 +110,20 @@ def create_tables():
         is_active=False,
     )
     session.add(banner)
-    session.commit()
+    await session.commit()
+    await session.close()
+
+
+def create_tables():
+    global ADMIN_TOKEN, USER_TOKEN
+    asyncio.run(fill_tables())
+
+    response = app_client.post(
+        "/token", data={"username": "admin", "password": "admin"}
+    )
+    ADMIN_TOKEN = response.json()["access_token"]
+    response = app_client.post("/token", data={"username": "user", "password": "user"})
+    USER_TOKEN = response.json()["access_token"]
 
 
 #  Очистка кеша редис
@@ -102,10 +137,14 @@ def setup():
     create_tables()
 
 
-def fake_session():
-    session = Session()
-    yield session
-    session.close()
+async def fake_session():
+    async with Session() as session:
+        yield session
+
+
+async def fake_read_session():
+    async with ReadSession() as session:
+        yield session
 
 
 #  Пересоздание бд, если проводились изменения в таблицах
@@ -115,10 +154,31 @@ def resetup():
     create_tables()
 
 
-def fake_redis():
+@pytest.fixture(scope="function")
+def redis_cache():
     yield r
-    r.close()
+
+
+#  Построение in-process индекса баннеров по текущему состоянию бд
+@pytest.fixture(scope="function")
+def memory_index():
+    async def build():
+        async with Session() as session:
+            await banner_index.build(session=session)
+
+    asyncio.run(build())
+    yield banner_index
+    banner_index.clear()
+
+
+#  Асинхронный клиент создается на каждый запрос, так как привязан к event loop
+async def fake_redis():
+    client = fakeredis.aioredis.FakeRedis(server=redis_server)
+    yield client
+    await client.aclose()
 
 
 app.dependency_overrides[get_session] = fake_session
+app.dependency_overrides[get_read_session] = fake_read_session
 app.dependency_overrides[get_redis] = fake_redis
+app.dependency_overrides[get_broker_redis] = fake_redis
@@ -1,4 +1,19 @@
+import json
+import re
+import fakeredis
+import fakeredis.aioredis
 from fastapi.testclient import TestClient
+from redis.exceptions import RedisError
+from sqlalchemy.orm import selectinload
+from database.redis import get_redis
+from schemas.banner import Banner
+from services.banner_cache import (
+    banner_cache,
+    CachedBanner,
+    encode_entry,
+    render_banner_body,
+)
+from test.conftest import Session
 
 
 def test_create_banner_by_user(client: TestClient, user_token):
@@ -32,6 +47,44 @@ def test_create_banner(client: TestClient, admin_token, resetup):
     assert response.json().get("banner_id") is not None
 
 
+def test_create_banner_with_duplicate_tags(client: TestClient, admin_token, resetup):
+    new_banner = {
+        "tag_ids": [2, 2],
+        "feature_id": 1,
+        "content": {"title": "some_title", "text": "some_text", "url": "some_url"},
+        "is_active": True
+    }
+    response = client.post(
+        "/banner",
+        headers={"Authorization": f"Bearer {admin_token}"},
+        json=new_banner
+    )
+    assert response.status_code == 201
+    patch_response = client.patch(
+        f"/banner/{response.json()['banner_id']}",
+        headers={"Authorization": f"Bearer {admin_token}"},
+        json={"tag_ids": [1, 1], "feature_id": 3}
+    )
+    assert patch_response.status_code == 200
+
+
+def test_create_and_update_banner_without_tags(
+        client: TestClient, admin_token, resetup
+):
+    response = client.post(
+        "/banner",
+        headers={"Authorization": f"Bearer {admin_token}"},
+        json={"tag_ids": [], "feature_id": 1, "content": {}, "is_active": True}
+    )
+    assert response.status_code == 201
+    patch_response = client.patch(
+        f"/banner/{response.json()['banner_id']}",
+        headers={"Authorization": f"Bearer {admin_token}"},
+        json={"feature_id": 2}
+    )
+    assert patch_response.status_code == 200
+
+
 def test_get_banners(client: TestClient, admin_token, user_token):
     response = client.get(
         "/banner",
@@ -60,6 +113,35 @@ def test_create_banner_with_non_existing_tag(client: TestClient, admin_token):
         json=new_banner
     )
     assert response.status_code == 400
+    assert response.json()["detail"] == (
+        "Некорректные данные.Один или несколько тегов отсутствуют: 4"
+    )
+
+
+def test_tags_resolved_in_one_query(client: TestClient, admin_token):
+    def queries(tag_ids):
+        response = client.post(
+            "/banner",
+            headers={"Authorization": f"Bearer {admin_token}"},
+            json={
+                "tag_ids": tag_ids,
+                "feature_id": 2,
+                "content": {},
+                "is_active": True,
+            },
+        )
+        assert response.status_code == 400
+        timing = response.headers["server-timing"]
+        return int(re.search(r'"(\d+) queries"', timing)[1])
+
+    queries([4])
+    assert queries([1, 2, 3, 4, 5, 6, 7]) == queries([4])
+    response = client.post(
+        "/banner",
+        headers={"Authorization": f"Bearer {admin_token}"},
+        json={"tag_ids": [7, 1, 5], "feature_id": 2, "content": {}, "is_active": True},
+    )
+    assert response.json()["detail"].endswith("отсутствуют: 5, 7")
 
 
 def test_create_banner_with_non_existing_feature(client: TestClient, admin_token):
@@ -163,3 +245,322 @@ def test_update_banner_by_user(client: TestClient, user_token):
         headers={"Authorization": f"Bearer {user_token}"}
     )
     assert new_banner_response.status_code == 200
+
+
+def test_delete_banner_invalidates_cache(client: TestClient, admin_token, resetup):
+    response = client.get(
+        "/user_banner?tag_id=1&feature_id=1",
+        headers={"Authorization": f"Bearer {admin_token}"}
+    )
+    assert response.status_code == 200
+    delete_response = client.delete(
+        "/banner/1",
+        headers={"Authorization": f"Bearer {admin_token}"}
+    )
+    assert delete_response.status_code == 204
+    response = client.get(
+        "/user_banner?tag_id=1&feature_id=1",
+        headers={"Authorization": f"Bearer {admin_token}"}
+    )
+    assert response.status_code == 404
+
+
+def test_update_banner_tags_invalidates_cache(
+        client: TestClient, admin_token, resetup
+):
+    response = client.get(
+        "/user_banner?tag_id=1&feature_id=1",
+        headers={"Authorization": f"Bearer {admin_token}"}
+    )
+    assert response.status_code == 200
+    patch_response = client.patch(
+        "/banner/1",
+        headers={"Authorization": f"Bearer {admin_token}"},
+        json={"tag_ids": [2]}
+    )
+    assert patch_response.status_code == 200
+    response = client.get(
+        "/user_banner?tag_id=1&feature_id=1",
+        headers={"Authorization": f"Bearer {admin_token}"}
+    )
+    assert response.status_code == 404
+    response = client.get(
+        "/user_banner?tag_id=2&feature_id=1",
+        headers={"Authorization": f"Bearer {admin_token}"}
+    )
+    assert response.status_code == 200
+
+
+def test_update_banner_when_cache_write_fails(
+        client: TestClient, admin_token, redis_cache, monkeypatch, resetup
+):
+    response = client.get(
+        "/user_banner?tag_id=1&feature_id=1",
+        headers={"Authorization": f"Bearer {admin_token}"}
+    )
+    assert response.status_code == 200
+    assert redis_cache.exists("1_1")
+
+    async def broken_set(*args, **kwargs):
+        raise RedisError
+
+    monkeypatch.setattr(banner_cache, "set", broken_set)
+    patch_response = client.patch(
+        "/banner/1",
+        headers={"Authorization": f"Bearer {admin_token}"},
+        json={"content": {"title": "new_title"}}
+    )
+    assert patch_response.status_code == 200
+    #  Новое значение не записано, но и старое не отдается до BANNER_CACHE_TTL
+    assert not redis_cache.exists("1_1")
+    assert not redis_cache.exists("banner_version:1")
+
+
+def test_delete_banner_when_redis_is_down(client: TestClient, admin_token, resetup):
+    server = fakeredis.FakeServer()
+    server.connected = False
+
+    async def broken_redis():
+        yield fakeredis.aioredis.FakeRedis(server=server)
+
+    override = client.app.dependency_overrides[get_redis]
+    client.app.dependency_overrides[get_redis] = broken_redis
+    try:
+        response = client.delete(
+            "/banner/1",
+            headers={"Authorization": f"Bearer {admin_token}"}
+        )
+    finally:
+        client.app.dependency_overrides[get_redis] = override
+    assert response.status_code == 204
+
+
+def test_create_banner_with_taken_pair(client: TestClient, admin_token):
+    new_banner = {
+        "tag_ids": [2, 3],
+        "feature_id": 1,
+        "content": {"title": "some_title"},
+        "is_active": True
+    }
+    response = client.post(
+        "/banner",
+        headers={"Authorization": f"Bearer {admin_token}"},
+        json=new_banner
+    )
+    assert response.status_code == 400
+    assert "Нарушение однозначности" in response.json()["detail"]
+
+
+def test_update_banner_with_taken_pair(client: TestClient, admin_token):
+    patch_response = client.patch(
+        "/banner/2",
+        headers={"Authorization": f"Bearer {admin_token}"},
+        json={"feature_id": 1}
+    )
+    assert patch_response.status_code == 400
+    assert "Нарушение однозначности" in patch_response.json()["detail"]
+    response = client.get(
+        "/user_banner?tag_id=2&feature_id=2&use_last_revision=true",
+        headers={"Authorization": f"Bearer {admin_token}"}
+    )
+    assert response.status_code == 200
+
+
+def test_get_banners_by_cursor(client: TestClient, admin_token):
+    headers = {"Authorization": f"Bearer {admin_token}"}
+    response = client.get("/banner?after=&limit=2&tag_id=3", headers=headers)
+    assert response.status_code == 200
+    page = response.json()
+    assert [banner["banner_id"] for banner in page["banners"]] == [1, 2]
+    assert page["next_cursor"]
+    response = client.get(
+        f"/banner?after={page['next_cursor']}&limit=2&tag_id=3", headers=headers
+    )
+    page = response.json()
+    assert [banner["banner_id"] for banner in page["banners"]] == [3]
+    assert page["next_cursor"] is None
+
+
+def test_get_banners_by_invalid_cursor(client: TestClient, admin_token):
+    headers = {"Authorization": f"Bearer {admin_token}"}
+    response = client.get("/banner?after=not-a-cursor", headers=headers)
+    assert response.status_code == 400
+    response = client.get("/banner?after=&offset=1", headers=headers)
+    assert response.status_code == 400
+
+
+def test_get_banners_stream(client: TestClient, admin_token):
+    headers = {"Authorization": f"Bearer {admin_token}"}
+    for query in ("", "?tag_id=3&limit=2", "?feature_id=2", "?tag_id=3&offset=1"):
+        expected = client.get(f"/banner{query}", headers=headers).json()
+        separator = "&" if query else "?"
+        response = client.get(f"/banner{query}{separator}stream=true", headers=headers)
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "application/json"
+        for banner in expected:
+            banner["tag_ids"].sort()
+        assert response.json() == expected
+    response = client.get("/banner?stream=true&after=", headers=headers)
+    assert response.status_code == 400
+
+
+def test_banner_versions(client: TestClient, admin_token, resetup):
+    content = {"title": "some_title", "text": "some_text", "url": "some_url"}
+    new_content = {"title": "new_title"}
+    response = client.patch(
+        "/banner/1",
+        json={"content": new_content},
+        headers={"Authorization": f"Bearer {admin_token}"},
+    )
+    assert response.status_code == 200
+    response = client.get(
+        "/banner/1/versions",
+        headers={"Authorization": f"Bearer {admin_token}"},
+    )
+    versions = response.json()
+    assert [version["version"] for version in versions] == [2, 1]
+    assert versions[0]["content"] == new_content
+    assert versions[1]["content"] == content
+    assert versions[1]["tag_ids"] == [1, 3]
+
+    response = client.post(
+        "/banner/1/versions/1/restore",
+        headers={"Authorization": f"Bearer {admin_token}"},
+    )
+    assert response.status_code == 200
+    response = client.get(
+        "/banner/1/versions?limit=1",
+        headers={"Authorization": f"Bearer {admin_token}"},
+    )
+    assert [version["version"] for version in response.json()] == [3]
+    response = client.get(
+        "/user_banner?tag_id=1&feature_id=1&use_last_revision=true",
+        headers={"Authorization": f"Bearer {admin_token}"},
+    )
+    assert response.json()["content"] == content
+
+    response = client.post(
+        "/banner/1/versions/10/restore",
+        headers={"Authorization": f"Bearer {admin_token}"},
+    )
+    assert response.status_code == 400
+
+
+def test_update_banner_concurrently(
+        client: TestClient, admin_token, monkeypatch, resetup
+):
+    update = Banner.update
+
+    async def update_after_concurrent_edit(self, session, **kwargs):
+        #  Другой запрос меняет баннер после того, как этот его прочитал
+        async with Session() as other_session:
+            banner = await other_session.get(
+                Banner, self.id, options=[selectinload(Banner.tags)]
+            )
+            await update(
+                banner,
+                session=other_session,
+                tags=[],
+                feature_id=None,
+                content={"title": "other_title"},
+                is_active=None,
+            )
+            await other_session.commit()
+        return await update(self, session=session, **kwargs)
+
+    monkeypatch.setattr(Banner, "update", update_after_concurrent_edit)
+    response = client.patch(
+        "/banner/1",
+        headers={"Authorization": f"Bearer {admin_token}"},
+        json={"content": {"title": "new_title"}}
+    )
+    assert response.status_code == 409
+
+
+def test_last_revision_served_from_cache(client: TestClient, admin_token, redis_cache):
+    content = {"title": "some_title", "text": "some_text", "url": "some_url"}
+    response = client.get(
+        "/user_banner?tag_id=1&feature_id=1&use_last_revision=true",
+        headers={"Authorization": f"Bearer {admin_token}"},
+    )
+    assert response.json()["content"] == content
+    assert redis_cache.get("banner_version:1") == b"1"
+    #  Запись текущей версии отдается из кеша без обращения к бд
+    cached = CachedBanner(
+        body=render_banner_body({"title": "cached"}),
+        is_active=True,
+        banner_id=1,
+        version=1,
+    )
+    redis_cache.set("1_1", encode_entry(cached))
+    response = client.get(
+        "/user_banner?tag_id=1&feature_id=1&use_last_revision=true",
+        headers={"Authorization": f"Bearer {admin_token}"},
+    )
+    assert response.json()["content"] == {"title": "cached"}
+    #  Запись устаревшей версии -- нет
+    redis_cache.set("banner_version:1", 2)
+    response = client.get(
+        "/user_banner?tag_id=1&feature_id=1&use_last_revision=true",
+        headers={"Authorization": f"Bearer {admin_token}"},
+    )
+    assert response.json()["content"] == content
+
+
+def test_import_and_export_banners(client: TestClient, admin_token, resetup):
+    lines = [
+        '{"tag_ids": [1], "feature_id": 3, "content": {"title": "a"}, '
+        '"is_active": true}',
+        "not json",
+        '{"tag_ids": [100], "feature_id": 3, "content": {}, "is_active": true}',
+        '{"tag_ids": [1], "feature_id": 1, "content": {}, "is_active": true}',
+        '{"tag_ids": [1], "feature_id": 3, "content": {}, "is_active": true}',
+        "",
+        '{"tag_ids": [2], "feature_id": 1, "content": {"title": "b"}, '
+        '"is_active": false}',
+    ]
+    #  Отрицательная запись кеша для пары сбрасывается импортом
+    response = client.get(
+        "/user_banner?tag_id=1&feature_id=3",
+        headers={"Authorization": f"Bearer {admin_token}"},
+    )
+    assert response.status_code == 404
+    response = client.post(
+        "/banner/bulk",
+        content="\n".join(lines).encode(),
+        headers={"Authorization": f"Bearer {admin_token}"},
+    )
+    assert response.status_code == 200
+    result = response.json()
+    assert result["created"] == 2
+    assert result["failed"] == 4
+    assert [error["line"] for error in result["errors"]] == [2, 3, 4, 5]
+    assert result["errors"][3]["detail"] == (
+        "Некорректные данные.Нарушение однозначности"
+    )
+
+    response = client.get(
+        "/user_banner?tag_id=1&feature_id=3",
+        headers={"Authorization": f"Bearer {admin_token}"},
+    )
+    assert response.json()["content"] == {"title": "a"}
+
+    response = client.get(
+        "/banner/export",
+        headers={"Authorization": f"Bearer {admin_token}"},
+    )
+    assert response.headers["content-type"] == "application/x-ndjson"
+    exported = [json.loads(line) for line in response.text.splitlines()]
+    assert [banner["banner_id"] for banner in exported] == [1, 2, 3, 4, 5]
+    assert exported[0]["tag_ids"] == [1, 3]
+    assert exported[4]["tag_ids"] == [2]
+    assert exported[4]["is_active"] is False
+
+
+def test_import_banners_by_user(client: TestClient, user_token):
+    response = client.post(
+        "/banner/bulk",
+        content=b"",
+        headers={"Authorization": f"Bearer {user_token}"},
+    )
+    assert response.status_code == 403
@@ -0,0 +1,61 @@
+from fastapi.testclient import TestClient
+from services.config import settings
+from services.password import password_hasher
+from services.user import user_cache
+
+
+def test_current_user_is_cached(client: TestClient, user_token):
+    user_cache.clear()
+    response = client.get(
+        "/users/me",
+        headers={"Authorization": f"Bearer {user_token}"},
+    )
+    assert response.status_code == 200
+    assert user_cache.get("user").id == response.json()["id"]
+
+
+def test_cached_user_survives_rollback(client: TestClient, admin_token):
+    #  Пользователь загружается в сессию запроса, которая затем откатывается
+    user_cache.clear()
+    headers = {"Authorization": f"Bearer {admin_token}"}
+    response = client.post(
+        "/banner",
+        headers=headers,
+        json={"tag_ids": [2, 3], "feature_id": 1, "content": {}, "is_active": True},
+    )
+    assert response.status_code == 400
+    response = client.get("/banner", headers=headers)
+    assert response.status_code == 200
+
+
+def test_trust_token_claims(client: TestClient, user_token, monkeypatch):
+    monkeypatch.setattr(settings, "TRUST_TOKEN_CLAIMS", True)
+    user_cache.clear()
+    response = client.get(
+        "/users/me",
+        headers={"Authorization": f"Bearer {user_token}"},
+    )
+    assert response.status_code == 200
+    assert response.json()["username"] == "user"
+    #  Пользователь построен из токена, в бд и кеш не ходили
+    assert user_cache.get("user") is None
+    response = client.get(
+        "/banner",
+        headers={"Authorization": f"Bearer {user_token}"},
+    )
+    assert response.status_code == 403
+
+
+def test_invalid_token(client: TestClient):
+    response = client.get(
+        "/users/me",
+        headers={"Authorization": "Bearer invalid"},
+    )
+    assert response.status_code == 401
+
+
+def test_token_when_password_pool_is_full(client: TestClient, monkeypatch):
+    monkeypatch.setattr(password_hasher, "_limit", 0)
+    response = client.post("/token", data={"username": "user", "password": "user"})
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
@@ -0,0 +1,120 @@
+import asyncio
+import json
+import fakeredis.aioredis
+from sqlalchemy import update
+from schemas.banner import Banner
+from services import banner as banner_module
+from services.banner_events import (
+    EVICT_FEATURE,
+    EVICT_TAG,
+    REFRESH,
+    REMOVE,
+    REMOVE_BY_TAG,
+    BannerEventSubscriber,
+    publish_event,
+)
+from services.banner_index import banner_index
+from services.config import settings
+from test.conftest import Session, redis_server
+
+
+def remote_event(kind, ids):
+    #  Событие другого воркера или задачи Celery
+    return json.dumps({"origin": "other", "kind": kind, "ids": ids})
+
+
+async def wait_for(condition, timeout=2):
+    async with asyncio.timeout(timeout):
+        while not condition():
+            await asyncio.sleep(0.005)
+
+
+def run_with_subscriber(scenario):
+    async def run():
+        client = fakeredis.aioredis.FakeRedis(server=redis_server)
+        subscriber = BannerEventSubscriber()
+        subscriber.start(client, Session)
+        try:
+            #  Индекс строится после подписки
+            await wait_for(lambda: banner_index.ready)
+            await scenario(client)
+        finally:
+            await subscriber.stop()
+            await client.aclose()
+            banner_index.clear()
+
+    asyncio.run(run())
+
+
+def test_subscriber_applies_remote_events(redis_cache):
+    channel = settings.BANNER_EVENTS_CHANNEL
+
+    async def scenario(client):
+        assert banner_index.get(feature_id=1, tag_id=1) is not None
+        await client.publish(channel, remote_event(REMOVE, [1]))
+        await wait_for(lambda: banner_index.get(feature_id=1, tag_id=1) is None)
+        assert banner_index.get(feature_id=1, tag_id=3) is None
+
+        #  Синхронный клиент, как в задачах Celery
+        redis_cache.publish(channel, remote_event(EVICT_TAG, [2]))
+        await wait_for(lambda: banner_index.get(feature_id=2, tag_id=2) is None)
+        assert banner_index.get(feature_id=2, tag_id=3) is not None
+
+        await client.publish(channel, remote_event(REMOVE_BY_TAG, [3]))
+        await wait_for(lambda: banner_index.get(feature_id=2, tag_id=3) is None)
+
+    run_with_subscriber(scenario)
+
+
+def test_subscriber_skips_own_events(redis_cache):
+    async def scenario(client):
+        await publish_event(client, REMOVE, [2])
+        await client.publish(
+            settings.BANNER_EVENTS_CHANNEL, remote_event(REMOVE, [1])
+        )
+        await wait_for(lambda: banner_index.get(feature_id=1, tag_id=1) is None)
+        #  Свое событие уже применено локально и повторно не обрабатывается
+        assert banner_index.get(feature_id=2, tag_id=2) is not None
+
+    run_with_subscriber(scenario)
+
+
+def test_subscriber_refreshes_changed_banner(redis_cache, resetup):
+    async def scenario(client):
+        async with Session() as session:
+            await session.execute(
+                update(Banner).where(Banner.id == 1).values(content={"title": "new"})
+            )
+            await session.commit()
+        await client.publish(
+            settings.BANNER_EVENTS_CHANNEL, remote_event(REFRESH, [1])
+        )
+        await wait_for(
+            lambda: banner_index.get(feature_id=1, tag_id=1).body
+            == b'{"content":{"title":"new"}}'
+        )
+
+    run_with_subscriber(scenario)
+
+
+def test_delete_by_tag_or_feature_publishes_events(
+    client, admin_token, redis_cache, monkeypatch
+):
+    #  Сами баннеры удаляет задача Celery, здесь проверяются только события
+    for task in (banner_module.delete_banners_by_tag,
+                 banner_module.delete_banners_by_feature):
+        monkeypatch.setattr(task, "delay", lambda item_id: None)
+    pubsub = redis_cache.pubsub()
+    pubsub.subscribe(settings.BANNER_EVENTS_CHANNEL)
+    pubsub.get_message(timeout=1)
+    for query in ("tag_id=3", "feature_id=2"):
+        response = client.delete(
+            f"/banner/delete?{query}",
+            headers={"Authorization": f"Bearer {admin_token}"},
+        )
+        assert response.status_code == 204
+    events = [json.loads(pubsub.get_message(timeout=1)["data"]) for _ in range(2)]
+    assert [(event["kind"], event["ids"]) for event in events] == [
+        (REMOVE_BY_TAG, [3]), (EVICT_FEATURE, [2])
+    ]
+    pubsub.close()
@@ -0,0 +1,83 @@
+import json
+from redis.exceptions import RedisError
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import sessionmaker
+from schemas.banner import Banner, banner_lookup
+from services import celery_tasks
+from services.banner_events import REMOVE
+from services.config import settings
+from test.conftest import DB_PATH
+
+
+def test_delete_banners_in_batches(
+    client, admin_token, redis_cache, monkeypatch, resetup
+):
+    monkeypatch.setattr(celery_tasks, "sync_redis_client", redis_cache)
+    response = client.get(
+        "/user_banner?tag_id=3&feature_id=2",
+        headers={"Authorization": f"Bearer {admin_token}"},
+    )
+    assert response.status_code == 200
+    assert redis_cache.exists("3_2")
+    pubsub = redis_cache.pubsub()
+    pubsub.subscribe(settings.BANNER_EVENTS_CHANNEL)
+    pubsub.get_message(timeout=1)
+
+    engine = create_engine(f"sqlite:///{DB_PATH}")
+    progress = []
+    with sessionmaker(engine)() as session:
+        deleted = celery_tasks.delete_banners_in_batches(
+            session=session,
+            banner_ids_query=(
+                select(banner_lookup.c.banner_id).where(banner_lookup.c.tag_id == 3)
+            ),
+            batch_size=2,
+            on_progress=progress.append,
+        )
+        assert session.scalars(select(Banner.id)).all() == []
+        assert session.execute(select(banner_lookup)).all() == []
+    engine.dispose()
+    assert deleted == 3
+    assert progress == [2, 3]
+    assert not redis_cache.exists("3_2")
+    #  Воркеры узнают об удалении каждой пачки
+    events = [json.loads(pubsub.get_message(timeout=1)["data"]) for _ in range(2)]
+    assert [event["kind"] for event in events] == [REMOVE, REMOVE]
+    assert sorted(sum((event["ids"] for event in events), [])) == [1, 2, 3]
+    pubsub.close()
+
+
+class FailingDelete:
+    #  Redis, в котором сброс ключей не проходит
+    def __init__(self, client):
+        self.client = client
+        self.deletes = 0
+
+    def delete(self, *keys):
+        self.deletes += 1
+        raise RedisError
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+
+def test_delete_banners_when_cache_invalidation_fails(
+    redis_cache, monkeypatch, resetup
+):
+    redis_client = FailingDelete(redis_cache)
+    monkeypatch.setattr(celery_tasks, "sync_redis_client", redis_client)
+    monkeypatch.setattr(settings, "BANNER_CACHE_INVALIDATE_RETRY_MS", 0)
+    engine = create_engine(f"sqlite:///{DB_PATH}")
+    with sessionmaker(engine)() as session:
+        deleted = celery_tasks.delete_banners_in_batches(
+            session=session,
+            banner_ids_query=(
+                select(banner_lookup.c.banner_id).where(banner_lookup.c.tag_id == 3)
+            ),
+            batch_size=2,
+        )
+        #  Ошибка Redis на первой пачке не остановила удаление второй
+        assert session.scalars(select(Banner.id)).all() == []
+    engine.dispose()
+    assert deleted == 3
+    assert redis_client.deletes == 2 * (settings.BANNER_CACHE_INVALIDATE_RETRIES + 1)
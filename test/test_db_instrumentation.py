@@ -0,0 +1,42 @@
+import re
+from prometheus_client import REGISTRY
+from sqlalchemy import create_engine, text
+from database.instrumentation import TimedQueuePool, instrument_engine
+
+
+def test_request_db_stats(client, admin_token):
+    response = client.get(
+        "/user_banner?tag_id=1&feature_id=1&use_last_revision=true",
+        headers={"Authorization": f"Bearer {admin_token}"},
+    )
+    assert response.status_code == 200
+    timing = response.headers["server-timing"]
+    assert timing.startswith("db;dur=")
+    #  Тег, фича и баннер, плюс пользователь, если его нет в кеше
+    assert int(re.search(r'"(\d+) queries"', timing)[1]) >= 3
+
+
+def test_pool_metrics():
+    engine = create_engine(
+        "sqlite://",
+        poolclass=TimedQueuePool,
+        pool_size=2,
+        max_overflow=1,
+        pool_logging_name="pool_test",
+    )
+    instrument_engine(engine)
+    labels = {"pool": "pool_test"}
+    with engine.connect() as conn:
+        conn.execute(text("select 1"))
+        assert REGISTRY.get_sample_value("db_pool_checked_out", labels) == 1
+    assert REGISTRY.get_sample_value("db_pool_checked_out", labels) == 0
+    assert REGISTRY.get_sample_value("db_pool_size", labels) == 2
+    assert REGISTRY.get_sample_value(
+        "db_pool_checkout_wait_seconds_count", labels
+    ) == 1
+    connections = [engine.connect() for _ in range(3)]
+    assert REGISTRY.get_sample_value("db_pool_overflow", labels) == 1
+    for conn in connections:
+        conn.close()
+    assert REGISTRY.get_sample_value("db_pool_overflow", labels) == 0
+    assert REGISTRY.get_sample_value("db_pool_checked_out", labels) == 0
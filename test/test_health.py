@@ -0,0 +1,59 @@
+import fakeredis
+import fakeredis.aioredis
+import pytest
+from app import app
+from database.redis import get_redis
+from services.config import settings
+from services.health import health_service
+
+
+@pytest.fixture(scope="function", autouse=True)
+def fresh_health():
+    health_service.clear()
+    yield
+    health_service.clear()
+
+
+def test_live(client):
+    response = client.get("/health/live")
+    assert response.status_code == 200
+    assert response.json() == {"status": "ok"}
+
+
+def test_ready(client):
+    response = client.get("/health/ready")
+    assert response.status_code == 200
+    result = response.json()
+    assert result["status"] == "ok"
+    assert set(result["checks"]) == {"db", "redis", "broker"}
+    assert result["checks"]["db"]["checkout_ms"] >= 0
+    assert result["checks"]["redis"]["latency_ms"] >= 0
+
+
+def test_ready_fails_when_redis_is_down(client, monkeypatch):
+    assert client.get("/health/ready").status_code == 200
+    server = fakeredis.FakeServer()
+    server.connected = False
+
+    async def broken_redis():
+        client = fakeredis.aioredis.FakeRedis(server=server)
+        yield client
+        await client.aclose()
+
+    monkeypatch.setitem(app.dependency_overrides, get_redis, broken_redis)
+    #  Пока результат в кеше, зависимости не проверяются
+    assert client.get("/health/ready").status_code == 200
+    health_service.clear()
+    response = client.get("/health/ready")
+    assert response.status_code == 503
+    assert response.json()["checks"]["redis"] == {
+        "status": "fail", "error": "ConnectionError"
+    }
+    assert response.json()["checks"]["db"]["status"] == "ok"
+
+
+def test_ready_fails_over_threshold(client, monkeypatch):
+    monkeypatch.setattr(settings, "HEALTH_REDIS_MAX_LATENCY_MS", -1)
+    response = client.get("/health/ready")
+    assert response.status_code == 503
+    assert response.json()["checks"]["redis"]["error"] == "latency_ms > -1"
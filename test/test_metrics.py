@@ -0,0 +1,74 @@
+import fakeredis
+import fakeredis.aioredis
+from prometheus_client import REGISTRY
+from database.redis import get_redis
+from services import celery_tasks
+
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+def test_metrics_endpoint(client, user_token):
+    hits = sample("banner_cache_requests_total", layer="redis", result="hit")
+    for _ in range(2):
+        response = client.get(
+            "/user_banner?tag_id=1&feature_id=1",
+            headers={"Authorization": f"Bearer {user_token}"},
+        )
+        assert response.status_code == 200
+    assert sample(
+        "banner_cache_requests_total", layer="redis", result="hit"
+    ) == hits + 1
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert (
+        'http_request_duration_seconds_count{method="GET",route="/user_banner",'
+        'status="200"}' in response.text
+    )
+    assert "db_request_queries_count" in response.text
+
+
+def test_redis_error_falls_back_to_db(client, user_token):
+    server = fakeredis.FakeServer()
+    server.connected = False
+
+    async def broken_redis():
+        yield fakeredis.aioredis.FakeRedis(server=server)
+
+    errors = sample("banner_cache_requests_total", layer="redis", result="error")
+    override = client.app.dependency_overrides[get_redis]
+    client.app.dependency_overrides[get_redis] = broken_redis
+    try:
+        response = client.get(
+            "/user_banner?tag_id=1&feature_id=1",
+            headers={"Authorization": f"Bearer {user_token}"},
+        )
+        batch_response = client.post(
+            "/user_banner/batch",
+            json={"items": [
+                {"tag_id": 1, "feature_id": 1},
+                {"tag_id": 100, "feature_id": 1},
+            ]},
+            headers={"Authorization": f"Bearer {user_token}"},
+        )
+    finally:
+        client.app.dependency_overrides[get_redis] = override
+    assert response.status_code == 200
+    assert batch_response.status_code == 200
+    assert [
+        result["status"] for result in batch_response.json()["results"]
+    ] == [200, 400]
+    assert sample(
+        "banner_cache_requests_total", layer="redis", result="error"
+    ) > errors
+
+
+def test_celery_task_duration():
+    labels = {"task": celery_tasks.delete_banners_by_tag.name, "state": "SUCCESS"}
+    count = sample("celery_task_duration_seconds_count", **labels)
+    celery_tasks.start_task_timer(task_id="task")
+    celery_tasks.observe_task_duration(
+        task_id="task", task=celery_tasks.delete_banners_by_tag, state="SUCCESS"
+    )
+    assert sample("celery_task_duration_seconds_count", **labels) == count + 1
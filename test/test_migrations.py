@@ -0,0 +1,78 @@
+import asyncio
+import os
+import tempfile
+import pytest
+from alembic import command
+from alembic.autogenerate import compare_metadata
+from alembic.config import Config
+from alembic.runtime.migration import MigrationContext
+from sqlalchemy import create_engine, text
+from sqlalchemy.ext.asyncio import create_async_engine
+from database.base import ALEMBIC_INI, Base, check_schema
+
+
+def alembic_config(db_path):
+    config = Config(ALEMBIC_INI)
+    config.set_main_option("sqlalchemy.url", f"sqlite:///{db_path}")
+    config.attributes["configure_logger"] = False
+    return config
+
+
+def schema_check(db_path):
+    async def check():
+        engine = create_async_engine(f"sqlite+aiosqlite:///{db_path}")
+        try:
+            await check_schema(engine)
+        finally:
+            await engine.dispose()
+
+    asyncio.run(check())
+
+
+def test_migrations_match_models():
+    db_path = os.path.join(tempfile.mkdtemp(), "migrations.db")
+    config = alembic_config(db_path)
+    with pytest.raises(RuntimeError):
+        schema_check(db_path)
+
+    command.upgrade(config, "head")
+    schema_check(db_path)
+    engine = create_engine(f"sqlite:///{db_path}")
+    with engine.connect() as conn:
+        #  Миграции не отстают от моделей
+        assert compare_metadata(MigrationContext.configure(conn), Base.metadata) == []
+    engine.dispose()
+
+    command.downgrade(config, "base")
+    with pytest.raises(RuntimeError):
+        schema_check(db_path)
+
+
+def test_upgrade_from_initial_schema():
+    #  Бд прежних версий сервиса: схема 0001 с данными
+    db_path = os.path.join(tempfile.mkdtemp(), "migrations.db")
+    config = alembic_config(db_path)
+    command.upgrade(config, "0001")
+    engine = create_engine(f"sqlite:///{db_path}")
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO features (id) VALUES (1)"))
+        conn.execute(text("INSERT INTO tags (id) VALUES (1), (2)"))
+        conn.execute(text("INSERT INTO banners (id, feature_id) VALUES (1, 1), (2, 1)"))
+        conn.execute(text(
+            "INSERT INTO banner_tag (banner_id, tag_id) "
+            "VALUES (1, 1), (1, 1), (2, 1), (2, 2), (NULL, 2)"
+        ))
+
+    command.upgrade(config, "head")
+    schema_check(db_path)
+    with engine.connect() as conn:
+        assert conn.execute(
+            text("SELECT banner_id, tag_id FROM banner_tag ORDER BY 1, 2")
+        ).all() == [(1, 1), (2, 1), (2, 2)]
+        assert conn.execute(
+            text("SELECT feature_id, tag_id, banner_id FROM banner_lookup ORDER BY 2")
+        ).all() == [(1, 1, 1), (1, 2, 2)]
+        assert conn.execute(
+            text("SELECT id, version FROM banners ORDER BY id")
+        ).all() == [(1, 1), (2, 1)]
+    engine.dispose()
@@ -0,0 +1,80 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import pytest
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import NullPool
+from app import app
+from database.base import get_read_session
+from database.replica import Replica, RoutingSession
+from test.conftest import DB_PATH, engine
+
+
+def read_session_with_replica(replica_url):
+    replica = Replica(
+        create_async_engine(replica_url, poolclass=NullPool),
+        retry_seconds=30,
+    )
+    read_session = async_sessionmaker(
+        engine,
+        expire_on_commit=False,
+        sync_session_class=RoutingSession,
+        info={"replica": replica},
+    )
+
+    async def get_replica_session():
+        async with read_session() as session:
+            yield session
+
+    app.dependency_overrides[get_read_session] = get_replica_session
+    return replica
+
+
+@pytest.fixture(scope="function")
+def replica():
+    #  Реплика -- копия тестовой бд, отстающая от нее: другой контент баннера 1
+    #  и нет тега 3
+    replica_path = os.path.join(tempfile.mkdtemp(), "replica.db")
+    shutil.copy(DB_PATH, replica_path)
+    with sqlite3.connect(replica_path) as conn:
+        conn.execute(
+            "UPDATE banners SET content = ? WHERE id = 1", ('{"title": "replica"}',)
+        )
+        conn.execute("DELETE FROM tags WHERE id = 3")
+    override = app.dependency_overrides[get_read_session]
+    yield read_session_with_replica(f"sqlite+aiosqlite:///{replica_path}")
+    app.dependency_overrides[get_read_session] = override
+
+
+def get_banner(client, token, use_last_revision=False):
+    return client.get(
+        "/user_banner?tag_id=1&feature_id=1"
+        f"&use_last_revision={str(use_last_revision).lower()}",
+        headers={"Authorization": f"Bearer {token}"},
+    ).json()
+
+
+def test_reads_go_to_replica(client, user_token, replica):
+    assert get_banner(client, user_token) == {"content": {"title": "replica"}}
+    assert [tag["id"] for tag in client.get("/tags").json()["tags"]] == [1, 2]
+
+
+def test_fresh_reads_go_to_primary(client, admin_token, user_token, replica):
+    assert get_banner(client, user_token, use_last_revision=True)["content"][
+        "title"
+    ] == "some_title"
+    assert get_banner(client, admin_token)["content"]["title"] == "some_title"
+
+
+def test_failover_to_primary(client, user_token):
+    override = app.dependency_overrides[get_read_session]
+    missing_dir = os.path.join(tempfile.mkdtemp(), "missing")
+    replica = read_session_with_replica(
+        f"sqlite+aiosqlite:///{missing_dir}/replica.db"
+    )
+    try:
+        assert get_banner(client, user_token)["content"]["title"] == "some_title"
+        assert not replica.available
+    finally:
+        app.dependency_overrides[get_read_session] = override
@@ -0,0 +1,126 @@
+import asyncio
+import fakeredis
+import fakeredis.aioredis
+import pytest
+from prometheus_client import REGISTRY
+from services.config import settings
+from services.single_flight import SingleFlight, RedisSingleFlight
+from test.conftest import redis_server
+
+
+def calls(flight: str, result: str):
+    return REGISTRY.get_sample_value(
+        "single_flight_calls_total", {"flight": flight, "result": result}
+    ) or 0
+
+
+def test_single_flight_collapses_concurrent_loads():
+    single_flight = SingleFlight(flight="test_collapse")
+    loads = []
+
+    async def loader():
+        loads.append(1)
+        await asyncio.sleep(0.01)
+        return "banner"
+
+    async def run():
+        return await asyncio.gather(
+            *(single_flight.do(key="1_1", loader=loader) for _ in range(10))
+        )
+
+    before = calls("test_collapse", "load"), calls("test_collapse", "collapsed")
+    assert asyncio.run(run()) == ["banner"] * 10
+    assert len(loads) == 1
+    assert calls("test_collapse", "load") == before[0] + 1
+    assert calls("test_collapse", "collapsed") == before[1] + 9
+
+
+def test_single_flight_shares_exception():
+    single_flight = SingleFlight(flight="test_exception")
+
+    async def loader():
+        await asyncio.sleep(0.01)
+        raise LookupError("1_1")
+
+    async def run():
+        return await asyncio.gather(
+            *(single_flight.do(key="1_1", loader=loader) for _ in range(3)),
+            return_exceptions=True,
+        )
+
+    before = calls("test_exception", "load")
+    results = asyncio.run(run())
+    assert all(isinstance(result, LookupError) for result in results)
+    assert calls("test_exception", "load") == before + 1
+
+
+def test_redis_single_flight_waits_for_lock_owner():
+    single_flight = RedisSingleFlight(flight="test_lock")
+    loads = []
+
+    async def run():
+        redis_client = fakeredis.aioredis.FakeRedis(server=redis_server)
+
+        async def loader():
+            loads.append(1)
+            await asyncio.sleep(0.05)
+            await redis_client.set("1_1", b"banner")
+            return b"banner"
+
+        async def fetch():
+            return await redis_client.get("1_1")
+
+        results = await asyncio.gather(*(
+            single_flight.do(
+                redis_client=redis_client, key="1_1", loader=loader, fetch=fetch
+            )
+            for _ in range(5)
+        ))
+        assert not await redis_client.exists(single_flight.lock_key("1_1"))
+        await redis_client.aclose()
+        return results
+
+    before = calls("test_lock", "acquired"), calls("test_lock", "collapsed")
+    assert asyncio.run(run()) == [b"banner"] * 5
+    assert len(loads) == 1
+    assert calls("test_lock", "acquired") == before[0] + 1
+    assert calls("test_lock", "collapsed") == before[1] + 4
+
+
+def test_redis_single_flight_loads_when_redis_is_down():
+    single_flight = RedisSingleFlight(flight="test_lock_error")
+    server = fakeredis.FakeServer()
+    server.connected = False
+
+    async def loader():
+        return b"banner"
+
+    async def fetch():
+        return None
+
+    async def run():
+        redis_client = fakeredis.aioredis.FakeRedis(server=server)
+        return await single_flight.do(
+            redis_client=redis_client, key="1_1", loader=loader, fetch=fetch
+        )
+
+    before = calls("test_lock_error", "error")
+    assert asyncio.run(run()) == b"banner"
+    assert calls("test_lock_error", "error") == before + 1
+
+
+@pytest.mark.parametrize("lock_enabled", [False, True])
+def test_get_user_banner_with_coalescing(
+    client, user_token, monkeypatch, lock_enabled
+):
+    monkeypatch.setattr(settings, "BANNER_CACHE_LOCK_ENABLED", lock_enabled)
+    response = client.get(
+        "/user_banner?tag_id=1&feature_id=1",
+        headers={"Authorization": f"Bearer {user_token}"},
+    )
+    assert response.status_code == 200
+    response = client.get(
+        "/user_banner?tag_id=2&feature_id=1",
+        headers={"Authorization": f"Bearer {user_token}"},
+    )
+    assert response.status_code == 404
@@ -1,5 +1,22 @@
+import asyncio
+import pickle
+import time
+import fakeredis.aioredis
 import pytest
 from fastapi.testclient import TestClient
+from routing.banner import banner_service
+from services.banner_cache import (
+    CACHE_SCHEMA_VERSION,
+    HITS_KEEP_FACTOR,
+    banner_cache,
+    CachedBanner,
+    decode_entry,
+    encode_entry,
+    etag_matches,
+    render_banner_body,
+)
+from services.config import settings
+from test.conftest import Session, redis_server
 
 
 @pytest.mark.parametrize(
@@ -111,11 +128,12 @@ def test_cache(client: TestClient, user_token, admin_token, resetup):
         headers={"Authorization": f"Bearer {admin_token}"},
     )
     assert response.status_code == 200
+    #  Кеш перезаписывается при изменении баннера
     response = client.get(
         f"/user_banner?tag_id={tag_id}&feature_id={feature_id}",
         headers={"Authorization": f"Bearer {user_token}"},
     )
-    assert response.json()["content"] == content
+    assert response.json()["content"] == new_content["content"]
     response = client.get(
         f"/user_banner?tag_id={tag_id}&feature_id={feature_id}&use_last_revision=true",
         headers={"Authorization": f"Bearer {user_token}"},
@@ -143,3 +161,286 @@ def test_non_active_banner(client: TestClient, user_token, admin_token):
     )
     assert user_response.status_code == 403
     assert admin_response.json()["content"] == content
+
+
+def test_banner_index(
+    client: TestClient, user_token, admin_token, memory_index, resetup
+):
+    content = {"title": "some_title", "text": "some_text", "url": "some_url"}
+    assert memory_index.get(feature_id=1, tag_id=1) is not None
+    response = client.get(
+        "/user_banner?tag_id=1&feature_id=1",
+        headers={"Authorization": f"Bearer {user_token}"},
+    )
+    assert response.json()["content"] == content
+    response = client.get(
+        "/user_banner?tag_id=2&feature_id=3",
+        headers={"Authorization": f"Bearer {user_token}"},
+    )
+    assert response.status_code == 403
+    #  Индекс обновляется при изменении баннера
+    new_content = {"title": "index_title"}
+    response = client.patch(
+        "/banner/1",
+        json={"content": new_content, "tag_ids": [2]},
+        headers={"Authorization": f"Bearer {admin_token}"},
+    )
+    assert response.status_code == 200
+    assert memory_index.get(feature_id=1, tag_id=1) is None
+    response = client.get(
+        "/user_banner?tag_id=2&feature_id=1",
+        headers={"Authorization": f"Bearer {user_token}"},
+    )
+    assert response.json()["content"] == new_content
+    response = client.delete(
+        "/banner/1",
+        headers={"Authorization": f"Bearer {admin_token}"},
+    )
+    assert response.status_code == 204
+    assert memory_index.get(feature_id=1, tag_id=2) is None
+
+
+def test_cache_ignores_unknown_format(client: TestClient, user_token, redis_cache):
+    content = {"title": "some_title", "text": "some_text", "url": "some_url"}
+    redis_cache.set("1_1", pickle.dumps({"content": {"title": "stale"}}))
+    response = client.get(
+        "/user_banner?tag_id=1&feature_id=1",
+        headers={"Authorization": f"Bearer {user_token}"},
+    )
+    assert response.json()["content"] == content
+    assert redis_cache.get("1_1")[0] == CACHE_SCHEMA_VERSION
+
+
+def test_get_user_banners_batch(client: TestClient, user_token, redis_cache):
+    content = {"title": "some_title", "text": "some_text", "url": "some_url"}
+    items = [
+        {"tag_id": 1, "feature_id": 1},
+        {"tag_id": 2, "feature_id": 3},
+        {"tag_id": 2, "feature_id": 1},
+        {"tag_id": 100, "feature_id": 1},
+        {"tag_id": 1, "feature_id": 1},
+    ]
+    response = client.post(
+        "/user_banner/batch",
+        json={"items": items},
+        headers={"Authorization": f"Bearer {user_token}"},
+    )
+    assert response.status_code == 200
+    results = response.json()["results"]
+    assert [result["status"] for result in results] == [200, 403, 404, 400, 200]
+    assert results[0] == {
+        "tag_id": 1, "feature_id": 1, "status": 200, "content": content
+    }
+    assert results[4] == results[0]
+    #  Найденные баннеры кладутся в кеш по тем же ключам, что и GET /user_banner
+    assert redis_cache.get("1_1")[0] == CACHE_SCHEMA_VERSION
+    response = client.get(
+        "/user_banner?tag_id=1&feature_id=1",
+        headers={"Authorization": f"Bearer {user_token}"},
+    )
+    assert response.json()["content"] == content
+
+
+def test_get_user_banners_batch_last_revision(
+        client: TestClient, user_token, redis_cache
+):
+    content = {"title": "some_title1", "text": "some_text1", "url": "some_url1"}
+    for banner_id, pair in [(1, "1_1"), (2, "2_2")]:
+        redis_cache.set(pair, encode_entry(CachedBanner(
+            body=render_banner_body({"title": "cached"}),
+            is_active=True,
+            banner_id=banner_id,
+            version=1,
+        )))
+    redis_cache.set("banner_version:1", 1)
+    redis_cache.set("banner_version:2", 2)
+    response = client.post(
+        "/user_banner/batch",
+        json={
+            "items": [{"tag_id": 1, "feature_id": 1}, {"tag_id": 2, "feature_id": 2}],
+            "use_last_revision": True,
+        },
+        headers={"Authorization": f"Bearer {user_token}"},
+    )
+    results = response.json()["results"]
+    #  Запись текущей версии -- из кеша, устаревшей -- из бд
+    assert results[0]["content"] == {"title": "cached"}
+    assert results[1]["content"] == content
+
+
+def test_get_user_banners_batch_too_large(client: TestClient, user_token):
+    response = client.post(
+        "/user_banner/batch",
+        json={"items": [{"tag_id": i, "feature_id": 1} for i in range(1000)]},
+        headers={"Authorization": f"Bearer {user_token}"},
+    )
+    assert response.status_code == 400
+
+
+def test_stale_entry_is_served_and_refreshed(
+    client: TestClient, user_token, redis_cache
+):
+    content = {"title": "some_title", "text": "some_text", "url": "some_url"}
+    stale = CachedBanner(body=render_banner_body({"title": "stale"}), is_active=True)
+    redis_cache.set("1_1", encode_entry(stale, soft_expires_at=time.time() - 1))
+    response = client.get(
+        "/user_banner?tag_id=1&feature_id=1",
+        headers={"Authorization": f"Bearer {user_token}"},
+    )
+    #  Устаревшая запись отдается сразу, а перезагружается после ответа
+    assert response.json()["content"] == {"title": "stale"}
+    assert response.headers["cache-control"] == "private, max-age=0"
+    entry = decode_entry(redis_cache.get("1_1"))
+    assert entry.body == render_banner_body(content)
+    assert entry.soft_expires_at > time.time()
+    response = client.get(
+        "/user_banner?tag_id=1&feature_id=1",
+        headers={"Authorization": f"Bearer {user_token}"},
+    )
+    assert response.json()["content"] == content
+
+
+def test_negative_cache(
+    client: TestClient, user_token, admin_token, redis_cache, resetup
+):
+    response = client.get(
+        "/user_banner?tag_id=2&feature_id=1",
+        headers={"Authorization": f"Bearer {user_token}"},
+    )
+    assert response.status_code == 404
+    assert decode_entry(redis_cache.get("2_1")).status == 404
+    response = client.get(
+        "/user_banner?tag_id=4&feature_id=1",
+        headers={"Authorization": f"Bearer {user_token}"},
+    )
+    assert response.status_code == 400
+    assert decode_entry(redis_cache.get("4_1")).status == 400
+    #  Повторный запрос отдается из кеша с тем же ответом
+    response = client.get(
+        "/user_banner?tag_id=4&feature_id=1",
+        headers={"Authorization": f"Bearer {user_token}"},
+    )
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Некорректные данные."
+    #  Появление тега сбрасывает его отрицательные записи
+    response = client.post("/tag", headers={"Authorization": f"Bearer {admin_token}"})
+    assert response.json()["id"] == 4
+    assert not redis_cache.exists("4_1")
+    response = client.get(
+        "/user_banner?tag_id=4&feature_id=1",
+        headers={"Authorization": f"Bearer {user_token}"},
+    )
+    assert response.status_code == 404
+    #  Созданный баннер перезаписывает отрицательную запись
+    content = {"title": "new_title"}
+    response = client.post(
+        "/banner",
+        json={
+            "tag_ids": [2, 4], "feature_id": 1, "content": content, "is_active": True
+        },
+        headers={"Authorization": f"Bearer {admin_token}"},
+    )
+    assert response.status_code == 201
+    for tag_id in (2, 4):
+        response = client.get(
+            f"/user_banner?tag_id={tag_id}&feature_id=1",
+            headers={"Authorization": f"Bearer {user_token}"},
+        )
+        assert response.json()["content"] == content
+
+
+def test_warm_up(client: TestClient, user_token, redis_cache, monkeypatch):
+    monkeypatch.setattr(settings, "BANNER_WARMUP_SIZE", 10)
+    monkeypatch.setattr(settings, "BANNER_HITS_SAMPLE_RATE", 1)
+    headers = {"Authorization": f"Bearer {user_token}"}
+    for tag_id, feature_id in [(1, 1), (2, 2), (1, 1)]:
+        response = client.get(
+            f"/user_banner?tag_id={tag_id}&feature_id={feature_id}", headers=headers
+        )
+        assert response.status_code == 200
+    #  Несуществующие пары не учитываются
+    response = client.get("/user_banner?tag_id=100&feature_id=1", headers=headers)
+    assert response.status_code == 400
+    response = client.post(
+        "/user_banner/batch",
+        json={"items": [{"tag_id": 100, "feature_id": 2}]},
+        headers=headers,
+    )
+    assert response.json()["results"][0]["status"] == 400
+    assert redis_cache.zrevrange("banner_hits", 0, -1) == [b"1_1", b"2_2"]
+    redis_cache.delete("1_1", "2_2")
+
+    async def warm_up():
+        async with Session() as session:
+            redis_client = fakeredis.aioredis.FakeRedis(server=redis_server)
+            loaded = await banner_service.warm_up(
+                session=session, redis_client=redis_client
+            )
+            await redis_client.aclose()
+        return loaded
+
+    assert asyncio.run(warm_up()) == 2
+    assert redis_cache.exists("1_1", "2_2") == 2
+
+
+def test_hits_are_capped(redis_cache, monkeypatch):
+    monkeypatch.setattr(settings, "BANNER_WARMUP_SIZE", 1)
+
+    async def record():
+        redis_client = fakeredis.aioredis.FakeRedis(server=redis_server)
+        await banner_cache.record_hits(redis_client, [(1, 1)])
+        await banner_cache.record_hits(
+            redis_client, [(1, 1)] + [(tag_id, 2) for tag_id in range(10)]
+        )
+        await redis_client.aclose()
+
+    asyncio.run(record())
+    assert redis_cache.zcard("banner_hits") == HITS_KEEP_FACTOR
+    assert redis_cache.zrevrange("banner_hits", 0, 0) == [b"1_1"]
+
+
+def test_conditional_get(
+    client: TestClient, user_token, admin_token, memory_index, resetup
+):
+    url = "/user_banner?tag_id=1&feature_id=1"
+    headers = {"Authorization": f"Bearer {user_token}"}
+    #  Из индекса, из Redis и из бд -- один и тот же ETag
+    response = client.get(url, headers=headers)
+    assert response.headers["etag"] == '"1.1"'
+    assert response.headers["cache-control"] == "private, max-age=60"
+    memory_index.clear()
+    for _ in range(2):
+        response = client.get(url, headers={**headers, "If-None-Match": '"1.1"'})
+        assert response.status_code == 304
+        assert response.content == b""
+        assert response.headers["etag"] == '"1.1"'
+
+    response = client.patch(
+        "/banner/1",
+        headers={"Authorization": f"Bearer {admin_token}"},
+        json={"content": {"title": "new_title"}},
+    )
+    assert response.status_code == 200
+    response = client.get(url, headers={**headers, "If-None-Match": '"1.1"'})
+    assert response.status_code == 200
+    assert response.headers["etag"] == '"1.2"'
+    assert response.json() == {"content": {"title": "new_title"}}
+
+    response = client.get(
+        url + "&use_last_revision=true",
+        headers={**headers, "If-None-Match": 'W/"1.2"'},
+    )
+    assert response.status_code == 304
+    assert response.headers["cache-control"] == "private, no-cache"
+    response = client.get(
+        "/user_banner?tag_id=2&feature_id=3",
+        headers={"Authorization": f"Bearer {admin_token}"},
+    )
+    assert response.headers["cache-control"] == "private, no-cache"
+
+
+def test_etag_matches():
+    assert etag_matches('"1.2"', '"1.2"')
+    assert etag_matches('"1.1", W/"1.2"', '"1.2"')
+    assert etag_matches("*", '"1.2"')
+    assert not etag_matches('"1.1"', '"1.2"')